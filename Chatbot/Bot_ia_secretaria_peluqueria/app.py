@@ -15,10 +15,10 @@ import hmac
 import logging
 import os
 import json
+import threading
 import time as _time
 from zoneinfo import ZoneInfo
 
-import requests
 import sentry_sdk
 import unicodedata
 from hashlib import sha256
@@ -27,30 +27,36 @@ from datetime import datetime, timezone, timedelta, date
 from typing import Any, Optional
 
 import openai
-from flask import Flask, request, jsonify
+from flask import Flask, request, jsonify, g
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
-from requests.exceptions import ReadTimeout
 from sqlalchemy.orm import selectinload
 
-from Bot_ia_secretaria_peluqueria.peluqueros_utils import get_active_peluqueros
 # --- Dominio ---
-from models import Reserva, Peluqueria
+from models import Reserva
 from interpretador_ia import interpreta_ia, interpreta_telefono, interpreta_hora, interpreta_fecha
+from intent_rules import IntentClassifier
+from hora_es import parse_hora
+from faq_cache import faq
 from bd_utils import (
     guardar_reserva_db,
     cancelar_reserva_db, set_event_id_db
 )
-from reserva_utils import horas_disponibles, formatea_fecha_es, horas_disponibles_para_peluquero
+from reserva_utils import horas_disponibles, formatea_fecha_es, horas_disponibles_para_peluquero, peluqueros_libres_por_hora
 from google_calendar_utils import (
-    cancelar_reserva_google, crear_reserva_google_idempotente,
+    cancelar_reserva_google, crear_reserva_google_idempotente, list_event_ranges_for_days,
 )
 from db import SessionLocal
 from settings import settings
-from storage import get_storage
+from storage import get_storage, ADMIT as STORAGE_ADMIT
+import redis_conn
 from routers.health import bp as health_bp
+from tenant_registry import tenants, active_peluqueros
 from time_utils import now_local
-from concurrent.futures import ThreadPoolExecutor
+from session_executor import KeyedExecutor
+from graph_client import graph
+from calendar_mirror import mirror
+from calendar_watch import watcher
 
 
 # ================================================
@@ -63,6 +69,7 @@ limiter = Limiter(
     get_remote_address,
     app=app,
     storage_uri=settings.REDIS_URL,
+    storage_options=redis_conn.limiter_storage_options(settings.REDIS_URL),
     default_limits=[],
 )
 
@@ -88,8 +95,12 @@ app.config["MAX_CONTENT_LENGTH"] = 2 * 1024 * 1024  # Tamaño de petición: 2 MB
 
 storage = get_storage(settings)
 
-# Ejecuta el loopback al core fuera del hilo del webhook para no bloquear WhatsApp.
-CORE_EXECUTOR = ThreadPoolExecutor(max_workers=2)
+# Ejecuta el core fuera del hilo del webhook para no bloquear WhatsApp.
+# Los mensajes de una misma sesión se procesan en orden; cola acotada por peluquería.
+CORE_EXECUTOR = KeyedExecutor(
+    max_workers=settings.CORE_WORKERS,
+    max_pending_per_tenant=settings.CORE_MAX_PENDING_PER_PELU,
+)
 
 @app.errorhandler(429)
 def handle_rate_limit(_):
@@ -184,7 +195,6 @@ def idem_set(key: str, status: int, json_body: dict) -> None:
 # ================================================
 AM_WORDS = {"am", "mañana", "de la mañana", "por la mañana", "mñna", "mañna", "mñn"}
 PM_WORDS = {"pm", "tarde", "noche", "de la tarde", "por la tarde", "de la noche"}
-MIN_WORDS = {"cinco": 5, "diez": 10, "quince": 15, "veinte": 20, "veinticinco": 25, "cuarto": 15, "media": 30}
 
 DIAS_EN_ES = {
     "monday": "lunes", "tuesday": "martes", "wednesday": "miércoles",
@@ -227,6 +237,12 @@ _INTENT_MAP = {
     "consulta": "duda",
 }
 
+# Clasificador local (reglas ponderadas) antes de interpreta_ia; sí/no y comandos no son intención
+INTENT_CLF = IntentClassifier(
+    frases=_INTENT_MAP,
+    neutras=AFFIRM_WORDS | DENIAL_WORDS | CMD_MENU | CMD_RESET | CMD_SALIR | CMD_VOLVER,
+)
+
 # ================================================
 # Helpers varios
 # ================================================
@@ -311,53 +327,12 @@ def _suggestions(horas_libres: list[str], ref: str, motivo: str, n: int = 4) ->
         return {"ok": False, "sugerencias": horas_libres[:n], "motivo": motivo or "Esa hora no está disponible."}
 
 
-def _parse_ambiguous_text(texto: str):
-    """Parsea horas '12h' ambiguas en español ('y cuarto', 'menos', etc.)."""
-    t = (texto or "").lower().strip()
-    if _has_am_pm(t):
-        return None
-    m = re.search(
-        r"\b(?:a\s+las?\s+|las?\s+)?(\d{1,2})\s*menos\s*(\d{1,2}|media|cuarto|veinticinco|veinte|quince|diez|cinco)\b", t
-    )
-    if m:
-        h = int(m.group(1))
-        if 1 <= h <= 12:
-            part = m.group(2)
-            sub = int(part) if part.isdigit() else MIN_WORDS[part]
-            if 1 <= sub <= 59:
-                minutes = (60 - sub) % 60
-                h = 12 if h == 1 else h - 1
-                return h, minutes
-    m = re.search(
-        r"\b(?:a\s+las?\s+|las?\s+)?(\d{1,2})\s*y\s*(\d{1,2}|media|cuarto|veinticinco|veinte|quince|diez|cinco)\b", t
-    )
-    if m:
-        h = int(m.group(1))
-        if 1 <= h <= 12:
-            part = m.group(2)
-            minutes = int(part) if part.isdigit() else MIN_WORDS[part]
-            if 0 <= minutes <= 59:
-                return h, minutes
-    m = re.search(r"\b(?:a\s+las?\s+|las?\s+)?(\d{1,2})\s*[:h.]\s*(\d{1,2})\b", t)
-    if m:
-        h = int(m.group(1))
-        mm = int(m.group(2))
-        if 1 <= h <= 12 and 0 <= mm <= 59:
-            return h, mm
-    m = re.search(r"\b(?:a\s+las?\s+|las?\s+)?(\d{1,2})\b", t)
-    if m:
-        h = int(m.group(1))
-        if 1 <= h <= 12:
-            return h, 0
-    return None
-
-
 def normaliza_hora_ia(mensaje: str):
     """Normaliza una entrada natural a una hora en 24h, detectando ambigüedad AM/PM."""
-    amb_guess = _parse_ambiguous_text(mensaje)
-    if amb_guess:
-        h, m = amb_guess
-        return {"h": 12 if h == 12 else h, "m": m, "clue": None, "ambigua": True}
+    local = parse_hora(mensaje)
+    if local:
+        return local
+    # Solo lo que la gramática local no reconoce llega a la IA
     try:
         ai = interpreta_hora(mensaje)
     except Exception as ex:
@@ -508,6 +483,33 @@ def get_servicio_from_datos(pelu, datos: dict):
     return next((s for s in pelu.servicios if s.id == sid), None)
 
 
+def autoasigna_peluquero(pelu, datos: dict) -> tuple[Optional[int], Optional[str]]:
+    """
+    'Sin preferencia' con selección de peluquero activa: (id, nombre) del primer peluquero activo
+    libre a datos['hora'], con UNA carga de las reservas del día para todos (peluqueros_libres_por_hora).
+    (None, None) si ya hay peluquero elegido, no aplica o nadie está libre (reserva sin peluquero, como antes).
+    """
+    if datos.get("peluquero_id") or not getattr(pelu, "enable_peluquero_selection", True):
+        return None, None
+    activos = active_peluqueros(pelu)
+    if not activos:
+        return None, None
+    try:
+        with SessionLocal() as db:
+            libres = peluqueros_libres_por_hora(
+                db, pelu, get_servicio_from_datos(pelu, datos), datos["fecha"],
+                peluquero_ids=[p.id for p in activos],
+            )
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        return None, None
+    ids = libres.get(datos.get("hora")) or []
+    if not ids:
+        return None, None
+    sel = next(p for p in activos if p.id == ids[0])
+    return sel.id, getattr(sel, "nombre", None)
+
+
 def ymd_str(posible_fecha: Any) -> Optional[str]:
     if posible_fecha is None:
         return None
@@ -520,32 +522,91 @@ def ymd_str(posible_fecha: Any) -> Optional[str]:
         return str(posible_fecha)
 
 
-def guardar_estado(session_id: str, estado: dict) -> None:
-    storage.setex(f"state:{session_id}", json.dumps(estado, ensure_ascii=False), ttl=60 * 60 * 5)
+# Estado de conversación: documento JSON versionado ('_v') en state:{session_id}
+# - guardar_estado con un estado leído (lleva '_v') hace compare-and-set: si otro turno lo cambió
+#   entretanto, no se pisa y se marca el conflicto; procesar_mensaje lo convierte en una respuesta de error
+#   salvo que el turno ya haya confirmado una reserva/cancelación en BD (_efecto_confirmado)
+# - Escribir lo mismo que se leyó/escribió en este turno solo renueva el TTL (EXPIRE)
+ESTADO_TTL = 60 * 60 * 5
+_estado_tls = threading.local()
+
+
+def _estado_body(estado: dict) -> str:
+    return json.dumps({k: v for k, v in estado.items() if k != "_v"}, ensure_ascii=False)
+
+
+def _estado_visto(session_id: str, version: int, body: str) -> None:
+    _estado_tls.last = (session_id, version, body)
+
+
+def guardar_estado(session_id: str, estado: dict) -> bool:
+    body = _estado_body(estado)
+    expected = estado.get("_v")
+    last = getattr(_estado_tls, "last", None)
+    if expected is not None and last and last[0] == session_id:
+        if last[1] == expected and last[2] == body:
+            storage.expire(f"state:{session_id}", ESTADO_TTL)  # sin cambios: solo sigue viva la sesión
+            return True
+        if last[1] > expected:
+            expected = last[1]  # lo escribió este mismo turno después de leerlo
+    new_v = storage.set_versioned(f"state:{session_id}", body, ttl=ESTADO_TTL, expected=expected)
+    if new_v is None:
+        logging.warning("Estado de %s modificado por otro turno: no se sobrescribe", session_id)
+        sentry_sdk.capture_message(f"estado_conflict session={session_id}")
+        _estado_tls.conflicto = True
+        return False
+    if "_v" in estado:
+        estado["_v"] = new_v
+    _estado_visto(session_id, new_v, body)
+    return True
+
+
+def _efecto_confirmado() -> None:
+    """El turno ya dejó una reserva/cancelación en BD: su respuesta no se sustituye por la de conflicto."""
+    _estado_tls.efecto = True
+
+
+def _guardar_estado_tras_commit(session_id: str, estado: dict) -> None:
+    # Tras confirmar en BD el paso siguiente es este sí o sí: escritura sin CAS (sin '_v')
+    guardar_estado(session_id, {k: v for k, v in estado.items() if k != "_v"})
+
+
+def actualizar_estado(session_id: str, **campos) -> Optional[dict]:
+    """Actualiza solo esos campos sobre la última versión guardada (CAS con reintentos)."""
+    conflicto_previo = getattr(_estado_tls, "conflicto", False)
+    for _ in range(3):
+        estado = cargar_estado(session_id) or {"paso": "inicio", "datos": {}, "tipo_accion": None, "_v": 0}
+        estado.update(campos)
+        if guardar_estado(session_id, estado):
+            _estado_tls.conflicto = conflicto_previo  # el reintento lo resolvió
+            return estado
+    return None
 
 
 def cargar_estado(session_id: str) -> Optional[dict]:
-    raw = storage.get(f"state:{session_id}")
+    return _parse_estado(storage.get(f"state:{session_id}"), session_id)
+
+
+def _parse_estado(raw: Optional[str], session_id: Optional[str] = None) -> Optional[dict]:
     if not raw:
         return None
     try:
-        return json.loads(raw)
+        estado = json.loads(raw)
     except Exception as e:
         sentry_sdk.capture_exception(e)
         return None
+    if not isinstance(estado, dict):
+        return None
+    # estados previos al versionado (sin '_v') cuentan como versión 0
+    estado.setdefault("_v", 0)
+    if session_id:
+        _estado_visto(session_id, estado["_v"], _estado_body(estado))
+    return estado
 
 
-def get_peluqueria_by_api_key(api_key: str) -> Optional[Peluqueria]:
-    db = SessionLocal()
-    try:
-        return (
-            db.query(Peluqueria)
-            .options(selectinload(Peluqueria.servicios))
-            .filter_by(api_key=api_key)
-            .first()
-        )
-    finally:
-        db.close()
+def get_peluqueria_by_api_key(api_key: str):
+    # Snapshot de solo lectura desde el registro en proceso (sin ir a BD mientras no caduque)
+    return tenants.get_by_api_key(api_key)
 
 
 def _resumen_cancelacion_y_set_paso(pelu, estado, datos, session_id):
@@ -684,7 +745,7 @@ def _norm_min(s: str) -> str:
 def intencion_desde_texto_o_ia(mensaje: str, pelu, origin: str = "text") -> str | None:
     """
     1) Si el texto coincide con un botón o sinónimo claro → intención directa.
-    2) Solo llama a interpreta_ia si el origen es texto libre.
+    2) Texto libre: clasificador por reglas; solo si la confianza es baja se llama a interpreta_ia.
     """
     t = _norm_min(mensaje)
 
@@ -695,11 +756,23 @@ def intencion_desde_texto_o_ia(mensaje: str, pelu, origin: str = "text") -> str
         return _INTENT_MAP[t]
     if origin != "text":
         return _INTENT_MAP.get(t)  # o None
+
+    local, conf = INTENT_CLF.clasificar(mensaje)
+    if conf >= settings.INTENT_LOCAL_MIN_CONFIDENCE:
+        logging.info("intent fuente=reglas intent=%s conf=%.2f", local, conf)
+        return local
     try:
-        return interpreta_ia(mensaje, "intencion", pelu)
+        ia = interpreta_ia(mensaje, "intencion", pelu)
     except Exception as e:
         sentry_sdk.capture_exception(e)
         return None
+    # Acuerdo reglas/IA en los casos dudosos: sirve para ajustar pesos y umbral
+    ia_norm = (ia or "").strip().lower()
+    logging.info(
+        "intent fuente=ia intent=%s local=%s conf=%.2f acuerdo=%s",
+        ia_norm, local, conf, int(local is not None and local == ia_norm),
+    )
+    return ia
 
 
 def welcome_text(pelu_nombre: str, tipo_negocio: str) -> str:
@@ -722,29 +795,47 @@ def reset_estado(session_id: str):
 def purge_horas_cache(pelu, fecha_str: str):
     """Invalidar todas las combinaciones de servicio para (pelu, fecha)."""
     try:
-        # Borramos claves para cada servicio y también el caso None
-        for s in (pelu.servicios or []):
-            storage.delete(get_horas_cache_key(pelu.id, getattr(s, "id", None), fecha_str))
-        storage.delete(get_horas_cache_key(pelu.id, None, fecha_str))
+        # Borramos claves para cada servicio y también el caso None (un solo DEL)
+        keys = [get_horas_cache_key(pelu.id, getattr(s, "id", None), fecha_str) for s in (pelu.servicios or [])]
+        keys.append(get_horas_cache_key(pelu.id, None, fecha_str))
+        storage.delete_many(keys)
     except Exception as e:
         sentry_sdk.capture_exception(e)
 
 def get_horas_cache_key(pelu_id, servicio_id, fecha):
     return f"horas:{pelu_id}:{servicio_id or 'None'}:{fecha}"
 
-def horas_disponibles_cached(db, pelu, servicio, fecha):
-    key = get_horas_cache_key(pelu.id, getattr(servicio, "id", None), fecha)
-    cached = storage.get(key)
+def _horas_cache_get(pelu, servicio, fecha):
+    cached = storage.get(get_horas_cache_key(pelu.id, getattr(servicio, "id", None), fecha))
     if cached:
         try:
             return json.loads(cached)
         except Exception as e:
             sentry_sdk.capture_exception(e)
-            pass
-    horas = horas_disponibles(db, pelu, servicio, fecha)
-    storage.setex(key, json.dumps(horas, ensure_ascii=False), ttl=120)  # 2 min
+    return None
+
+def horas_disponibles_cached(db, pelu, servicio, fecha, busy_ranges=None):
+    key = get_horas_cache_key(pelu.id, getattr(servicio, "id", None), fecha)
+    cached = _horas_cache_get(pelu, servicio, fecha)
+    if cached is not None:
+        return cached
+    if busy_ranges is None:
+        horas = horas_disponibles(db, pelu, servicio, fecha)
+    else:
+        horas = horas_disponibles(db, pelu, servicio, fecha, busy_ranges=busy_ranges)
+    storage.setex(key, json.dumps(horas, ensure_ascii=False), ttl=_horas_cache_ttl(pelu))
     return horas
 
+def _horas_cache_ttl(pelu) -> int:
+    # Con canal push activo los cambios hechos en Calendar purgan la caché (/webhook/gcal):
+    # el TTL solo es una red de seguridad y puede ser de horas.
+    try:
+        if watcher.is_watched(pelu.id):
+            return int(settings.HORAS_CACHE_TTL_PUSH_SECONDS)
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+    return int(settings.HORAS_CACHE_TTL_SECONDS)
+
 def _fecha_fuera_de_rango(fecha_date, pelu) -> tuple[bool, date]:
     """
     Devuelve (fuera_de_rango, limite_incluido).
@@ -824,16 +915,34 @@ def _filtra_horas_por_horario_json(horas_list, fecha_obj, horario_json):
         # si algo falla, no rompas el flujo
         return horas_list
 
+# Días de Calendar que se leen por consulta al buscar próximas fechas con hueco
+VENTANA_DISPONIBILIDAD_DIAS = 14
+
 def _proximas_fechas_con_hueco(pelu, servicio, fecha_inicio_date, max_items=5, peluquero_id=None) -> list[str]:
     """
     Devuelve hasta 'max_items' fechas (formateadas dd/mm/YYYY) posteriores a 'fecha_inicio_date'
     que tengan al menos una hora disponible. Si 'peluquero_id' está presente, filtra por ese profesional.
     Aplica los mismos filtros que usas en el flujo: 'filtra_horas_desde_ahora' y '_filtra_horas_por_horario_json'.
+
+    La ocupación de Calendar se lee por ventanas de VENTANA_DISPONIBILIDAD_DIAS días
+    (una consulta paginada por ventana, no una por día) y solo si hace falta: se para
+    en cuanto hay 'max_items' fechas.
     """
     sugeridas: list[str] = []
-    now = now_local(pelu)
-    hoy = now.date()
     max_dias = int(getattr(pelu, "max_avance_dias", 150) or 150)
+    ventana: dict = {}
+
+    def _busy(f):
+        # None => Calendar falló en bloque; horas_disponibles* consultará ese día suelto
+        if f not in ventana:
+            restantes = max_dias - (f - fecha_inicio_date).days + 1
+            dias = max(1, min(VENTANA_DISPONIBILIDAD_DIAS, restantes))
+            por_dia = list_event_ranges_for_days(pelu, f, dias)
+            ventana.clear()
+            for i in range(dias):
+                d = f + timedelta(days=i)
+                ventana[d] = None if por_dia is None else por_dia.get(d, [])
+        return ventana[f]
 
     with SessionLocal() as db:
         for delta in range(1, max_dias + 1):
@@ -844,9 +953,11 @@ def _proximas_fechas_con_hueco(pelu, servicio, fecha_inicio_date, max_items=5, p
 
             # Horas “brutas” (según haya peluquero o no)
             if peluquero_id:
-                horas = horas_disponibles_para_peluquero(db, pelu, servicio, peluquero_id, f_str)
+                horas = horas_disponibles_para_peluquero(db, pelu, servicio, peluquero_id, f_str, busy_ranges=_busy(f))
             else:
-                horas = horas_disponibles_cached(db, pelu, servicio, f_str)
+                horas = _horas_cache_get(pelu, servicio, f_str)
+                if horas is None:
+                    horas = horas_disponibles_cached(db, pelu, servicio, f_str, busy_ranges=_busy(f))
 
             # Mismos filtros que en el flujo
             try:
@@ -915,7 +1026,6 @@ def wa_send_text(phone_number_id: str, to: str, body: str, session_id: Optional[
         return False
     if not _wa_outbound_allow(phone_number_id):
         return {"ok": False, "error": "wa_outbound_rate_limited"}
-    url = f"https://graph.facebook.com/{graph_ver}/{phone_number_id}/messages"
     normalized_session = _wa_normalize_session_id(session_id, to)
     payload = {
         "messaging_product": "whatsapp",
@@ -925,7 +1035,7 @@ def wa_send_text(phone_number_id: str, to: str, body: str, session_id: Optional[
     }
     headers = _wa_headers(token, normalized_session, payload)
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=10)
+        r = graph.post_message(phone_number_id, payload, token=token, graph_ver=graph_ver, headers=headers)
         if not r.ok:
             logging.warning(f"WA send failed {r.status_code}: {r.text[:200]}")
         return r.ok
@@ -982,16 +1092,7 @@ def _wa_headers(token: str, session_id: str, payload: dict) -> dict:
 
 
 def get_peluqueria_by_wa_phone_number_id(phone_number_id: str):
-    db = SessionLocal()
-    try:
-        return (
-            db.query(Peluqueria)
-            .options(selectinload(Peluqueria.servicios))
-            .filter_by(wa_phone_number_id=phone_number_id)
-            .first()
-        )
-    finally:
-        db.close()
+    return tenants.get_by_wa_phone_number_id(phone_number_id)
 
 
 def wa_send_main_menu(phone_number_id: str, to: str, pelu_nombre: str, session_id: Optional[str] = None) -> bool:
@@ -999,7 +1100,6 @@ def wa_send_main_menu(phone_number_id: str, to: str, pelu_nombre: str, session_i
     if not token:
         logging.error("WABA_TOKEN no configurado para %s", phone_number_id)
         return False
-    url = f"https://graph.facebook.com/{graph_ver}/{phone_number_id}/messages"
     normalized_session = _wa_normalize_session_id(session_id, to)
     if not _wa_outbound_allow(phone_number_id):
         return False
@@ -1022,7 +1122,7 @@ def wa_send_main_menu(phone_number_id: str, to: str, pelu_nombre: str, session_i
     }
     headers = _wa_headers(token, normalized_session, payload)
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=10)
+        r = graph.post_message(phone_number_id, payload, token=token, graph_ver=graph_ver, headers=headers)
         if r.ok:
             return True
         else:
@@ -1128,12 +1228,7 @@ def wa_send_service_list(
 
     headers = _wa_headers(token, normalized_session, payload)
     try:
-        r = requests.post(
-            f"https://graph.facebook.com/{graph_ver}/{phone_number_id}/messages",
-            headers=headers,
-            json=payload,
-            timeout=10
-        )
+        r = graph.post_message(phone_number_id, payload, token=token, graph_ver=graph_ver, headers=headers)
         if r.ok:
             return True
 
@@ -1159,8 +1254,7 @@ def wa_send_peluquero_list(
     page: int = 1,
     per_page: int = 10,
 ) -> bool:
-    with SessionLocal() as db:
-        activos = get_active_peluqueros(db, peluqueria_id=peluqueria.id)
+    activos = active_peluqueros(peluqueria)
 
     if not activos:  # nada que listar
         return False
@@ -1249,10 +1343,7 @@ def wa_send_peluquero_list(
 
     headers = _wa_headers(token, normalized_session, payload)
     try:
-        r = requests.post(
-            f"https://graph.facebook.com/{graph_ver}/{phone_number_id}/messages",
-            headers=headers, json=payload, timeout=10
-        )
+        r = graph.post_message(phone_number_id, payload, token=token, graph_ver=graph_ver, headers=headers)
         if r.ok:
             return True
         logging.warning(f"WA send peluquero list failed {r.status_code}: {r.text[:200]}")
@@ -1343,12 +1434,7 @@ def wa_send_hours_page(phone_number_id, to, session_id, horas, page=1, per_page=
 
     headers = _wa_headers(token, normalized_session, body)
     try:
-        r = requests.post(
-            f"https://graph.facebook.com/{graph_ver}/{phone_number_id}/messages",
-            headers=headers,
-            json=body,
-            timeout=10
-        )
+        r = graph.post_message(phone_number_id, body, token=token, graph_ver=graph_ver, headers=headers)
         if not r.ok:
             logging.warning(f"WA send hours page failed {r.status_code}: {r.text[:200]}")
             # 🔁 Fallback: TODAS las horas en texto
@@ -1447,12 +1533,7 @@ def wa_send_reservas_list(
 
     headers = _wa_headers(token, normalized_session, body)
     try:
-        r = requests.post(
-            f"https://graph.facebook.com/{graph_ver}/{phone_number_id}/messages",
-            headers=headers,
-            json=body,
-            timeout=10
-        )
+        r = graph.post_message(phone_number_id, body, token=token, graph_ver=graph_ver, headers=headers)
         if r.ok:
             return True
         logging.warning(f"WA send reservas list failed {r.status_code}: {r.text[:200]}")
@@ -1486,20 +1567,36 @@ def should_process_by_ts(session_id: str, ts: int) -> bool:
     Solo procesa si este ts es estrictamente mayor que el último procesado.
     Evita re-ordenamientos y reintentos tardíos.
     """
-    key = f"last_ts:{session_id}"
     try:
-        last = storage.get(key)
-        last_i = int(float(last)) if last is not None else 0
-        if ts < last_i:
-            return False
-        # aceptamos y dejamos guardado
-        storage.setex(key, str(ts), ttl=60*60*24)
-        return True
+        # comparar y guardar en una sola operación atómica
+        verdict, _ = storage.admit_message(f"last_ts:{session_id}", None, ts, ttl=60*60*24)
+        return verdict == STORAGE_ADMIT
     except Exception as e:
         sentry_sdk.capture_exception(e)
         # si storage falla, preferimos procesar
         return True
 
+def _wa_admit(session_id: str, ts: int, wamid: Optional[str]) -> tuple[bool, dict]:
+    """
+    Orden (last_ts) + dedup (seen_wamid) de un mensaje entrante en UNA operación atómica de storage
+    (script Lua en Redis): dos workers con el mismo reintento de Meta ya no pueden admitirlo ambos.
+    El estado de la sesión se lee en el mismo viaje.
+    Devuelve (procesar, precarga); precarga = {"state": raw} o {} si no se pudo leer.
+    """
+    try:
+        verdict, estado_raw = storage.admit_message(
+            f"last_ts:{session_id}",
+            f"seen_wamid:{wamid}" if wamid else None,
+            ts,
+            ttl=60*60*24,
+            peek_key=f"state:{session_id}",
+        )
+        return verdict == STORAGE_ADMIT, {"state": estado_raw}
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        # si storage falla, preferimos procesar
+        return True, {}
+
 def is_current(session_id: str, ts: int) -> bool:
     last = storage.get(f"last_ts:{session_id}")
     try:
@@ -1513,29 +1610,50 @@ def is_current(session_id: str, ts: int) -> bool:
 # ================================================
 
 
-def _pelu_rate_scope(endpoint: str) -> str:
-    try:
-        payload = request.get_json(silent=True) or {}
-    except Exception as e:
-        sentry_sdk.capture_exception(e)
-        payload = {}
+def _wa_firma_ok() -> bool:
+    """Firma de Meta verificada una sola vez por petición (la usan el limiter y el handler)."""
+    ok = g.get("wa_firma_ok")
+    if ok is None:
+        raw = request.get_data() or b""
+        sig = request.headers.get("X-Hub-Signature-256", "")
+        ok = verify_waba_signature(settings.WABA_APP_SECRET, raw, sig)
+        g.wa_firma_ok = ok
+    return ok
 
-    entries = payload.get("entry") or []
-    for entry in entries:
-        for change in (entry.get("changes") or []):
-            value = change.get("value") or {}
-            metadata = value.get("metadata") or {}
-            phone_number_id = metadata.get("phone_number_id")
-            if phone_number_id:
-                try:
-                    pelu = get_peluqueria_by_wa_phone_number_id(phone_number_id)
-                    pelu_id = getattr(pelu, "id", None)
-                    if pelu_id is not None:
-                        return f"pelu:{pelu_id}"
-                except Exception as e:
-                    sentry_sdk.capture_exception(e)
-                    continue
-    return "pelu:unknown"
+
+def _wa_firma_invalida() -> bool:
+    # exempt_when del limiter: se evalúa antes de tocar el storage, así el tráfico
+    # sin firma válida no consume cuota de la peluquería ni genera escrituras en Redis
+    return not _wa_firma_ok()
+
+
+def _wa_payload() -> Optional[dict]:
+    """JSON del webhook parseado una vez por petición; None si el cuerpo no es JSON válido."""
+    if "wa_payload" not in g:
+        try:
+            g.wa_payload = request.get_json(force=True) or {}
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            g.wa_payload = None
+    return g.wa_payload
+
+
+def _pelu_rate_scope(endpoint: str) -> str:
+    """Bucket por número de WhatsApp (metadata.phone_number_id), sin consultar la BD."""
+    scope = g.get("wa_rate_scope")
+    if scope is None:
+        scope = "pelu:unknown"
+        for entry in ((_wa_payload() or {}).get("entry") or []):
+            for change in (entry.get("changes") or []):
+                metadata = (change.get("value") or {}).get("metadata") or {}
+                phone_number_id = metadata.get("phone_number_id")
+                if phone_number_id:
+                    scope = f"wa:{phone_number_id}"
+                    break
+            if scope != "pelu:unknown":
+                break
+        g.wa_rate_scope = scope
+    return scope
 
 def _process_core_and_reply(
     phone_number_id: str,
@@ -1546,46 +1664,29 @@ def _process_core_and_reply(
     idem: str,
 ):
     try:
-        # Refetch pelu aqui (evita objetos SQLAlchemy detached fuera del request)
         pelu = get_peluqueria_by_wa_phone_number_id(phone_number_id)
         if not pelu:
             logging.warning("phone_number_id desconocido (async): %s", phone_number_id)
             return
 
-        headers = {
-            "Content-Type": "application/json",
-            "X-API-KEY": pelu.api_key,
-            "Idempotency-Key": idem,
-        }
-        body = {"session_id": session_id, "mensaje": texto, "origin": origin}
-        base = os.getenv("BOT_INTERNAL_URL", "http://127.0.0.1:5000")
-        timeout_tuple = (3.05, settings.LOOPBACK_TIMEOUT_SECONDS)
-
-        try:
-            r = requests.post(
-                f"{base}/webhook",
-                headers=headers,
-                json=body,
-                timeout=timeout_tuple,
-            )
-        except ReadTimeout:
-            # No rompemos UX: el webhook ya respondio 200 antes
-            sentry_sdk.capture_message(
-                "Loopback timeout /webhook (async)",
-                level="warning",
-            )
-            return
-
-        if not r.ok:
+        # Core en proceso (sin loopback HTTP a /webhook)
+        data, status = procesar_mensaje(
+            pelu,
+            session_id,
+            texto,
+            origin=origin,
+            idempotency_key=idem,
+        )
+        if status >= 400:
             logging.warning(
-                "loopback /webhook fallo %s: %s",
-                r.status_code,
-                (r.text or "")[:200],
+                "core fallo %s: %s",
+                status,
+                (data or {}).get("respuesta"),
             )
             return
 
         # ---- Respuesta del core ----
-        data = r.json() or {}
+        data = data or {}
         resp = data.get("respuesta")
         ui = data.get("ui")
         resp2 = data.get("respuesta2")
@@ -1701,7 +1802,7 @@ def _process_core_and_reply(
     except Exception as e:
         sentry_sdk.capture_exception(e)
         logging.error(
-            "Error loopback webhook (async): %s",
+            "Error procesando mensaje en el core (async): %s",
             e,
             exc_info=True,
         )
@@ -1721,18 +1822,15 @@ def whatsapp_verify():
 @app.route("/webhook/whatsapp", methods=["POST"])
 @limiter.shared_limit(
     settings.RATE_LIMITS["WEBHOOK_PER_PELU"],
-    scope=_pelu_rate_scope,)
+    scope=_pelu_rate_scope,
+    exempt_when=_wa_firma_invalida,)
 def whatsapp_receive():
-    # Verifica firma
-    raw = request.get_data() or b""
-    sig = request.headers.get("X-Hub-Signature-256", "")
-    if not verify_waba_signature(settings.WABA_APP_SECRET, raw, sig):
+    # Firma y JSON ya resueltos (y cacheados en g) al evaluar el límite
+    if not _wa_firma_ok():
         return "", 403
 
-    try:
-        payload = request.get_json(force=True) or {}
-    except Exception as e:
-        sentry_sdk.capture_exception(e)
+    payload = _wa_payload()
+    if payload is None:
         return "", 200
 
     entries = payload.get("entry", [])
@@ -1752,19 +1850,14 @@ def whatsapp_receive():
 
             for msg in messages:
                 ts = _msg_ts(msg)
-                if not should_process_by_ts(session_id=f"wa_{phone_number_id}_{msg.get('from')}",ts=ts):
-                    continue
-
                 from_msisdn = msg.get("from")
                 wamid = msg.get("id") or msg.get("wamid")
                 if not from_msisdn:
                     continue
 
-                if wamid:
-                    seen_key = f"seen_wamid:{wamid}"
-                    if storage.get(seen_key):
-                        continue
-                    storage.setex(seen_key, "1", ttl=60*60*24)
+                admit, pre = _wa_admit(f"wa_{phone_number_id}_{from_msisdn}", ts, wamid)
+                if not admit:
+                    continue
 
                 origin = "text"
                 msg_type = (msg.get("type") or "").strip().lower()
@@ -1915,7 +2008,7 @@ def whatsapp_receive():
 
                 idem = wamid or f"{from_msisdn}:{ts}"
 
-                estado_actual = cargar_estado(session_id)
+                estado_actual = _parse_estado(pre["state"]) if "state" in pre else cargar_estado(session_id)
                 if estado_actual is None:
                     estado_inicial = {"paso": "inicio", "datos": {}, "tipo_accion": None}
                     guardar_estado(session_id, estado_inicial)
@@ -1951,8 +2044,14 @@ def whatsapp_receive():
                     )
                     continue
 
-                # Reenvío al core
-                CORE_EXECUTOR.submit(_process_core_and_reply, phone_number_id, from_msisdn, session_id, texto, origin, idem)
+                # Reenvío al core (en orden por sesión)
+                accepted = CORE_EXECUTOR.submit(
+                    session_id, pelu.id,
+                    _process_core_and_reply, phone_number_id, from_msisdn, session_id, texto, origin, idem,
+                )
+                if not accepted:
+                    logging.warning("Cola del core llena (pelu=%s): mensaje descartado", pelu.id)
+                    sentry_sdk.capture_message(f"core_backpressure pelu={pelu.id} stats={CORE_EXECUTOR.stats()}")
                 continue
 
     return "", 200
@@ -1961,31 +2060,51 @@ def whatsapp_receive():
 # ================================================
 # Webhook de negocio (chat core)
 # ================================================
-@app.route("/webhook", methods=["POST"])
-def api_post():
-    try:
-        data = request.get_json(force=True) or {}
+def procesar_mensaje(
+    pelu,
+    session_id: str,
+    mensaje: str,
+    origin: str = "text",
+    idempotency_key: Optional[str] = None,
+) -> tuple[dict, int]:
+    """
+    Core conversacional: mensaje entrante → (respuesta estructurada, status).
+    Lo usan tanto el webhook de WhatsApp (en proceso) como el adaptador HTTP /webhook.
+    La respuesta tiene la forma {"respuesta", "ui"?, "choices"?, "respuesta2"?}.
+    Si otro turno de la misma sesión cambió el estado a mitad (conflicto del CAS), lo que íbamos a
+    contestar ya no casa con la conversación guardada: se pide repetir el mensaje. No si el turno ya
+    confirmó una reserva o cancelación: esa respuesta tiene que llegar.
+    """
+    _estado_tls.conflicto = _estado_tls.efecto = False
+    body, status = _procesar_turno(pelu, session_id, mensaje, origin, idempotency_key)
+    if getattr(_estado_tls, "conflicto", False) and not getattr(_estado_tls, "efecto", False):
+        return {
+            "respuesta": "Me han llegado dos mensajes casi a la vez y me he liado 😅. ¿Me repites el último?"
+        }, 200
+    return body, status
 
-        # Seguridad: solo API key por cabecera
-        api_key = request.headers.get("X-API-KEY")
-        session_id = data.get("session_id")
-        mensaje = data.get("mensaje", "")
-        origin = (data.get("origin") or "text").lower().strip()
 
-        if not api_key or not session_id or not mensaje:
-            return jsonify({
+def _procesar_turno(pelu, session_id: str, mensaje: str, origin: str, idempotency_key: Optional[str]) -> tuple[dict, int]:
+    try:
+        origin = (origin or "text").lower().strip()
+
+        if not session_id or not mensaje:
+            return {
                 "respuesta": "No he podido procesar tu mensaje ahora mismo. Inténtalo más tarde.",
                 "ui": "main_menu"
-            }), 200
+            }, 200
 
         if not re.match(r"^[A-Za-z0-9_\-]{4,40}$", session_id):
-            return jsonify({
+            return {
                 "respuesta": "No he podido continuar con la conversación. Inténtalo de nuevo.",
                 "ui": "main_menu"
-            }), 200
+            }, 200
 
-        # Rate limit por sesión (60s de ventana, configurable en settings)
-        count = storage.incr(f"rl:{session_id}", ttl=60)
+        # Rate limit por sesión (60s de ventana, configurable en settings) + estado en el mismo viaje
+        with storage.pipeline() as p:
+            p.incr(f"rl:{session_id}", ttl=60)
+            p.get(f"state:{session_id}")
+        count, estado_raw = p.results
         if count > settings.RATE_LIMIT_PER_MIN:
             # Opcional: resetea la sesión para no atascar al usuario
             try:
@@ -1993,35 +2112,27 @@ def api_post():
             except Exception as e:
                 sentry_sdk.capture_exception(e)
                 pass
-            return jsonify({
+            return {
                 "respuesta": "Estoy recibiendo muchos mensajes seguidos 😅. Espera unos segundos y seguimos.",
                 "ui": "main_menu"
-            }), 200
-
-        pelu = get_peluqueria_by_api_key(api_key)
-        if not pelu:
-            return jsonify({
-                "respuesta": f"No he podido identificar la {getattr(pelu, 'tipo_negocio', 'negocio')}. Inténtalo más tarde.",
-                "ui": "main_menu"
-            }), 200
+            }, 200
 
         # Estado
-        estado = cargar_estado(session_id)
+        estado = _parse_estado(estado_raw, session_id)
         if not estado:
             estado = {"paso": "inicio", "datos": {}, "tipo_accion": None}
             guardar_estado(session_id, estado)
-            return jsonify({"respuesta": welcome_text(pelu.nombre, pelu.tipo_negocio), "ui": "main_menu"})
+            return {"respuesta": welcome_text(pelu.nombre, pelu.tipo_negocio), "ui": "main_menu"}, 200
 
         # Comandos globales → reset a menú
         cmd = detect_global_command(mensaje)
         if cmd in {"menu", "reset", "salir", "volver"}:
             guardar_estado(session_id, {"paso": "inicio", "datos": {}, "tipo_accion": None})
-            return jsonify({"respuesta": return_text(pelu.nombre, pelu.tipo_negocio), "ui": "main_menu"})
+            return {"respuesta": return_text(pelu.nombre, pelu.tipo_negocio), "ui": "main_menu"}, 200
 
         if estado.get("force_welcome"):
-            estado["force_welcome"] = False
-            guardar_estado(session_id, estado)
-            return jsonify({"respuesta": welcome_text(pelu.nombre, pelu.tipo_negocio), "ui": "main_menu"})
+            actualizar_estado(session_id, force_welcome=False)
+            return {"respuesta": welcome_text(pelu.nombre, pelu.tipo_negocio), "ui": "main_menu"}, 200
 
         # ---------------------------------------------------------
         # INICIO → detecta intención
@@ -2038,27 +2149,27 @@ def api_post():
                     estado["paso"] = "fecha"
                     set_servicio_en_datos(estado["datos"], pelu.servicios[0])
                     guardar_estado(session_id, estado)
-                    return jsonify({"respuesta": "¿Para qué fecha quieres la cita?\n(dd/mm/aaaa)📅"})
+                    return {"respuesta": "¿Para qué fecha quieres la cita?\n(dd/mm/aaaa)📅"}, 200
                 else:
                     estado["paso"] = "servicio"
                     guardar_estado(session_id, estado)
-                    return jsonify({"respuesta": "¿Qué servicio deseas reservar?⬇️", "ui": "services"})
+                    return {"respuesta": "¿Qué servicio deseas reservar?⬇️", "ui": "services"}, 200
 
             if tipo_accion == "cancelar":
                 estado.update({"tipo_accion": "cancelar", "paso": "buscar"})
                 guardar_estado(session_id, estado)
-                return jsonify({"respuesta": "Dime el teléfono📞 con el que hiciste la reserva que quieres cancelar."})
+                return {"respuesta": "Dime el teléfono📞 con el que hiciste la reserva que quieres cancelar."}, 200
 
             if tipo_accion == "duda":
                 estado.update({"tipo_accion": "duda", "paso": "duda"})
                 guardar_estado(session_id, estado)
-                return jsonify({"respuesta": "Escríbeme tu duda y te ayudo con lo que necesites.❓"})
+                return {"respuesta": "Escríbeme tu duda y te ayudo con lo que necesites.❓"}, 200
 
             guardar_estado(session_id, estado)
-            return jsonify({
+            return {
                 "respuesta": "Por favor, elige una opción de las disponibles:",
                 "ui": "main_menu"
-            })
+            }, 200
         # ---------------------------------------------------------
         # FLUJO: RESERVAR
         # ---------------------------------------------------------
@@ -2106,21 +2217,21 @@ def api_post():
                     servicio = _elegir_servicio_desde_texto(pelu, msg_norm, servicio_nombre_ai)
 
                 if not servicio:
-                    return jsonify({
+                    return {
                         "respuesta": "Por favor, selecciona un servicio de la lista o escribe el nombre.",
                         "ui": "services"
-                    })
+                    }, 200
 
                 set_servicio_en_datos(datos, servicio)
 
                 if getattr(pelu, "enable_peluquero_selection", True):
                     estado["paso"] = "peluquero"
                     guardar_estado(session_id, estado)
-                    return jsonify({"respuesta": "¿Con quién te gustaría reservar?", "ui": "peluqueros"})
+                    return {"respuesta": "¿Con quién te gustaría reservar?", "ui": "peluqueros"}, 200
                 else:
                     estado["paso"] = "fecha"
                     guardar_estado(session_id, estado)
-                    return jsonify({"respuesta": "¿Para qué fecha quieres la cita?\n(dd/mm/aaaa)📅"})
+                    return {"respuesta": "¿Para qué fecha quieres la cita?\n(dd/mm/aaaa)📅"}, 200
 
             #(1,5) Peluquero
             if estado["paso"] == "peluquero":
@@ -2134,7 +2245,7 @@ def api_post():
                         datos["peluquero_nombre"] = None
                         estado["paso"] = "fecha"
                         guardar_estado(session_id, estado)
-                        return jsonify({"respuesta": "¿Para qué fecha quieres la cita?\n(dd/mm/aaaa)📅"})
+                        return {"respuesta": "¿Para qué fecha quieres la cita?\n(dd/mm/aaaa)📅"}, 200
 
                     # Fila paginada: PEL_P<page>_<idx_global>
                     m = re.fullmatch(r"PEL_P\d+_(\d+)", msg, flags=re.IGNORECASE)
@@ -2142,27 +2253,24 @@ def api_post():
                         idx = int(m.group(1))
                         try:
                             # obtenemos el listado ordenado de activos
-                            with SessionLocal() as _db:
-                                activos = get_active_peluqueros(_db, pelu.id) or []
+                            activos = active_peluqueros(pelu)
                             if 0 <= idx < len(activos):
                                 sel = activos[idx]
                                 datos["peluquero_id"] = getattr(sel, "id", None)
                                 datos["peluquero_nombre"] = getattr(sel, "nombre", "")
                                 estado["paso"] = "fecha"
                                 guardar_estado(session_id, estado)
-                                return jsonify(
-                                    {"respuesta": "¿Para qué fecha quieres la cita?\n(dd/mm/aaaa)📅"})
+                                return {"respuesta": "¿Para qué fecha quieres la cita?\n(dd/mm/aaaa)📅"}, 200
                         except Exception:
                             pass
 
                     # Cualquier otro id: re-mostrar lista
                     guardar_estado(session_id, estado)
-                    return jsonify({"respuesta": "Elige un profesional de la lista, por favor.", "ui": "peluqueros"})
+                    return {"respuesta": "Elige un profesional de la lista, por favor.", "ui": "peluqueros"}, 200
 
                 # Texto libre: intenta match por nombre
                 try:
-                    with SessionLocal() as _db:
-                        activos = get_active_peluqueros(_db, pelu.id) or []
+                    activos = active_peluqueros(pelu)
                     tnorm = (msg or "").strip().lower()
                     match = next((p for p in activos if (p.nombre or "").strip().lower() == tnorm), None)
                     if match:
@@ -2170,22 +2278,22 @@ def api_post():
                         datos["peluquero_nombre"] = getattr(match, "nombre", "")
                         estado["paso"] = "fecha"
                         guardar_estado(session_id, estado)
-                        return jsonify({"respuesta": "¿Para qué fecha quieres la cita?\n(dd/mm/aaaa)📅"})
+                        return {"respuesta": "¿Para qué fecha quieres la cita?\n(dd/mm/aaaa)📅"}, 200
                 except Exception:
                     pass
 
                 # Si no entiendo, reenvío lista
                 guardar_estado(session_id, estado)
-                return jsonify({"respuesta": "¿Con quién te gustaría reservar?", "ui": "peluqueros"})
+                return {"respuesta": "¿Con quién te gustaría reservar?", "ui": "peluqueros"}, 200
 
             # (2) Fecha
             if estado["paso"] == "fecha":
                 fecha_str = interpreta_fecha(mensaje, pelu)
 
                 if not fecha_str or fecha_str.upper() == "NO_ENTIENDO":
-                    return jsonify({
+                    return {
                         "respuesta": f"Por favor, elige una fecha correcta (dd/mm/aaaa)."
-                    })
+                    }, 200
 
                 # Validación de negocio (no parsing): existencia, pasado, día cerrado
                 try:
@@ -2194,19 +2302,19 @@ def api_post():
                     fecha_str = fecha_obj.strftime("%Y-%m-%d")  # normalizado
                 except Exception as e:
                     sentry_sdk.capture_exception(e)
-                    return jsonify({"respuesta": "La fecha no existe, prueba con otra fecha (dd/mm/aaaa)."})
+                    return {"respuesta": "La fecha no existe, prueba con otra fecha (dd/mm/aaaa)."}, 200
 
                 now = now_local(pelu)
                 hoy = now.date()
                 if fecha_obj < hoy:
-                    return jsonify({"respuesta": "No puedes reservar para una fecha pasada, elige otra fecha."})
+                    return {"respuesta": "No puedes reservar para una fecha pasada, elige otra fecha."}, 200
 
                 # 1) Validación de días de la semana cerrados
                 dias_cerrados = [d.strip().lower() for d in (pelu.dias_cerrados or "").split(",") if d.strip()]
                 nombre_dia = fecha_obj.strftime("%A").lower()
                 nombre_dia_es = DIAS_EN_ES.get(nombre_dia, nombre_dia) if 'DIAS_EN_ES' in globals() else nombre_dia
                 if nombre_dia_es in dias_cerrados:
-                    return jsonify({"respuesta": f"La {getattr(pelu, 'tipo_negocio', 'negocio')} cierra el {nombre_dia_es}🔒, elige otra fecha."})
+                    return {"respuesta": f"La {getattr(pelu, 'tipo_negocio', 'negocio')} cierra el {nombre_dia_es}🔒, elige otra fecha."}, 200
 
                 # 2) Validación de días concretos y recurrentes (JSON dias_cerrados_anio)
                 #    Estructura esperada: {"dates": ["YYYY-MM-DD", ...], "recurring": ["MM-DD", ...]}
@@ -2227,8 +2335,7 @@ def api_post():
                 festivos = closed_json.get("dates", []) if isinstance(closed_json, dict) else []
                 festivos_set = {str(f).strip() for f in festivos if f}
                 if fecha_str in festivos_set:
-                    return jsonify(
-                        {"respuesta": f"La {getattr(pelu, 'tipo_negocio', 'negocio')} está cerrada el {formatea_fecha_es(fecha_str)} (festivo) 🔒, elige otra fecha."})
+                    return {"respuesta": f"La {getattr(pelu, 'tipo_negocio', 'negocio')} está cerrada el {formatea_fecha_es(fecha_str)} (festivo) 🔒, elige otra fecha."}, 200
 
                 # Recurrentes (normalizar a MM-DD)
                 def _norm_mmdd(x):
@@ -2253,16 +2360,16 @@ def api_post():
 
                 mmdd = fecha_obj.strftime("%m-%d")
                 if mmdd in recurrentes_set:
-                    return jsonify({"respuesta": f"La {getattr(pelu, 'tipo_negocio', 'negocio')} cierra ese día (festivo) 🔒, elige otra fecha."})
+                    return {"respuesta": f"La {getattr(pelu, 'tipo_negocio', 'negocio')} cierra ese día (festivo) 🔒, elige otra fecha."}, 200
 
                 # 3) Validación de rango permitido
                 fuera, _ = _fecha_fuera_de_rango(fecha_obj, pelu)
                 if fuera:
-                    return jsonify({
+                    return {
                         "respuesta": (
                             "No se admiten reservas tan futuras. Elige una fecha anterior, por favor."
                         )
-                    })
+                    }, 200
 
                 # ✅ Si pasa todas las validaciones, se guarda la fecha
                 datos["fecha"] = fecha_str
@@ -2303,13 +2410,13 @@ def api_post():
                         msg += ". Fechas próximas con hueco:\n" + "\n".join(sugeridas)
                     msg += "\n\nElige otra fecha📅."
 
-                    return jsonify({"respuesta": msg})
+                    return {"respuesta": msg}, 200
 
-                return jsonify({
+                return {
                     "respuesta": "¿A qué hora quieres tu cita?🕔",
                     "ui": "hours",
                     "choices": horas
-                })
+                }, 200
 
             # (3) Hora
             if estado["paso"] == "hora":
@@ -2358,7 +2465,7 @@ def api_post():
                         msg += ". Fechas próximas con hueco:\n" + "\n".join(sugeridas)
                     msg += "\nElige otra fecha, por favor."
 
-                    return jsonify({"respuesta": msg})
+                    return {"respuesta": msg}, 200
 
                 raw_hours = storage.get(f"hours:{session_id}")
                 horas_all = []
@@ -2378,25 +2485,25 @@ def api_post():
                         datos["hora"] = horas_all[idx]
                         estado["paso"] = "nombre"
                         guardar_estado(session_id, estado)
-                        return jsonify({"respuesta": "¿A nombre de quién hacemos la reserva?"})
+                        return {"respuesta": "¿A nombre de quién hacemos la reserva?"}, 200
 
                 # 🔹 Si viene de lista interactiva y el texto ya es la hora exacta → aceptar directo
                 if origin == "list" and (mensaje in horas or mensaje in horas_all):
                     datos["hora"] = mensaje
                     estado["paso"] = "nombre"
                     guardar_estado(session_id, estado)
-                    return jsonify({"respuesta": "¿A nombre de quién hacemos la reserva?"})
+                    return {"respuesta": "¿A nombre de quién hacemos la reserva?"}, 200
 
                 # 🔹 Intentar interpretar una hora libre escrita por el usuario
                 parsed = normaliza_hora_ia(mensaje)
                 if not parsed:
                     guardar_estado(session_id, estado)
                     # devolvemos TODAS las horas; la capa WA las pagina (máx 10 por página) o hace fallback en texto si falla
-                    return jsonify({
+                    return {
                         "respuesta": "No he entendido la hora, estas son las horas disponibles:",
                         "ui": "hours",
                         "choices": horas
-                    })
+                    }, 200
 
                 decision = elegir_hora_final(horas, parsed)
 
@@ -2404,22 +2511,22 @@ def api_post():
                     datos["hora_candidatas"] = decision["candidatas"]
                     estado["paso"] = "confirma_am_pm"
                     guardar_estado(session_id, estado)
-                    return jsonify({
-                        "respuesta": f"¿Es por la mañana ({decision['candidatas'][0]}) o por la tarde ({decision['candidatas'][1]})?"})
+                    return {
+                        "respuesta": f"¿Es por la mañana ({decision['candidatas'][0]}) o por la tarde ({decision['candidatas'][1]})?"}, 200
 
                 if not decision.get("ok"):
                     guardar_estado(session_id, estado)
-                    return jsonify({
+                    return {
                         "respuesta": f"Por favor, elige una hora de las disponibles.",
                         "ui": "hours",
                         "choices": horas
-                    })
+                    }, 200
 
                 hora_str = decision["hora"]
                 datos["hora"] = hora_str
                 estado["paso"] = "nombre"
                 guardar_estado(session_id, estado)
-                return jsonify({"respuesta": "¿A nombre de quién hacemos la reserva?"})
+                return {"respuesta": "¿A nombre de quién hacemos la reserva?"}, 200
 
             # (3b) Aclaración am/pm
             if estado["paso"] == "confirma_am_pm":
@@ -2427,7 +2534,7 @@ def api_post():
                 if len(cands) != 2:
                     estado["paso"] = "hora"
                     guardar_estado(session_id, estado)
-                    return jsonify({"respuesta": "Vuelvo a preguntarte la hora. ¿Cuál te viene bien?"})
+                    return {"respuesta": "Vuelvo a preguntarte la hora. ¿Cuál te viene bien?"}, 200
 
                 t = (mensaje or "").lower().strip()
 
@@ -2466,15 +2573,15 @@ def api_post():
                             msg += ". Fechas próximas con hueco:\n" + "\n".join(sugeridas)
                         msg += "\nElige otra fecha, por favor."
 
-                        return jsonify({"respuesta": msg})
+                        return {"respuesta": msg}, 200
                     else:
                         estado["paso"] = "hora"
                         guardar_estado(session_id, estado)
-                        return jsonify({
+                        return {
                             "respuesta": f"Esa opción ya no está disponible.",
                             "ui": "hours",
                             "choices": horas
-                        })
+                        }, 200
 
                 if am_ok and not pm_ok:
                     elegido = am_opt
@@ -2505,7 +2612,7 @@ def api_post():
                                     elegido = cand
                             if not elegido:
                                 guardar_estado(session_id, estado)
-                                return jsonify({"respuesta": f"¿Por la mañana ({am_opt}) o por la tarde ({pm_opt})?"})
+                                return {"respuesta": f"¿Por la mañana ({am_opt}) o por la tarde ({pm_opt})?"}, 200
 
                 now = now_local(pelu)
                 hoy = now.date()
@@ -2515,35 +2622,34 @@ def api_post():
                     if chosen <= now:
                         estado["paso"] = "fecha"
                         guardar_estado(session_id, estado)
-                        return jsonify(
-                            {"respuesta": "No puedes reservar para una hora que ya ha pasado, indica otra fecha."})
+                        return {"respuesta": "No puedes reservar para una hora que ya ha pasado, indica otra fecha."}, 200
 
                 datos["hora"] = elegido
                 datos.pop("hora_candidatas", None)
                 estado["paso"] = "nombre"
                 guardar_estado(session_id, estado)
-                return jsonify({"respuesta": "¿A nombre de quién hacemos la reserva?"})
+                return {"respuesta": "¿A nombre de quién hacemos la reserva?"}, 200
 
             # (4) Nombre
             if estado["paso"] == "nombre":
                 nombre = mensaje.strip()
 
                 if not nombre or len(nombre) < 2:
-                    return jsonify({"respuesta": "No entendí el nombre, ¿Puedes escribirlo de nuevo?"})
+                    return {"respuesta": "No entendí el nombre, ¿Puedes escribirlo de nuevo?"}, 200
 
                 if re.fullmatch(r"[0-9\W_]+", nombre):
-                    return jsonify({"respuesta": "Ese nombre no es válido, ¿Puedes escribirlo de nuevo?"})
+                    return {"respuesta": "Ese nombre no es válido, ¿Puedes escribirlo de nuevo?"}, 200
 
                 datos["nombre"] = nombre
                 estado["paso"] = "telefono"
                 guardar_estado(session_id, estado)
-                return jsonify({"respuesta": "¿Cuál es tu número de teléfono?"})
+                return {"respuesta": "¿Cuál es tu número de teléfono?"}, 200
 
             # (5) Teléfono -> Resumen
             if estado["paso"] == "telefono":
                 telefono = interpreta_telefono(mensaje, getattr(pelu, 'country_code', None) or 'ES')
                 if not telefono:
-                    return jsonify({"respuesta": "El teléfono no es válido, ¿Puedes escribirlo de nuevo con el prefijo del país?"})
+                    return {"respuesta": "El teléfono no es válido, ¿Puedes escribirlo de nuevo con el prefijo del país?"}, 200
                 datos["telefono"] = telefono
                 estado["paso"] = "confirmar"
                 guardar_estado(session_id, estado)
@@ -2571,7 +2677,7 @@ def api_post():
                         f"Teléfono: {datos['telefono']}\n"
                         "¿Confirmas la reserva? (*si*/*no*)"
                     )
-                return jsonify({"respuesta": resumen})
+                return {"respuesta": resumen}, 200
 
             # (6) Confirmación final (idempotente y robusta)
             if estado["paso"] == "confirmar":
@@ -2580,15 +2686,15 @@ def api_post():
                 # --- Caso NEGACIÓN ---
                 if any(w in text_in for w in DENIAL_WORDS):
                     reset_estado(session_id)
-                    return jsonify({
+                    return {
                         "respuesta": "De acuerdo👌🏼, no confirmamos la reserva.",
                         "ui": "main_menu"
-                    })
+                    }, 200
 
                 # --- Caso AFIRMACIÓN ---
                 elif any(w in text_in for w in AFFIRM_WORDS):
                     horas_fresh = None
-                    explicit_key = request.headers.get("Idempotency-Key")
+                    explicit_key = idempotency_key
                     payload = {
                         "fecha": datos.get("fecha"),
                         "hora": datos.get("hora"),
@@ -2598,9 +2704,15 @@ def api_post():
                     idem_key, cached = idem_get("reservar_confirm", pelu.id, payload, explicit_key)
                     if cached:
                         sentry_event("idem.hit", action="reservar_confirm", key=idem_key)
-                        return jsonify(cached["json"]), cached["status"]
+                        return cached["json"], cached["status"]
 
                     try:
+                        # (0) "Sin preferencia": se asigna aquí un peluquero libre; no se guarda en datos
+                        #     para que un no_slot vuelva a ofrecer horas de cualquier peluquero
+                        peluquero_id, peluquero_nombre = datos.get("peluquero_id"), datos.get("peluquero_nombre")
+                        if not peluquero_id:
+                            peluquero_id, peluquero_nombre = autoasigna_peluquero(pelu, datos)
+
                         # (1) PRIMERO: asegurar hueco en BD (sin crear evento aún) con reintentos si hay lock
                         retries = 0
                         while True:
@@ -2612,7 +2724,8 @@ def api_post():
                                     datos["telefono"],
                                     datos["fecha"],
                                     datos["hora"],
-                                    event_id=None  # aún no hay evento en Calendar
+                                    event_id=None,  # aún no hay evento en Calendar
+                                    peluquero_id=peluquero_id,
                                 )
 
                             # éxito o error real (no_slot) -> salimos del bucle
@@ -2629,7 +2742,7 @@ def api_post():
                                 body = {
                                     "respuesta": "Estoy terminando de reservar. Confirma de nuevo en unos segundos."}
                                 # Importante: no cachear (no llamamos a idem_set)
-                                return jsonify(body), 200
+                                return body, 200
 
                             _sleep_backoff(retries)  # 150ms, 300ms...
                             retries += 1
@@ -2642,7 +2755,7 @@ def api_post():
                                 "respuesta": "No he podido confirmar ahora mismo. Vuelve a intentarlo en unos segundos, por favor."
                             }
                             # No cacheamos este estado incierto
-                            return jsonify(body), 200
+                            return body, 200
 
                         # (1a) Manejo explícito de errores de BD
                         if isinstance(res, dict) and res.get("error") == "no_slot":
@@ -2692,7 +2805,7 @@ def api_post():
 
                                 body = {"respuesta": msg}
                                 idem_set(idem_key, 200, body)
-                                return jsonify(body), 200
+                                return body, 200
                             else:
                                 estado["paso"] = "hora"
                                 guardar_estado(session_id, estado)
@@ -2702,10 +2815,11 @@ def api_post():
                                     "choices": horas_fresh
                                 }
                                 idem_set(idem_key, 200, body)
-                                return jsonify(body), 200
+                                return body, 200
 
                         # (1b) Éxito BD → tenemos ID de la reserva
                         reserva_id = int(res)
+                        _efecto_confirmado()
 
                         # (2) AHORA crear el evento en Google Calendar (idempotente por reserva)
                         gcal_key = f"{pelu.id}:{datos['fecha']}:{datos['hora']}:{reserva_id}"
@@ -2720,7 +2834,7 @@ def api_post():
                                     "servicio": servicio_sel,
                                     "nombre": datos["nombre"],
                                     "telefono": datos["telefono"],
-                                    "peluquero": datos.get("peluquero_nombre"),
+                                    "peluquero": peluquero_nombre,
                                 },
                                 private_key=gcal_key
                             )
@@ -2793,7 +2907,7 @@ def api_post():
                                 idem_set(idem_key, 200, body)
                                 sentry_event("calendar.no_hours_after_conflict", level="warning",
                                              fecha=datos["fecha"], peluquero_id=datos.get("peluquero_id"))
-                                return jsonify(body), 200
+                                return body, 200
                             else:
                                 estado["paso"] = "hora"
                                 guardar_estado(session_id, estado)
@@ -2805,7 +2919,7 @@ def api_post():
                                 idem_set(idem_key, 200, body)
                                 sentry_event("calendar.no_hours_after_conflict", level="warning",
                                              fecha=datos["fecha"], peluquero_id=datos.get("peluquero_id"))
-                                return jsonify(body), 200
+                                return body, 200
 
                         # (2b) Guardar event_id en BD si está disponible
                         try:
@@ -2828,7 +2942,7 @@ def api_post():
 
                         # (4) Post-confirm OK
                         estado["paso"] = "post_confirm"
-                        guardar_estado(session_id, estado)
+                        _guardar_estado_tras_commit(session_id, estado)
                         body = {
                             "respuesta": (
                                 f"✅ ¡Reserva confirmada en {pelu.nombre}! "
@@ -2837,7 +2951,7 @@ def api_post():
                             "respuesta2": "¿Quieres hacer algo más? (*si*/*no*)",
                         }
                         idem_set(idem_key, 200, body)
-                        return jsonify(body), 200
+                        return body, 200
 
                     except Exception as e:
                         try:
@@ -2850,16 +2964,16 @@ def api_post():
                         body = {"respuesta": "Ocurrió un error al confirmar la reserva, inténtalo de nuevo.",
                                 "ui": "main_menu"}
                         idem_set(idem_key, 500, body)
-                        return jsonify(body), 500
+                        return body, 500
 
                 # --- Caso NEUTRO / Irrelevante ---
                 guardar_estado(session_id, estado)
-                return jsonify({
+                return {
                     "respuesta": (
                         "👉 Responde *si* para confirmarla\n"
                         "👉 Responde *no* para cancelarla"
                     )
-                })
+                }, 200
 
             # (6b) Post confirmación: ¿algo más?
             if estado["paso"] == "post_confirm":
@@ -2867,17 +2981,17 @@ def api_post():
 
                 if any(w in text_in for w in DENIAL_WORDS):
                     guardar_estado(session_id,{"paso": "inicio", "datos": {}, "tipo_accion": None, "force_welcome": True})
-                    return jsonify({"respuesta": "¡Genial! Gracias por reservar. ¡Que tengas un buen día! 👋"})
+                    return {"respuesta": "¡Genial! Gracias por reservar. ¡Que tengas un buen día! 👋"}, 200
 
                 if any(w in text_in for w in AFFIRM_WORDS):
                     guardar_estado(session_id, {"paso": "inicio", "datos": {}, "tipo_accion": None})
-                    return jsonify({
+                    return {
                         "respuesta": "Perfecto, te muestro el menú para continuar.",
                         "ui": "main_menu"
-                    })
+                    }, 200
 
                 guardar_estado(session_id, estado)
-                return jsonify({"respuesta": "¿Quieres hacer algo más? (*si*/*no*)"})
+                return {"respuesta": "¿Quieres hacer algo más? (*si*/*no*)"}, 200
 
         # ---------------------------------------------------------
         # FLUJO: CANCELAR
@@ -2903,8 +3017,7 @@ def api_post():
                 if not r:
                     estado["paso"] = "buscar"
                     guardar_estado(session_id, estado)
-                    return jsonify(
-                        {"respuesta": "No encontré esa reserva. Escribe el teléfono con el que hiciste la reserva."})
+                    return {"respuesta": "No encontré esa reserva. Escribe el teléfono con el que hiciste la reserva."}, 200
 
                 if not es_reserva_futura(r.fecha, r.hora):
                     tel = getattr(r, "telefono", None) or datos.get("telefono")
@@ -2939,21 +3052,20 @@ def api_post():
                             datos["last_choices_cancel"] = items  # ⬅️ guarda la última lista
                             estado["paso"] = "seleccionar_reserva_cancelar"
                             guardar_estado(session_id, estado)
-                            return jsonify({
+                            return {
                                 "respuesta": "Esa reserva ya ha pasado. ¿Qué reserva quieres cancelar?",
                                 "ui": "res_list",
                                 "choices": items
-                            })
+                            }, 200
 
                     estado["paso"] = "buscar"
                     guardar_estado(session_id, estado)
-                    return jsonify(
-                        {"respuesta": "Esa reserva ya ha pasado. Escribe el teléfono para ver tus reservas futuras."})
+                    return {"respuesta": "Esa reserva ya ha pasado. Escribe el teléfono para ver tus reservas futuras."}, 200
 
                 datos["reserva_id"] = rid
                 estado["paso"] = "confirmar_cancelar"
                 guardar_estado(session_id, estado)
-                return jsonify({"respuesta": "¿Confirmas la cancelación de esa reserva? (*si*/*no*)"})
+                return {"respuesta": "¿Confirmas la cancelación de esa reserva? (*si*/*no*)"}, 200
 
             # (0bis) Estando en selección de reserva para cancelar, si NO pulsan una fila válida, re-muestra la lista
             if estado["paso"] == "seleccionar_reserva_cancelar":
@@ -2963,7 +3075,7 @@ def api_post():
                 # (el core ya no debe enviar nada aquí)
                 if re.fullmatch(r"RID_NEXT_\d+", m):
                     # simplemente no respondas; el webhook ya se encargará de paginar
-                    return jsonify({"respuesta": None})
+                    return {"respuesta": None}, 200
 
                 # 1) Si viene un RID válido (selección de reserva), deja que lo capture el fast-path de arriba
                 if re.fullmatch(r"RID_\d+", m):
@@ -2973,10 +3085,10 @@ def api_post():
                     t = m.lower()
                     if any(w in t for w in DENIAL_WORDS) or t in {"volver", "cancelar"}:
                         guardar_estado(session_id, {"paso": "inicio", "datos": {}, "tipo_accion": None})
-                        return jsonify({
+                        return {
                             "respuesta": "Cancelación detenida. Te muestro el menú para continuar.",
                             "ui": "main_menu"
-                        })
+                        }, 200
 
                     # 3) Re-muestra la lista que tenías; si no está, reconstruye por teléfono
                     choices = (estado.get("datos") or {}).get("last_choices_cancel") or []
@@ -3013,17 +3125,17 @@ def api_post():
                             estado["datos"]["last_choices_cancel"] = choices
 
                     guardar_estado(session_id, estado)
-                    return jsonify({
+                    return {
                         "respuesta": "Por favor, elige una reserva de las disponibles.",
                         "ui": "res_list",
                         "choices": choices
-                    })
+                    }, 200
 
             # (1) Buscar por teléfono
             if estado["paso"] == "buscar":
                 telefono = interpreta_telefono(mensaje, getattr(pelu, 'country_code', None) or 'ES')
                 if not telefono:
-                    return jsonify({"respuesta": "El teléfono no es válido, ¿Puedes escribirlo de nuevo?"})
+                    return {"respuesta": "El teléfono no es válido, ¿Puedes escribirlo de nuevo?"}, 200
 
                 db = SessionLocal()
                 try:
@@ -3044,8 +3156,8 @@ def api_post():
                     if not reservas:
                         estado["paso"] = "cancelar_confirmar_continuar"
                         guardar_estado(session_id, estado)
-                        return jsonify({
-                            "respuesta": "No encuentro reservas con ese teléfono. ¿Quieres intentar con otro número? (*si*/*no*)"})
+                        return {
+                            "respuesta": "No encuentro reservas con ese teléfono. ¿Quieres intentar con otro número? (*si*/*no*)"}, 200
 
                     datos["telefono"] = telefono
 
@@ -3058,7 +3170,7 @@ def api_post():
                         estado["paso"] = "confirmar_cancelar"
                         guardar_estado(session_id, estado)
                         resumen = f"Vas a cancelar la reserva del {formatea_fecha_es(r.fecha)} a las {hhmm_str(r.hora)}."
-                        return jsonify({"respuesta": resumen + " ¿Confirmas la cancelación? (*si*/*no*)"})
+                        return {"respuesta": resumen + " ¿Confirmas la cancelación? (*si*/*no*)"}, 200
 
                     # Varias reservas → lista
                     items = []
@@ -3077,23 +3189,23 @@ def api_post():
                 datos["last_choices_cancel"] = items  # ⬅️ guarda la última lista
                 estado["paso"] = "seleccionar_reserva_cancelar"
                 guardar_estado(session_id, estado)
-                return jsonify({
+                return {
                     "respuesta": "Tienes más de una reserva",
                     "ui": "res_list",
                     "choices": items
-                })
+                }, 200
 
             # (1b) ¿Intentar con otro número?
             if estado["paso"] == "cancelar_confirmar_continuar":
                 t = (mensaje or "").strip().lower()
                 if any(w in t for w in DENIAL_WORDS):
                     reset_estado(session_id)
-                    return jsonify({"respuesta": "De acuerdo👌🏽, te devuelvo al menú principal.", "ui": "main_menu"})
+                    return {"respuesta": "De acuerdo👌🏽, te devuelvo al menú principal.", "ui": "main_menu"}, 200
                 if any(w in t for w in AFFIRM_WORDS):
                     estado["paso"] = "buscar"
                     guardar_estado(session_id, estado)
-                    return jsonify({"respuesta": "Escribe el teléfono📞 con el que hiciste la reserva que quieres cancelar."})
-                return jsonify({"respuesta": "¿Quieres intentar con otro número? (*si*/*no*)"})
+                    return {"respuesta": "Escribe el teléfono📞 con el que hiciste la reserva que quieres cancelar."}, 200
+                return {"respuesta": "¿Quieres intentar con otro número? (*si*/*no*)"}, 200
 
             # (2) Confirmación final (idempotente) + resumen + respuesta2
             if estado["paso"] == "confirmar_cancelar":
@@ -3102,22 +3214,22 @@ def api_post():
                 # Negación
                 if any(w in t for w in DENIAL_WORDS):
                     reset_estado(session_id)
-                    return jsonify({
+                    return {
                         "respuesta": "De acuerdo👌🏽, no la cancelamos, te devuelvo al menú principal.",
                         "ui": "main_menu"
-                    })
+                    }, 200
 
                 # Pide confirmación explícita
                 if not any(w in t for w in AFFIRM_WORDS):
                     guardar_estado(session_id, estado)
-                    return jsonify({
-                        "respuesta": "👉 Responde *si* para confirmar la cancelación\n👉 Responde *no* para cancelar la cancelación"})
+                    return {
+                        "respuesta": "👉 Responde *si* para confirmar la cancelación\n👉 Responde *no* para cancelar la cancelación"}, 200
 
-                explicit_key = request.headers.get("Idempotency-Key")
+                explicit_key = idempotency_key
                 payload = {"reserva_id": datos.get("reserva_id")}
                 idem_key, cached = idem_get("cancelar_confirm", pelu.id, payload, explicit_key)
                 if cached:
-                    return jsonify(cached["json"]), cached["status"]
+                    return cached["json"], cached["status"]
 
                 try:
                     # Cargar datos de la reserva (para resumen/purga/event_id)
@@ -3132,7 +3244,7 @@ def api_post():
                         if not r:
                             body = {"respuesta": "No encontré la reserva a cancelar."}
                             idem_set(idem_key, 404, body)
-                            return jsonify(body), 200  # 200 para que el usuario lo vea
+                            return body, 200  # 200 para que el usuario lo vea
                         f = ymd_str(r.fecha)
                         h = hhmm_str(r.hora)
                         srv_nombre = getattr(getattr(r, "servicio", None), "nombre", "")
@@ -3155,7 +3267,7 @@ def api_post():
                                 "respuesta": "Ahora mismo estoy terminando otra operación. Intenta cancelar de nuevo en unos segundos.",
                                 "ui": "main_menu"}
                             # Importante: NO cacheamos fallos transitorios
-                            return jsonify(body), 200
+                            return body, 200
                         _sleep_backoff(retries)
                         retries += 1
 
@@ -3165,10 +3277,11 @@ def api_post():
                         body = {"respuesta": "No he podido cancelar en este momento, inténtalo más tarde.",
                                 "ui": "main_menu"}
                         idem_set(idem_key, 200, body)  # cacheamos respuesta amable final
-                        return jsonify(body), 200
+                        return body, 200
 
                     # Si ya estaba cancelada, seguimos como OK (idempotente)
                     # ok_bd True => cancelación efectiva o ya cancelada
+                    _efecto_confirmado()
 
                     # (B) Después: intentar cancelar en Google Calendar (best-effort)
                     # Aunque falle, la reserva YA está cancelada en BD y devolvemos éxito al usuario.
@@ -3193,7 +3306,7 @@ def api_post():
 
                     # (D) OK → post_confirm con mini-resumen + segundo mensaje
                     estado["paso"] = "post_confirm"
-                    guardar_estado(session_id, estado)
+                    _guardar_estado_tras_commit(session_id, estado)
 
                     lineas = ["Reserva cancelada:"]
                     if len(getattr(pelu, "servicios", []) or []) > 1 and srv_nombre:
@@ -3206,7 +3319,7 @@ def api_post():
 
                     body = {"respuesta": f"❌ {resumen}", "respuesta2": "¿Quieres hacer algo más? (*si*/*no*)"}
                     idem_set(idem_key, 200, body)
-                    return jsonify(body), 200
+                    return body, 200
 
                 except Exception as e:
                     try:
@@ -3220,7 +3333,7 @@ def api_post():
                     body = {"respuesta": "Ocurrió un error al cancelar la reserva, inténtalo de nuevo.",
                             "ui": "main_menu"}
                     # No lo cacheo si quieres permitir reintento inmediato; si prefieres, puedes idem_set con 200
-                    return jsonify(body), 200
+                    return body, 200
 
             # (3) Post confirm (sí → menú, no → despedida y force_welcome)
             if estado["paso"] == "post_confirm":
@@ -3228,9 +3341,9 @@ def api_post():
                 if any(w in t for w in DENIAL_WORDS):
                     guardar_estado(session_id,
                                    {"paso": "inicio", "datos": {}, "tipo_accion": None, "force_welcome": True})
-                    return jsonify({"respuesta": "Entendido. ¡Que tengas un buen día! 👋"})
+                    return {"respuesta": "Entendido. ¡Que tengas un buen día! 👋"}, 200
                 guardar_estado(session_id, {"paso": "inicio", "datos": {}, "tipo_accion": None})
-                return jsonify({"respuesta": "Perfecto, te muestro el menú para continuar", "ui": "main_menu"})
+                return {"respuesta": "Perfecto, te muestro el menú para continuar", "ui": "main_menu"}, 200
 
         # ---------------------------------------------------------
         # FLUJO: DUDA
@@ -3243,48 +3356,140 @@ def api_post():
                 if any(w in t for w in AFFIRM_WORDS):
                     estado["paso"] = "duda"
                     guardar_estado(session_id, estado)
-                    return jsonify({"respuesta": "¡Perfecto! Cuéntame tu otra duda.❓"})
+                    return {"respuesta": "¡Perfecto! Cuéntame tu otra duda.❓"}, 200
 
                 if any(w in t for w in DENIAL_WORDS):
                     guardar_estado(session_id,{"paso": "inicio", "datos": {}, "tipo_accion": None, "force_welcome": True})
-                    return jsonify({"respuesta": "¡Perfecto! Si necesitas algo más, aquí estoy.👋"})
+                    return {"respuesta": "¡Perfecto! Si necesitas algo más, aquí estoy.👋"}, 200
 
                 # Entrada ambigua → repregunta
                 guardar_estado(session_id, estado)
-                return jsonify({"respuesta": "¿Tienes otra duda? (*si*/*no*)."})
+                return {"respuesta": "¿Tienes otra duda? (*si*/*no*)."}, 200
 
             # Respuesta libre de IA a la duda
             if estado["paso"] == "duda":
                 try:
-                    respuesta_ia = interpreta_ia(mensaje, "duda", pelu)
+                    # Preguntas repetidas (o casi) de esta peluquería salen de caché sin ir a la IA
+                    respuesta_ia = faq.responder(pelu, mensaje, lambda: interpreta_ia(mensaje, "duda", pelu))
                 except Exception as e:
                     sentry_sdk.capture_exception(e)
                     logging.error(f"Error llamando a interpreta_ia: {e}", exc_info=True)
                     guardar_estado(session_id,{"paso": "inicio", "datos": {}, "tipo_accion": None, "force_welcome": True}
                     )
-                    return jsonify({
+                    return {
                         "respuesta": "No he podido consultar la información. Intentalo más tarde."
-                    })
+                    }, 200
                 # Tras responder, pasamos a confirmar si quiere otra duda
                 estado["paso"] = "duda_confirmar"
                 guardar_estado(session_id, estado)
-                return jsonify({"respuesta": f"{respuesta_ia}\n\n¿Tienes otra duda? (*si*/*no*)"})
+                return {"respuesta": f"{respuesta_ia}\n\n¿Tienes otra duda? (*si*/*no*)"}, 200
 
         # Si llegamos aquí, el estado no encaja
         guardar_estado(session_id, {"paso": "inicio", "datos": {}, "tipo_accion": None})
-        return jsonify({"respuesta": return_text(pelu.nombre, pelu.tipo_negocio), "ui": "main_menu"})
+        return {"respuesta": return_text(pelu.nombre, pelu.tipo_negocio), "ui": "main_menu"}, 200
 
 
     except Exception as e:
         sentry_sdk.capture_exception(e)
 
-        logging.error(f"Error en api_post: {e}", exc_info=True)
+        logging.error(f"Error en procesar_mensaje: {e}", exc_info=True)
 
         guardar_estado(session_id,{"paso": "inicio", "datos": {}, "tipo_accion": None, "force_welcome": True})
 
-        return jsonify({
+        return {
             "respuesta": "Ha ocurrido un error interno. Por favor, inténtalo más tarde."
-        }), 500
+        }, 500
+
+
+# ================================================
+# Webhook de Google Calendar (notificaciones push)
+# ================================================
+_gcal_pending: set = set()
+_gcal_pending_lock = threading.Lock()
+
+def _gcal_refresh(chan: dict):
+    """
+    Sincroniza el espejo del calendario y purga la caché de horas SOLO de los días que cambiaron.
+    sync_changes() devuelve también los días que dejaron pendientes el cron o las escrituras propias
+    si sincronizaron antes que este aviso (con push el TTL de la caché de horas es de horas).
+    """
+    cal_id = chan.get("cal_id")
+    with _gcal_pending_lock:
+        _gcal_pending.discard(cal_id)
+    pelu = tenants.get_by_id(chan.get("pelu_id"))
+    if not pelu:
+        return
+    fechas = mirror.sync_changes(cal_id, getattr(pelu, "tz", None) or settings.CAL_TZ)
+    if fechas is None:
+        # sin saber qué cambió no podemos fiarnos de la caché larga: purgamos todo el horizonte
+        logging.warning("gcal push: sync fallida para pelu %s, purga completa", pelu.id)
+        hoy = now_local(pelu).date()
+        max_dias = int(getattr(pelu, "max_avance_dias", 150) or 150)
+        fechas = {hoy + timedelta(days=i) for i in range(max_dias + 1)}
+    for f in sorted(fechas):
+        purge_horas_cache(pelu, f.strftime("%Y-%m-%d"))
+
+
+@app.route("/webhook/gcal", methods=["POST"])
+def gcal_notify():
+    chan = watcher.verify(
+        request.headers.get("X-Goog-Channel-ID", ""),
+        request.headers.get("X-Goog-Channel-Token", ""),
+        request.headers.get("X-Goog-Resource-ID", ""),
+    )
+    if chan is None:
+        return "", 403
+
+    # "sync" es el aviso inicial al crear el canal: no hay cambios que aplicar
+    if request.headers.get("X-Goog-Resource-State") == "sync":
+        return "", 200
+
+    # Coalesce: si ya hay un refresco pendiente para este calendario, ese verá también este cambio
+    cal_id = chan.get("cal_id")
+    with _gcal_pending_lock:
+        if cal_id in _gcal_pending:
+            return "", 200
+        _gcal_pending.add(cal_id)
+    if not CORE_EXECUTOR.submit(f"gcal:{cal_id}", chan.get("pelu_id"), _gcal_refresh, chan):
+        with _gcal_pending_lock:
+            _gcal_pending.discard(cal_id)
+        return "", 503  # Google reintenta con backoff
+    return "", 200
+
+
+@app.route("/webhook", methods=["POST"])
+def api_post():
+    """Adaptador HTTP sobre procesar_mensaje (autenticado por API key en cabecera)."""
+    data = request.get_json(force=True, silent=True) or {}
+
+    # Seguridad: solo API key por cabecera
+    api_key = request.headers.get("X-API-KEY")
+    session_id = data.get("session_id")
+    mensaje = data.get("mensaje", "")
+    origin = (data.get("origin") or "text").lower().strip()
+
+    if not api_key or not session_id or not mensaje:
+        return jsonify({
+            "respuesta": "No he podido procesar tu mensaje ahora mismo. Inténtalo más tarde.",
+            "ui": "main_menu"
+        }), 200
+
+    pelu = get_peluqueria_by_api_key(api_key)
+    if not pelu:
+        return jsonify({
+            "respuesta": f"No he podido identificar la {getattr(pelu, 'tipo_negocio', 'negocio')}. Inténtalo más tarde.",
+            "ui": "main_menu"
+        }), 200
+
+    body, status = procesar_mensaje(
+        pelu,
+        session_id,
+        mensaje,
+        origin=origin,
+        idempotency_key=request.headers.get("Idempotency-Key"),
+    )
+    return jsonify(body), status
+
 
 # ================================================
 # Main (solo DEV)
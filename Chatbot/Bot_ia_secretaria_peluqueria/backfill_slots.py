@@ -0,0 +1,38 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+backfill_slots.py — Rellena las tablas slot_ocupacion / slot_ocupacion_peluquero
+a partir de las reservas confirmadas (desde hoy, o desde la fecha indicada).
+
+Uso (una vez tras `alembic upgrade head`, ANTES de activar SLOT_INVENTARIO_ENABLED):
+    /opt/bot-pelu/.venv/bin/python /opt/bot-pelu/backfill_slots.py [YYYY-MM-DD]
+
+Es idempotente: borra el inventario desde esa fecha y lo vuelve a calcular, así que
+también sirve para corregirlo si alguien edita reservas o duraciones a mano en la BD.
+"""
+
+import logging
+import sys
+from datetime import date, datetime
+
+from db import SessionLocal
+from slot_inventario import backfill
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger("backfill_slots")
+
+
+def main():
+    desde = datetime.strptime(sys.argv[1], "%Y-%m-%d").date() if len(sys.argv) > 1 else date.today()
+    with SessionLocal() as db:
+        try:
+            n = backfill(db, desde)
+            db.commit()
+        except Exception:
+            db.rollback()
+            raise
+    log.info("Inventario de slots rehecho desde %s: %d reservas confirmadas", desde.isoformat(), n)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,7 +1,7 @@
 # bd_utils.py — versión compatible con retornos int/bool
 # Concurrencia:
 # - Advisory lock por (peluqueria_id, fecha) con GET_LOCK/RELEASE_LOCK (no-op si no existe)
-# - Bloqueos row-level con with_for_update() en Peluqueria, Servicio y Reservas del día
+# - Bloqueo row-level (with_for_update) solo de las reservas del rango que puede solapar
 # - Transacción controlada explícitamente con commit/rollback (sin context manager)
 # - Retornos preservados: int | True | False
 
@@ -11,13 +11,19 @@ import logging
 from datetime import datetime, time
 from typing import List, Optional
 
-from sqlalchemy import text
+from sqlalchemy import func, text
+from sqlalchemy.exc import DBAPIError
 from sqlalchemy.orm import selectinload
 
 from settings import settings
 from db import SessionLocal
 from models import Reserva, Servicio, Peluqueria
 from reserva_utils import _overlap
+from slot_locks import get_slot_locks
+import slot_inventario
+
+# Backend de locks por franja (settings.SLOT_LOCK_BACKEND)
+SLOT_LOCKS = get_slot_locks(settings)
 
 
 # -------- utilidades de locking por (peluqueria, fecha) --------
@@ -95,34 +101,83 @@ def _slot_keys(peluqueria_id: int, fecha_str: str, hora_str: str, dur_min: int,
         m += step_min
     return keys
 
-def _acquire_locks(db, keys: list[str], timeout_sec: int = 5) -> list[str] | None:
+def _acquire_locks_batch(db, keys: list[str], timeout_sec: int = 5) -> list[str] | None:
     """
-    Intenta adquirir TODOS los locks de la lista.
-    Si alguno falla, libera los ya adquiridos y devuelve None.
+    Adquiere TODOS los locks de la lista en UNA sola sentencia (MySQL 5.7+ permite varios named locks por sesión):
+      SELECT GET_LOCK(:k0, :t) AND GET_LOCK(:k1, :t) AND ...
+    Devuelve las claves cogidas, o None si alguna falla (no queda ninguna cogida).
+    - Claves ordenadas y sin duplicados: dos reservas que se pisan piden los locks en el mismo orden.
+    - AND corta en el primer 0/NULL; lo que ya se hubiera cogido se suelta con RELEASE_ALL_LOCKS().
+    - Latencia ~constante sea cual sea la duración del servicio (1 ida y vuelta, no N).
     """
-    acquired = []
     if not keys:
         return []
-    # repartimos un pequeño tiempo por lock (p.ej. timeout total ÷ nº locks, mínimo 1s)
-    per_lock = max(1, int(timeout_sec / max(1, len(keys))))
-    for k in keys:
-        if not _acquire_lock(db, k, timeout=per_lock):
-            # falló: liberar los que ya tenemos
-            for ak in reversed(acquired):
-                try:
-                    _release_lock(db, ak)
-                except Exception:
-                    pass
-            return None
-        acquired.append(k)
-    return acquired
-
-def _release_locks(db, keys: list[str]):
-    for k in keys or []:
-        try:
-            _release_lock(db, k)
-        except Exception:
-            pass
+    keys = sorted(set(keys))
+    if not _is_mysql(db):
+        return keys
+
+    per_lock = max(1, int(timeout_sec / len(keys)))
+    sql = "SELECT " + " AND ".join(f"GET_LOCK(:k{i}, :t)" for i in range(len(keys)))
+    params = {f"k{i}": k for i, k in enumerate(keys)}
+    params["t"] = per_lock
+    try:
+        val = db.execute(text(sql), params).scalar()
+    except Exception:
+        _release_all_locks(db)
+        return None if getattr(settings, "STRICT_LOCKS", True) else keys
+    if val != 1:
+        _release_all_locks(db)
+        return None
+    return keys
+
+def _release_all_locks(db) -> None:
+    """Suelta todos los named locks de la sesión en una sola sentencia."""
+    if not _is_mysql(db):
+        return
+    try:
+        db.execute(text("SELECT RELEASE_ALL_LOCKS()"))
+    except Exception:
+        pass
+
+def _reservas_en_rango(db, peluqueria_id: int, fecha, hora: time, dur_min: int) -> List[Reserva]:
+    """
+    Reservas confirmadas del día que pueden solapar con [hora, hora+dur_min), con FOR UPDATE.
+    Una reserva existente solapa si empieza antes del fin y después de (inicio - su duración);
+    como cota se usa la duración máxima del catálogo => el rango de índice (pelu, fecha, hora)
+    bloqueado es estrecho y reservas de otras franjas del mismo día no esperan.
+    """
+    max_dur = db.query(func.max(Servicio.duracion_min)).filter(Servicio.peluqueria_id == peluqueria_id).scalar()
+    max_dur = max(int(max_dur or 0), int(dur_min or 0))
+    start = _mins(hora)
+    end = start + int(dur_min or 0)
+
+    q = (
+        db.query(Reserva)
+        .options(selectinload(Reserva.servicio))
+        .filter(
+            Reserva.peluqueria_id == peluqueria_id,
+            Reserva.fecha == fecha,
+            Reserva.estado == "confirmada",
+        )
+    )
+    if start - max_dur >= 0:
+        lo = start - max_dur
+        q = q.filter(Reserva.hora > time(lo // 60, lo % 60))
+    if end < 24 * 60:
+        q = q.filter(Reserva.hora < time(end // 60, end % 60))
+    return q.with_for_update().all()
+
+def _config_reserva(peluqueria_id: int, servicio_id: int) -> tuple[int, int, int, Optional[float]]:
+    """(duración, capacidad, paso de reservas, precio) leídos en una sesión propia que se cierra al salir."""
+    with SessionLocal() as db:
+        pelu = db.query(Peluqueria).filter(Peluqueria.id == peluqueria_id).one()
+        servicio = db.query(Servicio).filter(Servicio.id == servicio_id).one()
+        return (
+            int(getattr(servicio, "duracion_min", 30) or 30),
+            int(getattr(pelu, "num_peluqueros", 1) or 1),
+            int(getattr(pelu, "rango_reservas", 15) or 15),
+            getattr(servicio, "precio", None),
+        )
 
 # -------------------- operaciones principales --------------------
 def guardar_reserva_db(
@@ -133,58 +188,63 @@ def guardar_reserva_db(
     fecha_str: str,   # "YYYY-MM-DD"
     hora_str: str,    # "HH:MM"
     event_id: Optional[str] = None,
+    peluquero_id: Optional[int] = None,
 ):
     """
-    Devuelve: ID (int) en éxito, False si no hay hueco/lock timeout, o raise en error inesperado.
+    Devuelve: ID (int) en éxito, {"error": "no_slot" | "lock_timeout"} si no se pudo, o raise en error inesperado.
+    Con SLOT_INVENTARIO_ENABLED la capacidad sale de slot_ocupacion (y slot_ocupacion_peluquero si hay peluquero_id).
     """
-    db = SessionLocal()
-    slot_locks = None
+    locks = SLOT_LOCKS
+    lease = None
+    db = None
     try:
         # --- INPUTS ya los tienes ---
         fecha = datetime.strptime(fecha_str, "%Y-%m-%d").date()
         hora = datetime.strptime(hora_str, "%H:%M").time()
 
-        # 2) Cargar peluquería y servicio con bloqueo
-        pelu = (
-            db.query(Peluqueria)
-            .filter(Peluqueria.id == peluqueria_id)
-            .with_for_update()
-            .one()
-        )
-        servicio = (
-            db.query(Servicio)
-            .filter(Servicio.id == servicio_id)
-            .with_for_update()
-            .one()
-        )
-
-        duracion = int(getattr(servicio, "duracion_min", 30) or 30)
-        capacidad = int(getattr(pelu, "num_peluqueros", 1) or 1)
-        step = int(getattr(pelu, "rango_reservas", 15) or 15)
+        # 1) Config de peluquería y servicio en una sesión corta que se cierra antes de esperar ningún lock
+        #    (sin bloqueo de fila: bloquear la peluquería serializaba todas sus reservas, de cualquier día)
+        duracion, capacidad, step, precio = _config_reserva(peluqueria_id, servicio_id)
 
-        # 1) 🔒 Lock por FRANJA (todos los slots que ocupa la reserva)
+        # 2) 🔒 Lease de Redis ANTES de abrir la sesión de la reserva: la espera por un hueco disputado
+        #    no retiene una conexión del pool (GET_LOCK, en cambio, vive en la propia sesión)
         slot_keys = _slot_keys(peluqueria_id, fecha_str, hora_str, duracion, step)
-        slot_locks = _acquire_locks(db, slot_keys, timeout_sec=5)
-        if slot_locks is None:
-            return {"error": "lock_timeout"}
-
-        # 3) Traer reservas del día con bloqueo (para conteo de solapes)
-        reservas_dia = (
-            db.query(Reserva)
-            .options(selectinload(Reserva.servicio))
-            .filter(
-                Reserva.peluqueria_id == peluqueria_id,
-                Reserva.fecha == fecha,
-                Reserva.estado == "confirmada",
-            )
-            .with_for_update()
-            .all()
-        )
-
-        # 4) Contar solapes vs capacidad
-        if _contar_solapes(reservas_dia, hora, duracion) >= capacidad:
-            db.rollback()
-            return {"error": "no_slot"}
+        if not settings.SLOT_INVENTARIO_ENABLED and not locks.needs_session:
+            lease = locks.acquire(None, slot_keys, timeout_sec=5)
+            if lease is None:
+                return {"error": "lock_timeout"}
+
+        db = SessionLocal()
+        if settings.SLOT_INVENTARIO_ENABLED:
+            # 1-4) Capacidad por inventario: UPDATE condicional de los tramos (sin named locks ni leer el día)
+            try:
+                hay_hueco = slot_inventario.ocupar(db, peluqueria_id, fecha, hora, duracion, capacidad, peluquero_id)
+            except DBAPIError:
+                # deadlock / lock wait timeout en las filas de inventario: el llamante reintenta
+                db.rollback()
+                return {"error": "lock_timeout"}
+            if not hay_hueco:
+                db.rollback()
+                return {"error": "no_slot"}
+        else:
+            # 2) 🔒 Lock por FRANJA con GET_LOCK (todos los slots que ocupa la reserva, en una sola sentencia)
+            if lease is None:
+                lease = locks.acquire(db, slot_keys, timeout_sec=5)
+                if lease is None:
+                    return {"error": "lock_timeout"}
+
+            # 3) Solo las reservas que PUEDEN solapar: hora en (inicio - duración máx., fin)
+            reservas_dia = _reservas_en_rango(db, peluqueria_id, fecha, hora, duracion)
+
+            # 4) Contar solapes vs capacidad (y el peluquero, si viene, solo puede tener una a la vez)
+            if _contar_solapes(reservas_dia, hora, duracion) >= capacidad:
+                db.rollback()
+                return {"error": "no_slot"}
+            if peluquero_id and _contar_solapes(
+                [r for r in reservas_dia if r.peluquero_id == peluquero_id], hora, duracion
+            ):
+                db.rollback()
+                return {"error": "no_slot"}
 
         # 5) Insert atómico (igual que antes)
         nueva = Reserva(
@@ -196,31 +256,39 @@ def guardar_reserva_db(
             hora=hora,
             estado="confirmada",
             event_id=event_id,
+            peluquero_id=peluquero_id,
         )
         if hasattr(nueva, "duracion_min"):
             setattr(nueva, "duracion_min", duracion)
-        if hasattr(nueva, "precio") and hasattr(servicio, "precio"):
-            setattr(nueva, "precio", getattr(servicio, "precio"))
+        if hasattr(nueva, "precio") and precio is not None:
+            setattr(nueva, "precio", precio)
 
         db.add(nueva)
         db.flush()
         db.refresh(nueva)
+        # Fence más viejo que el último escrito (solo Redis) => otra reserva pudo contar sin vernos: no confirmamos
+        if lease is not None and not locks.fence_write(db, lease):
+            db.rollback()
+            return {"error": "lock_timeout"}
         db.commit()
         return int(nueva.id)
 
     except Exception:
         try:
-            db.rollback()
+            if db is not None:
+                db.rollback()
         except Exception:
             pass
         raise
     finally:
-        # 🔓 liberar SIEMPRE los locks de slots (no del día)
-        try:
-            _release_locks(db, slot_locks or [])
-        except Exception:
-            pass
-        db.close()
+        # 🔓 liberar SIEMPRE los locks de slots
+        if lease is not None:
+            try:
+                locks.release(db, lease)
+            except Exception:
+                pass
+        if db is not None:
+            db.close()
 
 def set_event_id_db(reserva_id: int, event_id: str) -> bool:
     db = SessionLocal()
@@ -286,6 +354,9 @@ def cancelar_reserva_db(reserva_id: int):
             return {"ok": True, "skipped": "already_cancelled"}
 
         r.estado = "cancelada"
+        if settings.SLOT_INVENTARIO_ENABLED:
+            slot_inventario.liberar(db, r.peluqueria_id, r.fecha, r.hora,
+                                    slot_inventario.duracion_de(r), getattr(r, "peluquero_id", None))
         try:
             if hasattr(r, "updated_at"):
                 r.updated_at = datetime.utcnow()
@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+bench_fechas.py — Compara el parseo de fechas del paso "fecha":
+  - antes: dateparser.parse(...) con un dict de settings nuevo en cada mensaje
+  - ahora: fecha_es.parse_fecha (gramática regex + DateDataParser reutilizado)
+
+Uso:
+    python bench_fechas.py [repeticiones]
+
+No llama a la IA: solo mide la parte local y cuenta cuántas entradas acabarían en ella
+(None = se iría a interpreta_ia).
+"""
+
+import sys
+import time
+from datetime import datetime
+
+import dateparser
+
+from fecha_es import parse_fecha
+
+ENTRADAS = [
+    "03/09/2025", "3/9/25", "3-9-25", "2025-09-03", "15 de octubre", "15 octubre 2025",
+    "oct 15", "15 oct 25", "octubre 15, 2025", "3 de octubre de 2025", "25 dic 25",
+    "mañana", "pasado mañana", "hoy", "el lunes", "el viernes que viene", "el 20",
+    "mañana por la tarde", "dentro de una semana", "cuando podáis",
+]
+
+
+def _antes(texto, base):
+    dt = dateparser.parse(
+        texto,
+        languages=["es"],
+        settings={"DATE_ORDER": "DMY", "PREFER_DAY_OF_MONTH": "first", "RELATIVE_BASE": base},
+    )
+    return dt.date() if dt else None
+
+
+def _medir(fn, n):
+    fallos = 0
+    t0 = time.perf_counter()
+    for _ in range(n):
+        for e in ENTRADAS:
+            if fn(e) is None:
+                fallos += 1
+    total = time.perf_counter() - t0
+    return total / (n * len(ENTRADAS)) * 1000, fallos // n
+
+
+def main():
+    n = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+    base = datetime.now()
+    hoy = base.date()
+    _antes("hoy", base)            # no contar la carga inicial de idiomas de dateparser
+    parse_fecha("hoy", hoy)
+
+    for nombre, fn in (
+        ("dateparser.parse (antes)", lambda e: _antes(e, base)),
+        ("fecha_es.parse_fecha", lambda e: parse_fecha(e, hoy)),
+    ):
+        ms, fallos = _medir(fn, n)
+        print(f"{nombre:28s} {ms:8.3f} ms/mensaje   sin fecha (-> IA): {fallos}/{len(ENTRADAS)}")
+
+
+if __name__ == "__main__":
+    main()
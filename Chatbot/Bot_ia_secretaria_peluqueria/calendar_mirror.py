@@ -0,0 +1,419 @@
+# calendar_mirror.py — espejo local de los eventos de Google Calendar (por cal_id)
+# - Se guarda en storage (Redis o memoria), troceado por día local de la peluquería:
+#     gcal:mirror:{cal_id}              -> meta {"sync_token", "synced_at", "tz", "desde", "hasta"}
+#     gcal:mirror:{cal_id}:d:{AAAA-MM-DD} -> {event_id: {"start": {...}, "end": {...}}} de ese día
+#     gcal:mirror:{cal_id}:idx          -> {event_id: [días]} (para mover/borrar eventos; solo lo usan las escrituras)
+#     gcal:mirror:{cal_id}:dirty        -> [días] cambiados que aún no ha purgado nadie de la caché de horas
+# - Solo una ventana [hoy - KEEP_PAST_DAYS, hoy + CAL_MIRROR_HORIZON_DAYS]; sync completa con timeMin/timeMax
+# - Sincronización incremental con syncToken; completa si no hay token, Google responde 410 o la ventana se queda corta
+# - Sincronizan el cron (sync_calendars.py) y los avisos push; las lecturas NUNCA van a la red:
+#   sin espejo fresco que cubra los días pedidos devuelven None y el llamante consulta Calendar en vivo
+# - Escritores de distintos procesos se excluyen con un lock en storage (gcal:mirror:{cal_id}:lock)
+# - Todo camino que cambia días (cron, push, escrituras propias) los apunta en :dirty; sync_changes()
+#   los consume, así el refresco del push purga también lo que sincronizó otro antes que él
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import date, datetime, timedelta
+from typing import Callable, Optional
+from zoneinfo import ZoneInfo
+
+import sentry_sdk
+from googleapiclient.errors import HttpError
+
+from settings import settings
+from storage import get_storage
+
+MIRROR_TTL = 7 * 24 * 3600  # sin syncs en una semana => se rehace desde cero
+KEEP_PAST_DAYS = 1          # días ya pasados que se conservan en la ventana
+RESYNC_MARGIN_DAYS = 3      # la ventana se rehace (sync completa) al perder estos días por delante;
+                            # así toda clave de día se reescribe mucho antes de caducar (MIRROR_TTL)
+LOCK_TTL = 120              # vida máxima del lock entre procesos (una sync completa cabe de sobra)
+SYNC_LOCK_WAIT = 30.0       # una sync espera a la que esté en curso (cron vs push)
+PATCH_LOCK_WAIT = 2.0       # una escritura propia no espera más: el próximo sync la traerá igualmente
+
+
+def mirror_key(cal_id: str) -> str:
+    return f"gcal:mirror:{cal_id}"
+
+
+def day_key(cal_id: str, d: date) -> str:
+    return f"gcal:mirror:{cal_id}:d:{d.isoformat()}"
+
+
+def _idx_key(cal_id: str) -> str:
+    return f"gcal:mirror:{cal_id}:idx"
+
+
+def _dirty_key(cal_id: str) -> str:
+    return f"gcal:mirror:{cal_id}:dirty"
+
+
+def _lock_key(cal_id: str) -> str:
+    return f"gcal:mirror:{cal_id}:lock"
+
+
+def _http_status(e: HttpError):
+    status = getattr(e, "status_code", None) or getattr(getattr(e, "resp", None), "status", None)
+    try:
+        return int(status)
+    except Exception:
+        return None
+
+
+def _slim(ev: dict) -> dict:
+    """Solo lo necesario para calcular ocupación (sin summary/description = sin PII)."""
+    return {"start": dict(ev.get("start") or {}), "end": dict(ev.get("end") or {})}
+
+
+def _start_key(ev: dict) -> str:
+    start = ev.get("start") or {}
+    return start.get("dateTime") or start.get("date") or ""
+
+
+def _dias(desde: date, hasta: date) -> list:
+    return [desde + timedelta(days=i) for i in range((hasta - desde).days + 1)]
+
+
+def _medianoche(d: date, tz: ZoneInfo) -> str:
+    return datetime(d.year, d.month, d.day, tzinfo=tz).isoformat()
+
+
+def _json(obj) -> str:
+    return json.dumps(obj, separators=(",", ":"), sort_keys=True)
+
+
+def event_dates(ev: dict, tz: ZoneInfo) -> list:
+    """Días locales (date) que ocupa un evento (fin exclusivo)."""
+    start, end = ev.get("start") or {}, ev.get("end") or {}
+    try:
+        if start.get("dateTime") and end.get("dateTime"):
+            s_loc = datetime.fromisoformat(start["dateTime"]).astimezone(tz)
+            e_loc = datetime.fromisoformat(end["dateTime"]).astimezone(tz)
+            d, last = s_loc.date(), (e_loc - timedelta(microseconds=1)).date()
+        elif start.get("date") and end.get("date"):
+            d = datetime.strptime(start["date"], "%Y-%m-%d").date()
+            last = datetime.strptime(end["date"], "%Y-%m-%d").date() - timedelta(days=1)
+        else:
+            return []
+    except Exception:
+        return []
+    out = []
+    while d <= last:
+        out.append(d)
+        d += timedelta(days=1)
+    return out
+
+
+class CalendarMirror:
+    def __init__(
+        self,
+        storage=None,
+        service_factory: Optional[Callable] = None,
+        max_staleness: int = 180,
+        clock: Callable[[], float] = time.time,
+    ):
+        self._storage = storage or get_storage(settings)
+        self._service_factory = service_factory
+        self._max_staleness = int(max_staleness)
+        self._clock = clock
+        self._locks: dict[str, threading.Lock] = {}
+        self._locks_guard = threading.Lock()
+
+    def _service(self):
+        if self._service_factory is not None:
+            return self._service_factory()
+        from google_calendar_utils import get_calendar_service
+        return get_calendar_service()
+
+    def _lock_for(self, cal_id: str) -> threading.Lock:
+        with self._locks_guard:
+            return self._locks.setdefault(cal_id, threading.Lock())
+
+    @contextmanager
+    def _locked(self, cal_id: str, wait: float):
+        """Exclusión entre hilos (lock local) y entre procesos (SET NX en storage). Cede False si no lo consigue."""
+        deadline = time.monotonic() + wait
+        local = self._lock_for(cal_id)
+        if not local.acquire(timeout=wait):
+            yield False
+            return
+        try:
+            key, token = _lock_key(cal_id), uuid.uuid4().hex
+            while not self._storage.set_if_absent(key, token, ttl=LOCK_TTL):
+                if time.monotonic() >= deadline:
+                    yield False
+                    return
+                time.sleep(0.05)
+            try:
+                yield True
+            finally:
+                if self._storage.get(key) == token:
+                    self._storage.delete(key)
+        finally:
+            local.release()
+
+    def _today(self, tz: ZoneInfo) -> date:
+        return datetime.fromtimestamp(self._clock(), tz).date()
+
+    # ---------- estado ----------
+    def load(self, cal_id: str) -> Optional[dict]:
+        """Meta del espejo (token, última sync, zona y ventana) o None."""
+        return self._load_json(mirror_key(cal_id))
+
+    def _load_json(self, key: str) -> Optional[dict]:
+        raw = self._storage.get(key)
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            return None
+
+    def _load_days(self, cal_id: str, dias: list) -> dict:
+        """{date: {event_id: evento}} de los días pedidos (un solo MGET)."""
+        out = {}
+        for d, raw in zip(dias, self._storage.mget([day_key(cal_id, d) for d in dias])):
+            try:
+                out[d] = json.loads(raw) if raw else {}
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                out[d] = {}
+        return out
+
+    def _write_days(self, cal_id: str, docs: dict, dias) -> None:
+        llenos = {day_key(cal_id, d): _json(docs[d]) for d in dias if docs.get(d)}
+        vacios = [day_key(cal_id, d) for d in dias if not docs.get(d)]
+        if llenos:
+            self._storage.mset_ex(llenos, ttl=MIRROR_TTL)
+        if vacios:
+            self._storage.delete_many(vacios)
+
+    def _mark_dirty(self, cal_id: str, fechas) -> None:
+        """Apunta días cambiados hasta que un sync_changes() los consuma (con el lock cogido)."""
+        if not fechas:
+            return
+        pendientes = {d.isoformat() for d in fechas} | set(self._load_json(_dirty_key(cal_id)) or [])
+        # más viejo que el TTL largo de la caché de horas ya no hace falta purgarlo
+        self._storage.setex(_dirty_key(cal_id), _json(sorted(pendientes)),
+                            ttl=int(settings.HORAS_CACHE_TTL_PUSH_SECONDS))
+
+    def _take_dirty(self, cal_id: str) -> set:
+        pendientes = self._load_json(_dirty_key(cal_id)) or []
+        if pendientes:
+            self._storage.delete(_dirty_key(cal_id))
+        return {date.fromisoformat(x) for x in pendientes}
+
+    def _save_meta(self, cal_id: str, meta: dict) -> None:
+        self._storage.setex(mirror_key(cal_id), _json(meta), ttl=MIRROR_TTL)
+
+    @staticmethod
+    def _ventana(meta: dict) -> tuple[date, date]:
+        return date.fromisoformat(meta["desde"]), date.fromisoformat(meta["hasta"])
+
+    # ---------- sincronización ----------
+    def sync(self, cal_id: str, tzname: Optional[str] = None) -> bool:
+        """Trae los cambios desde el último syncToken (o todo si no hay). True si quedó al día."""
+        return self._sync(cal_id, tzname) is not None
+
+    def sync_changes(self, cal_id: str, tzname: str) -> Optional[set]:
+        """
+        Como sync(), pero devuelve los días locales (date) con eventos nuevos, cambiados o borrados
+        pendientes de purgar: los de esta sync y los que dejaron otras (cron, escrituras propias).
+        Quien llama se compromete a purgarlos; None si la sync falló (no se sabe qué cambió).
+        """
+        return self._sync(cal_id, tzname, consumir=True)
+
+    def _sync(self, cal_id: str, tzname: Optional[str], consumir: bool = False) -> Optional[set]:
+        if not cal_id:
+            return None
+        try:
+            with self._locked(cal_id, SYNC_LOCK_WAIT) as ok:
+                if not ok:
+                    logging.warning("Sync de %s en curso en otro proceso: se omite", cal_id)
+                    return None
+                meta = self.load(cal_id)
+                tz = ZoneInfo(tzname or (meta or {}).get("tz") or settings.CAL_TZ)
+                hoy = self._today(tz)
+                horizonte = int(settings.CAL_MIRROR_HORIZON_DAYS)
+                incremental = (
+                    meta is not None and meta.get("sync_token") and meta.get("tz") == tz.key
+                    and (self._ventana(meta)[1] - hoy).days > horizonte - RESYNC_MARGIN_DAYS
+                )
+                touched = None
+                if incremental:
+                    try:
+                        touched = self._sync_incremental(cal_id, meta, tz)
+                    except HttpError as e:
+                        if _http_status(e) != 410:
+                            raise
+                        # syncToken caducado: Google exige sync completa
+                        logging.info("syncToken caducado para %s: resync completo", cal_id)
+                if touched is None:
+                    touched = self._sync_completo(cal_id, meta, tz, hoy)
+                if consumir:
+                    return touched | self._take_dirty(cal_id)
+                self._mark_dirty(cal_id, touched)
+                return touched
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            logging.error("Error sincronizando calendario %s: %s", cal_id, e, exc_info=True)
+            return None
+
+    def _list(self, cal_id: str, extra: dict) -> tuple[list, Optional[str]]:
+        """Todas las páginas de events.list; devuelve (items, nextSyncToken)."""
+        service = self._service()
+        items, page_token = [], None
+        while True:
+            params = {"calendarId": cal_id, "singleEvents": True, "maxResults": 2500, **extra}
+            if page_token:
+                params["pageToken"] = page_token
+            resp = service.events().list(**params).execute() or {}
+            items.extend(resp.get("items", []) or [])
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                return items, resp.get("nextSyncToken")
+
+    def _sync_completo(self, cal_id: str, meta: Optional[dict], tz: ZoneInfo, hoy: date) -> set:
+        desde = hoy - timedelta(days=KEEP_PAST_DAYS)
+        hasta = hoy + timedelta(days=int(settings.CAL_MIRROR_HORIZON_DAYS))
+        # timeMin/timeMax sí se admiten en la sync inicial; las incrementales solo llevan el syncToken
+        items, token = self._list(cal_id, {
+            "timeMin": _medianoche(desde, tz),
+            "timeMax": _medianoche(hasta + timedelta(days=1), tz),
+            "showDeleted": False,
+        })
+        nuevos: dict = {}
+        idx: dict = {}
+        for ev in items:
+            eid = ev.get("id")
+            if not eid or ev.get("status") == "cancelled":
+                continue
+            dias = [d for d in event_dates(ev, tz) if desde <= d <= hasta]
+            for d in dias:
+                nuevos.setdefault(d, {})[eid] = _slim(ev)
+            if dias:
+                idx[eid] = [d.isoformat() for d in dias]
+
+        # días que cambian respecto a lo guardado (ventana anterior ∪ nueva)
+        todos = set(_dias(desde, hasta))
+        if meta and meta.get("desde") and meta.get("hasta"):
+            todos |= set(_dias(*self._ventana(meta)))
+        todos = sorted(todos)
+        viejos = self._load_days(cal_id, todos)
+        touched = {d for d in todos if viejos[d] != nuevos.get(d, {})}
+        # se reescriben todos los días con eventos (renueva su TTL), no solo los cambiados
+        self._write_days(cal_id, nuevos, set(nuevos) | touched)
+        self._storage.setex(_idx_key(cal_id), _json(idx), ttl=MIRROR_TTL)
+        self._save_meta(cal_id, {
+            "sync_token": token, "synced_at": self._clock(), "tz": tz.key,
+            "desde": desde.isoformat(), "hasta": hasta.isoformat(),
+        })
+        return touched
+
+    def _sync_incremental(self, cal_id: str, meta: dict, tz: ZoneInfo) -> set:
+        items, token = self._list(cal_id, {"syncToken": meta["sync_token"]})
+        touched = self._aplicar(cal_id, meta, tz, items) if items else set()
+        self._save_meta(cal_id, dict(meta, sync_token=token, synced_at=self._clock()))
+        return touched
+
+    def _aplicar(self, cal_id: str, meta: dict, tz: ZoneInfo, items: list) -> set:
+        """Aplica altas/cambios/bajas a los días afectados; devuelve los días cuyo contenido cambió."""
+        desde, hasta = self._ventana(meta)
+        idx = self._load_json(_idx_key(cal_id)) or {}
+        cambios = {}
+        for ev in items:
+            eid = ev.get("id")
+            if not eid:
+                continue
+            if ev.get("status") == "cancelled":
+                cambios[eid] = ([], None)
+            else:
+                cambios[eid] = ([d for d in event_dates(ev, tz) if desde <= d <= hasta], _slim(ev))
+
+        afectados = set()
+        for eid, (dias, _) in cambios.items():
+            afectados.update(date.fromisoformat(x) for x in idx.get(eid, ()))
+            afectados.update(dias)
+        afectados = sorted(afectados)
+        viejos = self._load_days(cal_id, afectados)
+        docs = {d: dict(viejos[d]) for d in afectados}
+        for eid, (dias, slim) in cambios.items():
+            for x in idx.pop(eid, ()):
+                docs[date.fromisoformat(x)].pop(eid, None)
+            for d in dias:
+                docs[d][eid] = slim
+            if dias:
+                idx[eid] = [d.isoformat() for d in dias]
+
+        touched = {d for d in afectados if docs[d] != viejos[d]}
+        self._write_days(cal_id, docs, touched)
+        self._storage.setex(_idx_key(cal_id), _json(idx), ttl=MIRROR_TTL)
+        return touched
+
+    # ---------- escrituras propias (best-effort, sin esperar al próximo sync) ----------
+    def apply_event(self, cal_id: str, ev: dict) -> None:
+        if ev and ev.get("id"):
+            self._patch(cal_id, [ev])
+
+    def remove_event(self, cal_id: str, event_id: str) -> None:
+        if event_id:
+            self._patch(cal_id, [{"id": event_id, "status": "cancelled"}])
+
+    def _patch(self, cal_id: str, items: list) -> None:
+        if not cal_id:
+            return
+        try:
+            with self._locked(cal_id, PATCH_LOCK_WAIT) as ok:
+                if not ok:
+                    return
+                meta = self.load(cal_id)
+                if meta is None or not meta.get("desde"):
+                    return  # sin espejo todavía: el primer sync lo traerá
+                touched = self._aplicar(cal_id, meta, ZoneInfo(meta.get("tz") or settings.CAL_TZ), items)
+                self._mark_dirty(cal_id, touched)
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+
+    # ---------- lecturas ----------
+    def ranges_for_days(self, peluqueria, fecha_desde: date, dias: int) -> Optional[dict]:
+        """
+        {date: [(HH:MM, HH:MM)]} para la ventana, leyendo solo las claves de esos días.
+        None si no hay espejo utilizable (sin sync, más viejo que max_staleness, otra zona horaria
+        o días fuera de la ventana): el llamante consulta Calendar en vivo.
+        """
+        cal_id = getattr(peluqueria, "cal_id", None)
+        if not cal_id or dias <= 0:
+            return None
+        meta = self.load(cal_id)
+        if meta is None or not meta.get("desde"):
+            return None
+        if self._clock() - float(meta.get("synced_at") or 0) > self._max_staleness:
+            return None
+
+        from google_calendar_utils import _bucket_event, tz_of
+        tz = ZoneInfo(tz_of(peluqueria))
+        if meta.get("tz") != tz.key:
+            return None
+        desde, hasta = self._ventana(meta)
+        fecha_hasta = fecha_desde + timedelta(days=dias - 1)
+        if fecha_desde < desde or fecha_hasta > hasta:
+            return None
+
+        por_dia: dict = {}
+        for d, doc in self._load_days(cal_id, _dias(fecha_desde, fecha_hasta)).items():
+            # cada evento se reparte solo en SU día: un evento de varios días está en la clave de cada uno
+            uno = {d: []}
+            for ev in sorted(doc.values(), key=_start_key):
+                _bucket_event(ev, tz, uno)
+            por_dia[d] = uno[d]
+        return por_dia
+
+
+mirror = CalendarMirror(max_staleness=settings.CAL_MIRROR_MAX_STALENESS_SECONDS)
@@ -0,0 +1,160 @@
+# calendar_watch.py — canales push de Google Calendar (events.watch) por peluquería
+# - Registro y renovación de canales (los canales caducan; se renuevan antes de RENEW_MARGIN)
+# - Token por canal (HMAC) para validar las notificaciones que llegan a /webhook/gcal
+# - Estado en storage: gcal:watch:{channel_id} y gcal:watch:pelu:{pelu_id}
+# - Solo con storage compartido (STORAGE_BACKEND=redis): el cron registra los canales y la app valida los
+#   avisos; con "memory" el estado muere con cada ejecución del cron (canal nuevo por minuto y 403 en la app)
+from __future__ import annotations
+
+import hashlib
+import hmac
+import json
+import logging
+import time
+import uuid
+from typing import Callable, Optional
+
+import sentry_sdk
+
+from settings import settings
+from storage import get_storage
+
+WATCH_TTL_SECONDS = 7 * 24 * 3600
+RENEW_MARGIN_SECONDS = 24 * 3600
+
+
+def channel_token(channel_id: str) -> str:
+    return hmac.new(
+        settings.GCAL_WEBHOOK_SECRET.encode("utf-8"), channel_id.encode("utf-8"), hashlib.sha256
+    ).hexdigest()
+
+
+def _chan_key(channel_id: str) -> str:
+    return f"gcal:watch:{channel_id}"
+
+
+def _pelu_key(pelu_id) -> str:
+    return f"gcal:watch:pelu:{pelu_id}"
+
+
+class CalendarWatcher:
+    def __init__(
+        self,
+        storage=None,
+        service_factory: Optional[Callable] = None,
+        address: Optional[str] = None,
+        clock: Callable[[], float] = time.time,
+        shared: Optional[bool] = None,
+    ):
+        self._storage = storage or get_storage(settings)
+        self._service_factory = service_factory
+        self._address = address
+        self._clock = clock
+        if shared is None:
+            shared = (settings.STORAGE_BACKEND or "").lower() == "redis"
+        self._shared = shared
+        self._avisado = False
+
+    def _service(self):
+        if self._service_factory is not None:
+            return self._service_factory()
+        from google_calendar_utils import get_calendar_service
+        return get_calendar_service()
+
+    def _load(self, key: str) -> Optional[dict]:
+        raw = self._storage.get(key)
+        if not raw:
+            return None
+        try:
+            return json.loads(raw)
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            return None
+
+    # ---------- registro / renovación ----------
+    def ensure_watch(self, pelu) -> bool:
+        """Registra un canal para el calendario de 'pelu' o lo renueva si caduca pronto. True si queda activo."""
+        cal_id = getattr(pelu, "cal_id", None)
+        if not self._address or not cal_id:
+            return False
+        if not self._shared:
+            if not self._avisado:
+                self._avisado = True
+                logging.warning("GCAL_WEBHOOK_URL configurada sin STORAGE_BACKEND=redis: no se registran canales push")
+            return False
+        now = self._clock()
+        current = self._load(_pelu_key(pelu.id))
+        if current and current.get("cal_id") == cal_id and current.get("expiration", 0) - now > RENEW_MARGIN_SECONDS:
+            return True
+
+        # Antes de registrar el nuevo: un canal viejo sin parar seguiría mandando avisos hasta caducar
+        if current:
+            self._stop(current)
+            self._storage.delete(_pelu_key(pelu.id))
+
+        channel_id = uuid.uuid4().hex
+        try:
+            resp = self._service().events().watch(
+                calendarId=cal_id,
+                body={
+                    "id": channel_id,
+                    "type": "web_hook",
+                    "address": self._address,
+                    "token": channel_token(channel_id),
+                    "params": {"ttl": str(WATCH_TTL_SECONDS)},
+                },
+            ).execute() or {}
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            logging.error("No se pudo registrar el canal de Calendar para pelu %s: %s", pelu.id, e, exc_info=True)
+            return False
+
+        # Google devuelve la caducidad en ms epoch
+        try:
+            expiration = int(resp.get("expiration")) / 1000.0
+        except Exception:
+            expiration = now + WATCH_TTL_SECONDS
+        chan = {
+            "channel_id": channel_id,
+            "resource_id": resp.get("resourceId"),
+            "cal_id": cal_id,
+            "pelu_id": pelu.id,
+            "tz": getattr(pelu, "tz", None),
+            "expiration": expiration,
+        }
+        ttl = max(60, int(expiration - now))
+        raw = json.dumps(chan)
+        self._storage.setex(_chan_key(channel_id), raw, ttl=ttl)
+        self._storage.setex(_pelu_key(pelu.id), raw, ttl=ttl)
+        return True
+
+    def _stop(self, chan: dict) -> None:
+        # Deja de recibir avisos del canal anterior (best-effort: caduca solo de todos modos)
+        self._storage.delete(_chan_key(chan.get("channel_id", "")))
+        try:
+            self._service().channels().stop(
+                body={"id": chan.get("channel_id"), "resourceId": chan.get("resource_id")}
+            ).execute()
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+
+    # ---------- notificaciones ----------
+    def verify(self, channel_id: str, token: str, resource_id: str) -> Optional[dict]:
+        """Canal registrado cuyo token y resourceId coinciden con la notificación; None si no."""
+        if not channel_id or not token:
+            return None
+        if not hmac.compare_digest(channel_token(channel_id), token):
+            return None
+        chan = self._load(_chan_key(channel_id))
+        if not chan:
+            return None
+        if chan.get("resource_id") and resource_id and chan["resource_id"] != resource_id:
+            return None
+        return chan
+
+    def is_watched(self, pelu_id) -> bool:
+        chan = self._load(_pelu_key(pelu_id))
+        return bool(chan) and chan.get("expiration", 0) > self._clock()
+
+
+watcher = CalendarWatcher(address=settings.GCAL_WEBHOOK_URL)
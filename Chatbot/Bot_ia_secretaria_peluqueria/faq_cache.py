@@ -0,0 +1,203 @@
+# faq_cache.py — caché de respuestas del paso 'duda' por peluquería
+# - Coincidencia exacta (texto normalizado) y casi-duplicada (Jaccard de tokens sin stopwords)
+# - Nunca mezcla preguntas que nombran servicios distintos ("precio del corte" ≠ "precio del tinte")
+# - Todo cuelga del fingerprint del tenant: si cambia Peluqueria/Servicio, las entradas dejan de valer
+#   (en cuanto tenant_registry recarga el snapshot, como mucho TENANT_CACHE_TTL_SECONDS después)
+# - L1 en proceso; L2 exacta en storage (solo backend redis) para compartir entre workers
+# - Contadores de aciertos por tipo en stats(), expuesto en GET /stats
+from __future__ import annotations
+
+import hashlib
+import json
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import sentry_sdk
+
+from settings import settings
+
+NO_CACHEAR = {"", "NO_ENTIENDO"}
+
+STOPWORDS = {
+    "a", "al", "de", "del", "el", "la", "las", "los", "lo", "le", "les", "un", "una", "unos", "unas",
+    "y", "o", "e", "en", "con", "por", "para", "que", "me", "mi", "mis", "se", "te", "tu", "su", "es",
+    "son", "hay", "hola", "buenas", "buenos", "dias", "tardes", "noches", "gracias", "porfa", "favor",
+    "quiero", "quisiera", "queria", "saber", "podrias", "puedes", "decir", "dime", "vosotros", "ustedes",
+    "teneis", "tienen", "tienes", "pregunta", "duda", "cosa", "vale", "ok",
+}
+
+
+def normaliza(texto: str) -> str:
+    t = (texto or "").strip().lower()
+    t = "".join(c for c in unicodedata.normalize("NFD", t) if unicodedata.category(c) != "Mn")
+    t = re.sub(r"[^a-z0-9\s]", " ", t)
+    return re.sub(r"\s+", " ", t).strip()
+
+
+def _raiz(tok: str) -> str:
+    # plural muy simple: "cortes" -> "corte", "precios" -> "precio"
+    if len(tok) > 4 and tok.endswith("es") and not tok.endswith("ces"):
+        return tok[:-1]
+    if len(tok) > 3 and tok.endswith("s"):
+        return tok[:-1]
+    return tok
+
+
+def tokens(texto: str) -> frozenset:
+    return frozenset(_raiz(w) for w in normaliza(texto).split() if w not in STOPWORDS)
+
+
+def jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+def fingerprint(pelu) -> str:
+    """Fingerprint del TenantSnapshot; si es un objeto ORM/stub, hash de los datos que usa el prompt de 'duda'."""
+    fp = getattr(pelu, "fingerprint", None)
+    if fp:
+        return str(fp)
+    campos = [getattr(pelu, k, None) for k in (
+        "nombre", "direccion", "dias_cerrados", "horario", "telefono_peluqueria", "currency_code")]
+    servicios = [
+        (getattr(s, "nombre", None), getattr(s, "precio", None), getattr(s, "duracion_min", None))
+        for s in (getattr(pelu, "servicios", None) or [])
+    ]
+    raw = json.dumps([campos, servicios], default=str, ensure_ascii=False)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def _tokens_servicio(pelu) -> frozenset:
+    out = set()
+    for s in (getattr(pelu, "servicios", None) or []):
+        out |= tokens(getattr(s, "nombre", "") or "")
+    return frozenset(out)
+
+
+class _Indice:
+    """Preguntas de una peluquería para un fingerprint concreto (LRU acotado)."""
+
+    def __init__(self, fp: str, servicio_toks: frozenset):
+        self.fp = fp
+        self.servicio_toks = servicio_toks
+        # pregunta normalizada -> (tokens, respuesta, expires_at)
+        self.entradas: "OrderedDict[str, tuple[frozenset, str, float]]" = OrderedDict()
+
+
+class FAQCache:
+    def __init__(self, storage=None, clock: Callable[[], float] = time.monotonic):
+        self._storage = storage
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._indices: dict = {}
+        self._stats = {"exacta": 0, "similar": 0, "l2": 0, "miss": 0}
+
+    # ---------- índice en proceso ----------
+    def _indice_locked(self, pelu) -> _Indice:
+        fp = fingerprint(pelu)
+        idx = self._indices.get(pelu.id)
+        if idx is None or idx.fp != fp:
+            idx = _Indice(fp, _tokens_servicio(pelu))     # cambió la config: se descarta lo anterior
+            self._indices[pelu.id] = idx
+        return idx
+
+    def buscar(self, pelu, pregunta: str) -> tuple[Optional[str], str]:
+        """(respuesta, tipo) con tipo 'exacta' | 'similar'; (None, '') si no hay."""
+        q = normaliza(pregunta)
+        toks = tokens(pregunta)
+        now = self._clock()
+        with self._lock:
+            idx = self._indice_locked(pelu)
+            row = idx.entradas.get(q)
+            if row is not None and row[2] > now:
+                idx.entradas.move_to_end(q)
+                return row[1], "exacta"
+            umbral = float(settings.FAQ_CACHE_MIN_SIMILARITY)
+            mejor, mejor_sim = None, 0.0
+            for key, (etoks, resp, exp) in idx.entradas.items():
+                if exp <= now:
+                    continue
+                # servicios distintos => pregunta distinta aunque el resto coincida
+                if (etoks & idx.servicio_toks) != (toks & idx.servicio_toks):
+                    continue
+                sim = jaccard(toks, etoks)
+                if sim >= umbral and sim > mejor_sim:
+                    mejor, mejor_sim = resp, sim
+            return (mejor, "similar") if mejor is not None else (None, "")
+
+    def guardar(self, pelu, pregunta: str, respuesta: str) -> None:
+        q = normaliza(pregunta)
+        ttl = int(settings.FAQ_CACHE_TTL_SECONDS)
+        with self._lock:
+            idx = self._indice_locked(pelu)
+            idx.entradas[q] = (tokens(pregunta), respuesta, self._clock() + ttl)
+            idx.entradas.move_to_end(q)
+            while len(idx.entradas) > max(1, int(settings.FAQ_CACHE_MAX_PER_PELU)):
+                idx.entradas.popitem(last=False)
+
+    # ---------- L2 exacta ----------
+    def _clave(self, pelu, pregunta: str) -> str:
+        h = hashlib.sha1(normaliza(pregunta).encode("utf-8")).hexdigest()[:20]
+        return f"faq:{pelu.id}:{fingerprint(pelu)}:{h}"
+
+    def responder(self, pelu, pregunta: str, fn: Callable[[], str]) -> str:
+        """Respuesta cacheada para la duda o, si no hay, fn() (la IA) y se guarda."""
+        if not settings.FAQ_CACHE_ENABLED or getattr(pelu, "id", None) is None or not tokens(pregunta):
+            return fn()
+        resp, tipo = self.buscar(pelu, pregunta)
+        if resp is not None:
+            self._cuenta(tipo)
+            return resp
+        if self._storage is not None:
+            try:
+                resp = self._storage.get(self._clave(pelu, pregunta))
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                resp = None
+            if resp is not None:
+                self._cuenta("l2")
+                self.guardar(pelu, pregunta, resp)
+                return resp
+
+        self._cuenta("miss")
+        out = fn()
+        if isinstance(out, str) and out.strip() not in NO_CACHEAR:
+            self.guardar(pelu, pregunta, out)
+            if self._storage is not None:
+                try:
+                    self._storage.setex(self._clave(pelu, pregunta), out, ttl=int(settings.FAQ_CACHE_TTL_SECONDS))
+                except Exception as e:
+                    sentry_sdk.capture_exception(e)
+        return out
+
+    def invalidate(self, peluqueria_id=None) -> None:
+        with self._lock:
+            if peluqueria_id is None:
+                self._indices.clear()
+            else:
+                self._indices.pop(peluqueria_id, None)
+
+    def _cuenta(self, campo: str) -> None:
+        with self._lock:
+            self._stats[campo] += 1
+
+    def stats(self) -> dict:
+        with self._lock:
+            total = sum(self._stats.values())
+            hits = total - self._stats["miss"]
+            return dict(self._stats, hit_rate=round(hits / total, 3) if total else 0.0)
+
+
+def _storage_compartido():
+    if (settings.STORAGE_BACKEND or "").lower() != "redis":
+        return None
+    from storage import get_storage
+    return get_storage(settings)
+
+
+faq = FAQCache(_storage_compartido())
@@ -0,0 +1,135 @@
+# fecha_es.py — parser de fechas en español para el paso "fecha" (antes de dateparser y de la IA)
+# - Gramática regex para los formatos del prompt de fecha: dd/mm/aa, "15 de octubre", "oct 15",
+#   "2025-09-03", días de la semana, "hoy", "mañana", "pasado mañana", "el 20"
+# - Respaldo: un DateDataParser ya construido y reutilizado (uno por zona horaria y día)
+# - Sin año explícito: año en curso, o el siguiente si el mes ya pasó
+from __future__ import annotations
+
+import re
+import unicodedata
+from datetime import date, datetime, timedelta
+from functools import lru_cache
+from typing import Optional
+
+import sentry_sdk
+
+MESES = {
+    "enero": 1, "ene": 1, "febrero": 2, "feb": 2, "marzo": 3, "mar": 3, "abril": 4, "abr": 4,
+    "mayo": 5, "may": 5, "junio": 6, "jun": 6, "julio": 7, "jul": 7, "agosto": 8, "ago": 8,
+    "septiembre": 9, "setiembre": 9, "sept": 9, "sep": 9, "set": 9, "octubre": 10, "oct": 10,
+    "noviembre": 11, "nov": 11, "diciembre": 12, "dic": 12,
+}
+DIAS_SEMANA = {"lunes": 0, "martes": 1, "miercoles": 2, "jueves": 3, "viernes": 4, "sabado": 5, "domingo": 6}
+
+_MES = r"(?P<mes>" + "|".join(sorted(MESES, key=len, reverse=True)) + r")\.?"
+_ANIO = r"(?P<anio>\d{4}|\d{2})"
+_PRE = r"^(?:(?:para|el|la|del?|dia)\s+)*"
+
+_RE_ISO = re.compile(r"\b(?P<anio>\d{4})[-/](?P<mes>\d{1,2})[-/](?P<dia>\d{1,2})\b")
+_RE_NUM = re.compile(r"\b(?P<dia>\d{1,2})[/\-.](?P<mes>\d{1,2})(?:[/\-.]" + _ANIO + r")?\b")
+_RE_DIA_MES = re.compile(r"\b(?P<dia>\d{1,2})\s+(?:de\s+)?" + _MES + r"(?:\s*,?\s*(?:de\s+|del\s+)?" + _ANIO + r")?\b")
+_RE_MES_DIA = re.compile(r"\b" + _MES + r"\s+(?P<dia>\d{1,2})(?:\s*,?\s*" + _ANIO + r")?\b")
+_RE_SEMANA = re.compile(
+    r"\b(?P<prox>proximo\s+|siguiente\s+)?(?P<dow>" + "|".join(DIAS_SEMANA) + r")\b(?P<viene>\s+que viene|\s+proximo|\s+siguiente)?"
+)
+_RE_SOLO_DIA = re.compile(_PRE + r"(?P<dia>\d{1,2})$")
+
+
+def _norm(texto: str) -> str:
+    t = (texto or "").strip().lower()
+    t = "".join(c for c in unicodedata.normalize("NFD", t) if unicodedata.category(c) != "Mn")
+    t = re.sub(r"[¿?¡!;\"']", " ", t)
+    return re.sub(r"\s+", " ", t).strip(" .")
+
+
+def _mk(y: int, m: int, d: int) -> Optional[date]:
+    try:
+        return date(y, m, d)
+    except ValueError:
+        return None
+
+
+def _anio(tok: Optional[str]) -> Optional[int]:
+    if not tok:
+        return None
+    y = int(tok)
+    return 2000 + y if y < 100 else y
+
+
+def _con_anio(hoy: date, mes: int, dia: int, anio: Optional[int]) -> Optional[date]:
+    if anio is not None:
+        return _mk(anio, mes, dia)
+    # Como dateparser (año en curso), salvo meses ya pasados: "15 de enero" dicho en diciembre
+    y = hoy.year + 1 if mes < hoy.month else hoy.year
+    return _mk(y, mes, dia)
+
+
+def parse_fecha_regex(texto: str, hoy: date) -> Optional[date]:
+    """Solo la gramática local; None si no reconoce el texto (o la fecha no existe)."""
+    t = _norm(texto)
+    if not t:
+        return None
+    if re.search(r"\bpasado manana\b", t):
+        return hoy + timedelta(days=2)
+    if re.fullmatch(_PRE + r"hoy", t):
+        return hoy
+    if re.match(_PRE + r"manana\b", t):         # "mañana", "mañana por la tarde"
+        return hoy + timedelta(days=1)
+
+    m = _RE_ISO.search(t)
+    if m:
+        return _mk(int(m["anio"]), int(m["mes"]), int(m["dia"]))
+    m = _RE_NUM.search(t)
+    if m:
+        return _con_anio(hoy, int(m["mes"]), int(m["dia"]), _anio(m["anio"]))
+    m = _RE_DIA_MES.search(t)
+    if m:
+        return _con_anio(hoy, MESES[m["mes"]], int(m["dia"]), _anio(m["anio"]))
+    m = _RE_MES_DIA.search(t)
+    if m:
+        return _con_anio(hoy, MESES[m["mes"]], int(m["dia"]), _anio(m["anio"]))
+
+    m = _RE_SEMANA.search(t)
+    if m:
+        delta = (DIAS_SEMANA[m["dow"]] - hoy.weekday()) % 7
+        if delta == 0 and (m["prox"] or m["viene"]):
+            delta = 7                          # "el jueves que viene" dicho en jueves
+        return hoy + timedelta(days=delta)
+
+    m = _RE_SOLO_DIA.match(t)
+    if m:
+        dia = int(m["dia"])
+        f = _mk(hoy.year, hoy.month, dia)
+        if f is None or f < hoy:
+            sig = (hoy.replace(day=1) + timedelta(days=32)).replace(day=1)
+            f = _mk(sig.year, sig.month, dia)
+        return f
+    return None
+
+
+@lru_cache(maxsize=16)
+def _date_data_parser(tzname: str, hoy_iso: str):
+    # Construir el parser (cargadores de idioma + settings) es lo caro de dateparser:
+    # se hace una vez por zona y día en lugar de en cada mensaje
+    from dateparser.date import DateDataParser
+    return DateDataParser(
+        languages=["es"],
+        settings={
+            "DATE_ORDER": "DMY",
+            "PREFER_DAY_OF_MONTH": "first",
+            "RELATIVE_BASE": datetime.fromisoformat(hoy_iso),
+        },
+    )
+
+
+def parse_fecha(texto: str, hoy: date, tzname: str = "Europe/Madrid") -> Optional[date]:
+    """Gramática local y, si no reconoce nada, DateDataParser reutilizado. None = que decida la IA."""
+    f = parse_fecha_regex(texto, hoy)
+    if f is not None:
+        return f
+    try:
+        dt = _date_data_parser(tzname, hoy.isoformat()).get_date_data(texto).date_obj
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        return None
+    return dt.date() if dt else None
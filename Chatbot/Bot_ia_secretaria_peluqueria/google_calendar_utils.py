@@ -1,14 +1,17 @@
 """Utilidades para interactuar con Google Calendar (aware por peluquería)."""
 from __future__ import annotations
 
+import json
 import logging
+import threading
 from time import sleep
 from typing import Optional, List, Tuple
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
 import sentry_sdk
-from googleapiclient.discovery import build
+from googleapiclient.discovery import build, build_from_document
+from googleapiclient.discovery_cache import get_static_doc
 from googleapiclient.errors import HttpError
 from google.oauth2 import service_account
 
@@ -50,12 +53,59 @@ def parse_iso_dt(s: str) -> Optional[datetime]:
 
 
 # --- Google Service ---
-def get_calendar_service():
-    creds = service_account.Credentials.from_service_account_file(
-        SERVICE_ACCOUNT_FILE, scopes=SCOPES
-    )
-    # cache_discovery=False evita warnings en serverless/containers
-    return build('calendar', 'v3', credentials=creds, cache_discovery=False)
+# Credenciales: una por fichero y proceso (google-auth reutiliza el token hasta que caduca).
+# Servicio: uno por hilo y fichero, porque httplib2 (transporte del cliente) no es thread-safe.
+# Documento de discovery: el estático que trae googleapiclient, parseado una sola vez.
+_svc_lock = threading.Lock()
+_creds_cache: dict[str, service_account.Credentials] = {}
+_discovery_doc: Optional[dict] = None
+_svc_generation = 0
+_svc_local = threading.local()
+
+
+def _credentials_for(path: str) -> service_account.Credentials:
+    with _svc_lock:
+        creds = _creds_cache.get(path)
+        if creds is None:
+            creds = service_account.Credentials.from_service_account_file(path, scopes=SCOPES)
+            _creds_cache[path] = creds
+        return creds
+
+
+def _calendar_discovery_doc() -> Optional[dict]:
+    global _discovery_doc
+    if _discovery_doc is None:
+        raw = get_static_doc('calendar', 'v3')
+        if raw:
+            _discovery_doc = json.loads(raw)
+    return _discovery_doc
+
+
+def get_calendar_service(credentials_file: Optional[str] = None):
+    """Servicio de Calendar cacheado (por hilo) para el fichero de credenciales dado."""
+    path = credentials_file or SERVICE_ACCOUNT_FILE
+    if getattr(_svc_local, "generation", None) != _svc_generation:
+        _svc_local.services = {}
+        _svc_local.generation = _svc_generation
+    service = _svc_local.services.get(path)
+    if service is None:
+        creds = _credentials_for(path)
+        doc = _calendar_discovery_doc()
+        if doc is not None:
+            service = build_from_document(doc, credentials=creds)
+        else:
+            # cache_discovery=False evita warnings en serverless/containers
+            service = build('calendar', 'v3', credentials=creds, cache_discovery=False, static_discovery=True)
+        _svc_local.services[path] = service
+    return service
+
+
+def reset_calendar_service() -> None:
+    """Descarta credenciales y servicios cacheados (p. ej. tras rotar credentials.json)."""
+    global _svc_generation
+    with _svc_lock:
+        _creds_cache.clear()
+        _svc_generation += 1
 
 
 def _retry(callable_execute, retries: int = 3):
@@ -107,6 +157,18 @@ def _find_event_by_reserva_id(service, calendar_id: str, reserva_id: str) -> Opt
 
 
 # === Lectura de ocupaciones por día ===
+def _mirror_ranges(peluqueria, fecha_desde, dias: int) -> Optional[dict]:
+    """Ocupación desde el espejo local (calendar_mirror); None => consultar Calendar en vivo."""
+    if not settings.CAL_MIRROR_ENABLED:
+        return None
+    try:
+        from calendar_mirror import mirror
+        return mirror.ranges_for_days(peluqueria, fecha_desde, dias)
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        return None
+
+
 def list_event_ranges_for_day(peluqueria, fecha):
     """
     Devuelve [(HH:MM, HH:MM), ...] con los rangos OCUPADOS en 'fecha'
@@ -121,6 +183,10 @@ def list_event_ranges_for_day(peluqueria, fecha):
         if not getattr(peluqueria, "cal_id", None):
             return []
 
+        por_dia = _mirror_ranges(peluqueria, fecha, 1)
+        if por_dia is not None:
+            return por_dia.get(fecha, [])
+
         service = get_calendar_service()
 
         tzname = tz_of(peluqueria)
@@ -172,6 +238,96 @@ def list_event_ranges_for_day(peluqueria, fecha):
         return []
 
 
+def list_event_ranges_for_days(peluqueria, fecha_desde, dias: int) -> Optional[dict]:
+    """
+    Igual que list_event_ranges_for_day pero para 'dias' días consecutivos desde 'fecha_desde'
+    con UNA consulta paginada a events.list sobre toda la ventana.
+    Devuelve {date: [(HH:MM, HH:MM), ...]} con todos los días de la ventana (vacíos incluidos),
+    o None si Calendar falla (el llamante decide el fallback).
+
+    - Los rangos se reparten por día LOCAL de la peluquería; un evento que cruza
+      medianoche aparece recortado en cada día ("23:59" como fin de día)
+    - Un evento all-day bloquea 00:00-23:59 en cada día que cubre
+    """
+    try:
+        if not getattr(peluqueria, "cal_id", None):
+            return {fecha_desde + timedelta(days=i): [] for i in range(dias)}
+
+        por_dia = _mirror_ranges(peluqueria, fecha_desde, dias)
+        if por_dia is not None:
+            return por_dia
+
+        service = get_calendar_service()
+        tz = ZoneInfo(tz_of(peluqueria))
+        start_dt = datetime(fecha_desde.year, fecha_desde.month, fecha_desde.day, 0, 0, tzinfo=tz)
+        end_dt = start_dt + timedelta(days=dias)
+
+        por_dia: dict = {fecha_desde + timedelta(days=i): [] for i in range(dias)}
+        page_token = None
+        while True:
+            resp = _retry(
+                service.events()
+                .list(
+                    calendarId=peluqueria.cal_id,
+                    timeMin=start_dt.isoformat(),
+                    timeMax=end_dt.isoformat(),
+                    singleEvents=True,
+                    orderBy="startTime",
+                    showDeleted=False,
+                    maxResults=2500,
+                    pageToken=page_token,
+                )
+                .execute
+            )
+            if resp is None:
+                return None
+            for ev in resp.get("items", []) or []:
+                _bucket_event(ev, tz, por_dia)
+            page_token = resp.get("nextPageToken")
+            if not page_token:
+                return por_dia
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        logging.error("list_event_ranges_for_days error", exc_info=True)
+        return None
+
+
+def _bucket_event(ev: dict, tz: ZoneInfo, por_dia: dict) -> None:
+    """Añade los rangos ocupados de 'ev' a cada día local de 'por_dia' que toca."""
+    if ev.get("status") == "cancelled":
+        return
+    start = ev.get("start", {})
+    end = ev.get("end", {})
+    s_dt = start.get("dateTime")
+    e_dt = end.get("dateTime")
+    if not s_dt or not e_dt:
+        if start.get("date") and end.get("date"):
+            try:
+                d = datetime.strptime(start["date"], "%Y-%m-%d").date()
+                d_end = datetime.strptime(end["date"], "%Y-%m-%d").date()  # exclusivo
+            except Exception:
+                return
+            while d < d_end:
+                if d in por_dia:
+                    por_dia[d].append(("00:00", "23:59"))
+                d += timedelta(days=1)
+        return
+
+    s_parsed = parse_iso_dt(s_dt)
+    e_parsed = parse_iso_dt(e_dt)
+    if not s_parsed or not e_parsed:
+        return
+    s_loc = to_aware(s_parsed, tz.key).astimezone(tz)
+    e_loc = to_aware(e_parsed, tz.key).astimezone(tz)
+    d = s_loc.date()
+    while d <= e_loc.date():
+        ini = s_loc.strftime("%H:%M") if d == s_loc.date() else "00:00"
+        fin = e_loc.strftime("%H:%M") if d == e_loc.date() else "23:59"
+        if d in por_dia and ini < fin:
+            por_dia[d].append((ini, fin))
+        d += timedelta(days=1)
+
+
 # --- util de listado acotado ---
 def _list_events_between(service, calendar_id: str, start_dt: datetime, end_dt: datetime):
     start_iso = start_dt.isoformat()
@@ -229,6 +385,18 @@ def _count_overlaps_calendar(service, calendar_id: str, start_dt_local: datetime
 
 
 # === CRUD de eventos ===
+def _mirror_apply(cal_id: str, ev: dict) -> None:
+    if settings.CAL_MIRROR_ENABLED:
+        from calendar_mirror import mirror
+        mirror.apply_event(cal_id, ev)
+
+
+def _mirror_remove(cal_id: str, event_id: str) -> None:
+    if settings.CAL_MIRROR_ENABLED:
+        from calendar_mirror import mirror
+        mirror.remove_event(cal_id, event_id)
+
+
 def crear_reserva_google_idempotente(peluqueria, datos, private_key: str):
     """
     Crea (o actualiza si ya existe por gkey) un evento en Google Calendar
@@ -341,6 +509,7 @@ def crear_reserva_google_idempotente(peluqueria, datos, private_key: str):
             sendUpdates="none",
         ).execute()
         ev_id = created.get("id")
+        _mirror_apply(peluqueria.cal_id, created)
 
         # 4) Post-chequeo de capacidad (capacidad = num_peluqueros)
         try:
@@ -353,6 +522,7 @@ def crear_reserva_google_idempotente(peluqueria, datos, private_key: str):
             # carrera: revertir
             try:
                 _retry(service.events().delete(calendarId=peluqueria.cal_id, eventId=ev_id).execute)
+                _mirror_remove(peluqueria.cal_id, ev_id)
             except Exception:
                 pass
             return {"success": False, "error": "no_slot_calendar_capacity"}
@@ -378,6 +548,8 @@ def cancelar_reserva_google(peluqueria, event_id: str):
             return {"success": False, "error": "missing_calendar_id"}
         service = get_calendar_service()
         resp = _retry(service.events().delete(calendarId=peluqueria.cal_id, eventId=event_id).execute)
+        if resp is not None:
+            _mirror_remove(peluqueria.cal_id, event_id)
         return {"success": resp is not None}
     except Exception as e:
         sentry_sdk.capture_exception(e)
@@ -0,0 +1,88 @@
+# graph_client.py — cliente HTTP compartido para la Graph API de WhatsApp
+# - Una requests.Session por proceso: pool de conexiones + keep-alive
+#   (3-4 envíos por turno reutilizan la misma conexión TLS)
+# - Cabecera Authorization por peluquería en cada llamada (token del tenant)
+# - Timeouts y política de reintentos centralizados
+from __future__ import annotations
+
+from typing import Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+from settings import settings
+
+GRAPH_BASE_URL = "https://graph.facebook.com"
+
+
+class CappedRetry(Retry):
+    """Retry que respeta Retry-After pero nunca duerme más de MAX_RETRY_AFTER segundos."""
+
+    # Atributo de clase y no argumento: Retry.new() reconstruye la instancia solo con sus propios kwargs
+    MAX_RETRY_AFTER: float = settings.GRAPH_RETRY_AFTER_MAX_SECONDS
+
+    def get_retry_after(self, response):
+        retry_after = super().get_retry_after(response)
+        if retry_after is None:
+            return None
+        return min(retry_after, max(0.0, float(self.MAX_RETRY_AFTER)))
+
+
+class GraphClient:
+    def __init__(
+        self,
+        base_url: str = GRAPH_BASE_URL,
+        version: str = settings.GRAPH_API_VERSION,
+        connect_timeout: float = settings.GRAPH_CONNECT_TIMEOUT_SECONDS,
+        read_timeout: float = settings.GRAPH_READ_TIMEOUT_SECONDS,
+        pool_maxsize: int = settings.GRAPH_POOL_MAXSIZE,
+        max_retries: int = settings.GRAPH_MAX_RETRIES,
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.version = version
+        self.timeout = (connect_timeout, read_timeout)
+        # Un POST a /messages NO es idempotente en Meta: solo se reintenta si la petición
+        # no llegó a salir (fallo de conexión) o si Meta la rechazó por cuota (429).
+        # El Retry-After del 429 se respeta con tope: esto corre en hilos del CORE_EXECUTOR.
+        retry = CappedRetry(
+            total=max_retries,
+            connect=max_retries,
+            read=0,
+            status=max_retries,
+            status_forcelist=(429,),
+            allowed_methods=frozenset({"GET", "POST"}),
+            backoff_factor=0.3,
+            respect_retry_after_header=True,
+            raise_on_status=False,
+        )
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=max(1, int(pool_maxsize)), max_retries=retry)
+        self.session = requests.Session()
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def messages_url(self, phone_number_id: str, graph_ver: Optional[str] = None) -> str:
+        return f"{self.base_url}/{graph_ver or self.version}/{phone_number_id}/messages"
+
+    def post_message(
+        self,
+        phone_number_id: str,
+        payload: dict,
+        token: str,
+        graph_ver: Optional[str] = None,
+        headers: Optional[dict] = None,
+    ) -> requests.Response:
+        """POST /{phone_number_id}/messages con el token de la peluquería. Lanza en error de red."""
+        h = {"Content-Type": "application/json", **(headers or {}), "Authorization": f"Bearer {token}"}
+        return self.session.post(
+            self.messages_url(phone_number_id, graph_ver),
+            headers=h,
+            json=payload,
+            timeout=self.timeout,
+        )
+
+    def close(self) -> None:
+        self.session.close()
+
+
+graph = GraphClient()
@@ -7,3 +7,13 @@ threads = 2
 timeout = 120
 graceful_timeout = 30
 loglevel = "info"
+
+
+def worker_exit(server, worker):
+    # Drena la cola del core (mensajes ya aceptados por el webhook) antes de que
+    # el arbiter mate al worker al vencer graceful_timeout.
+    import sys
+    appmod = sys.modules.get("app")
+    executor = getattr(appmod, "CORE_EXECUTOR", None)
+    if executor is not None:
+        executor.shutdown(timeout=max(1, graceful_timeout - 5))
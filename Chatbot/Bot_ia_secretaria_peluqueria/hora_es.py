@@ -0,0 +1,155 @@
+# hora_es.py — parser determinista de horas en español (paso "hora" del flujo de reserva)
+# - Cubre "17:30", "17h30", "1730", "a las 5", "cinco y media", "las 6 menos cuarto",
+#   "10 en punto", "5 pm", "a las 7 de la tarde", "mediodía (y media)", "medianoche"...
+# - Un número suelto necesita marca de hora ("a las", "h", "en punto", "pm"...) salvo que sea todo el mensaje
+# - Devuelve la hora con su pista am/pm y si es ambigua (1..12 sin pista); la IA queda como último recurso
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import Optional
+
+HORA_WORDS = {
+    "una": 1, "uno": 1, "dos": 2, "tres": 3, "cuatro": 4, "cinco": 5, "seis": 6, "siete": 7,
+    "ocho": 8, "nueve": 9, "diez": 10, "once": 11, "doce": 12, "trece": 13, "catorce": 14,
+    "quince": 15, "dieciseis": 16, "diecisiete": 17, "dieciocho": 18, "diecinueve": 19,
+    "veinte": 20, "veintiuna": 21, "veintiuno": 21, "veintidos": 22, "veintitres": 23,
+}
+MIN_WORDS = {
+    "cinco": 5, "diez": 10, "cuarto": 15, "quince": 15, "veinte": 20, "veinticinco": 25,
+    "media": 30, "treinta": 30, "cuarenta": 40, "cuarenta y cinco": 45, "cincuenta": 50,
+    "tres cuartos": 45, "3 cuartos": 45,
+}
+
+_H = r"(?P<h>\d{1,2}|" + "|".join(sorted(HORA_WORDS, key=len, reverse=True)) + r")"
+# palabras antes que dígitos: "3 cuartos" no es el minuto 3
+_M = r"(?P<min>" + "|".join(sorted(MIN_WORDS, key=len, reverse=True)) + r"|\d{1,2})"
+_PRE = r"(?P<pre>\b(?:a|sobre|hacia|para|desde|tipo|como a)?\s*(?:las?)\s+)?"
+
+_RE_DIGITAL = re.compile(r"\b(\d{1,2})\s*(?::|\.|,|h)\s*(\d{2})\b")
+_RE_COMPACTA = re.compile(r"^(?:a las\s+)?(\d{3,4})\s*(?:h|hrs?|horas)?$")
+_RE_MENOS = re.compile(_PRE + r"\b" + _H + r"\s+menos\s+" + _M + r"\b")
+_RE_Y = re.compile(_PRE + r"\b" + _H + r"\s+y\s+" + _M + r"\b")
+_SUF = (r"(?P<suf>\s*(?:en punto|h|hrs?|horas)\b"
+        r"|\s+(?:am|pm|de la (?:manana|tarde|noche|madrugada)|por la (?:manana|tarde|noche)|del mediodia)\b)?")
+# tras un número vale también una "h" pegada ("17h", "a las 11h", "17hrs"), que \b no deja pasar
+_RE_SOLA = re.compile(_PRE + r"\b" + _H + r"(?:\b|(?<=\d)(?=h))" + _SUF)
+_RE_MEDIODIA = re.compile(r"\bmediodia(?:\s+(?P<op>y|menos)\s+" + _M + r")?\b")
+
+_RE_AM = re.compile(r"\b(am|de la manana|por la manana|de madrugada|de la madrugada)\b")
+_RE_PM = re.compile(r"\b(pm|tarde|noche|del mediodia)\b")
+_RE_NOCHE = re.compile(r"\bnoche\b")
+
+
+def _norm(texto: str) -> str:
+    t = (texto or "").strip().lower()
+    t = "".join(c for c in unicodedata.normalize("NFD", t) if unicodedata.category(c) != "Mn")
+    t = re.sub(r"\b([ap])\s*\.\s*m\s*\.?", r"\1m", t)    # a.m. / p. m. → am / pm
+    t = re.sub(r"(\d)\s*([ap]m)\b", r"\1 \2", t)          # 5pm → 5 pm
+    t = re.sub(r"[¿?¡!;\"']", " ", t)
+    return re.sub(r"\s+", " ", t).strip()
+
+
+def _num(tok: str, tabla: dict) -> Optional[int]:
+    if tok.isdigit():
+        return int(tok)
+    return tabla.get(tok)
+
+
+def _clue(t: str) -> Optional[str]:
+    if _RE_AM.search(t):
+        return "am"
+    if _RE_PM.search(t):
+        return "pm"
+    return None
+
+
+def _ajusta_noche(h: int, clue: Optional[str], t: str) -> Optional[str]:
+    # "12 de la noche" = medianoche
+    if h == 12 and clue == "pm" and _RE_NOCHE.search(t):
+        return "am"
+    return clue
+
+
+def _resultado(h: int, m: int, clue: Optional[str]) -> Optional[dict]:
+    if not (0 <= h <= 23 and 0 <= m <= 59):
+        return None
+    if h == 0 or h >= 13:
+        return {"h": h, "m": m, "clue": None, "ambigua": False, "candidatas": [f"{h:02d}:{m:02d}"]}
+    if clue:
+        h24 = (0 if h == 12 else h) if clue == "am" else (12 if h == 12 else h + 12)
+        return {"h": h, "m": m, "clue": clue, "ambigua": False, "candidatas": [f"{h24:02d}:{m:02d}"]}
+    am, pm = (0 if h == 12 else h), (12 if h == 12 else h + 12)
+    return {"h": h, "m": m, "clue": None, "ambigua": True, "candidatas": [f"{am:02d}:{m:02d}", f"{pm:02d}:{m:02d}"]}
+
+
+def _hora_palabra_ok(match, t: str) -> bool:
+    # "una", "dos"... solo cuentan como hora con "a las"/"la" delante o si son todo el mensaje
+    return match.group("h").isdigit() or bool(match.group("pre")) or match.group(0).strip() == t
+
+
+def _suelta_ok(match, t: str) -> bool:
+    # un número suelto solo es hora con marca ("a las", "h", "en punto", "pm", "de la tarde"...) o si es
+    # todo el mensaje: "mejor el dia 20" o "en 2 semanas" no son horas
+    return bool(match.group("pre")) or bool(match.group("suf")) or match.group(0).strip() == t
+
+
+def parse_hora(texto: str) -> Optional[dict]:
+    """
+    Interpreta una hora en español sin IA.
+    Devuelve {"h", "m", "clue": "am"|"pm"|None, "ambigua": bool, "candidatas": ["HH:MM", ...]}
+    (mismo formato que normaliza_hora_ia) o None si no hay una hora reconocible.
+    """
+    t = _norm(texto)
+    if not t:
+        return None
+    if re.search(r"\bmedianoche\b", t):
+        return _resultado(0, 0, None)
+    clue = _clue(t)
+
+    m = _RE_DIGITAL.search(t)
+    if m:
+        h, mm = int(m.group(1)), int(m.group(2))
+        return _resultado(h, mm, _ajusta_noche(h, clue, t))
+
+    m = _RE_COMPACTA.match(t)
+    if m:
+        d = m.group(1)
+        return _resultado(int(d[:-2]), int(d[-2:]), clue)
+
+    m = _RE_MENOS.search(t)
+    if m and _hora_palabra_ok(m, t):
+        h, sub = _num(m.group("h"), HORA_WORDS), _num(m.group("min"), MIN_WORDS)
+        if h is None or sub is None or not (1 <= sub <= 59):
+            return None
+        if not (1 <= h <= 23):
+            return None
+        if h >= 13:
+            clue = "pm"                       # "13 menos cuarto" = 12:45, sin ambigüedad
+        prev = 12 if h == 1 else h - 1        # "la una menos cuarto" = 12:45
+        return _resultado(prev, 60 - sub, clue)
+
+    m = _RE_Y.search(t)
+    if m and _hora_palabra_ok(m, t):
+        h, mm = _num(m.group("h"), HORA_WORDS), _num(m.group("min"), MIN_WORDS)
+        if h is None or mm is None:
+            return None
+        return _resultado(h, mm, clue)
+
+    # Con varios números ("el 15 a las 5") manda el que va detrás de "a las"
+    sueltas = [m for m in _RE_SOLA.finditer(t) if _suelta_ok(m, t)]
+    m = next((x for x in sueltas if x.group("pre")), sueltas[0] if sueltas else None)
+    if not m:
+        md = _RE_MEDIODIA.search(t)
+        if not md:
+            return None
+        sub = _num(md.group("min"), MIN_WORDS) if md.group("op") else 0
+        if sub is None or not (0 <= sub <= 59):
+            return None
+        if md.group("op") == "menos" and sub:
+            return _resultado(11, 60 - sub, "am")    # "mediodía menos cuarto" = 11:45
+        return _resultado(12, sub, "pm")             # "mediodía y media" = 12:30
+    h = _num(m.group("h"), HORA_WORDS)
+    if h is None or h > 23:
+        return None
+    return _resultado(h, 0, _ajusta_noche(h, clue, t))
@@ -0,0 +1,156 @@
+# ia_cache.py — memoización de interpreta_ia / interpreta_hora
+# - Clave: (peluqueria_id, paso, hash del catálogo, fecha local, texto normalizado)
+# - L1: LRU+TTL en proceso; L2: storage compartido (solo con backend redis)
+# - TTL por paso y contadores de aciertos por paso (stats(), expuesto en GET /stats)
+from __future__ import annotations
+
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from datetime import datetime
+from typing import Callable, Optional
+from zoneinfo import ZoneInfo
+
+import sentry_sdk
+
+from settings import settings
+
+NO_CACHEAR = {"", "NO_ENTIENDO"}   # interpreta_ia devuelve NO_ENTIENDO también ante errores de la API
+
+
+def ttls() -> dict:
+    return {
+        "intencion": int(settings.IA_CACHE_TTL_INTENCION),
+        "servicio": int(settings.IA_CACHE_TTL_SERVICIO),
+        "fecha": int(settings.IA_CACHE_TTL_FECHA),
+        "hora": int(settings.IA_CACHE_TTL_HORA),
+    }
+
+
+def normaliza(texto: str) -> str:
+    t = (texto or "").strip().lower()
+    t = "".join(c for c in unicodedata.normalize("NFD", t) if unicodedata.category(c) != "Mn")
+    t = re.sub(r"[^\w\s:/\-]", " ", t)
+    return re.sub(r"\s+", " ", t).strip()
+
+
+def catalogo_hash(pelu) -> str:
+    """Fingerprint del TenantSnapshot; para objetos ORM/stub, hash de nombre+duración de servicios."""
+    fp = getattr(pelu, "fingerprint", None)
+    if fp:
+        return str(fp)
+    servicios = getattr(pelu, "servicios", None) or []
+    raw = "|".join(f"{getattr(s, 'nombre', '')}:{getattr(s, 'duracion_min', '')}" for s in servicios)
+    return hashlib.sha1(raw.encode("utf-8")).hexdigest()[:12]
+
+
+def fecha_local(pelu) -> str:
+    tzname = getattr(pelu, "tz", None) or settings.CAL_TZ
+    try:
+        return datetime.now(ZoneInfo(tzname)).date().isoformat()
+    except Exception:
+        return datetime.utcnow().date().isoformat()
+
+
+def clave(paso: str, pelu, texto: str) -> str:
+    # Solo entra en la clave lo que cambia la respuesta de ese paso
+    pelu_id = getattr(pelu, "id", None) or "-"
+    cat = catalogo_hash(pelu) if paso == "servicio" else "-"
+    dia = fecha_local(pelu) if paso == "fecha" else "-"
+    h = hashlib.sha1(normaliza(texto).encode("utf-8")).hexdigest()[:20]
+    return f"ia:{pelu_id}:{paso}:{cat}:{dia}:{h}"
+
+
+class IACache:
+    def __init__(self, storage=None, max_entries: int = 5000, clock: Callable[[], float] = time.monotonic):
+        self._storage = storage
+        self._max = max(1, int(max_entries))
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._lru: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._stats: dict = {}
+
+    def _cuenta(self, paso: str, campo: str) -> None:
+        with self._lock:
+            st = self._stats.setdefault(paso, {"l1": 0, "l2": 0, "miss": 0})
+            st[campo] += 1
+
+    def _get_l1(self, key: str) -> Optional[str]:
+        with self._lock:
+            row = self._lru.get(key)
+            if row is None:
+                return None
+            if row[1] <= self._clock():
+                self._lru.pop(key, None)
+                return None
+            self._lru.move_to_end(key)
+            return row[0]
+
+    def _set_l1(self, key: str, value: str, ttl: int) -> None:
+        with self._lock:
+            self._lru[key] = (value, self._clock() + ttl)
+            self._lru.move_to_end(key)
+            while len(self._lru) > self._max:
+                self._lru.popitem(last=False)
+
+    def memo(self, paso: str, pelu, texto: str, fn: Callable[[], str]) -> str:
+        """Devuelve la respuesta cacheada de (paso, pelu, texto) o llama a fn() y la guarda."""
+        ttl = ttls().get(paso)
+        if not settings.IA_CACHE_ENABLED or not ttl or not normaliza(texto):
+            return fn()
+        key = clave(paso, pelu, texto)
+
+        hit = self._get_l1(key)
+        if hit is not None:
+            self._cuenta(paso, "l1")
+            return hit
+        if self._storage is not None:
+            try:
+                hit = self._storage.get(key)
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                hit = None
+            if hit is not None:
+                self._cuenta(paso, "l2")
+                self._set_l1(key, hit, ttl)
+                return hit
+
+        self._cuenta(paso, "miss")
+        out = fn()
+        if isinstance(out, str) and out.strip() not in NO_CACHEAR:
+            self._set_l1(key, out, ttl)
+            if self._storage is not None:
+                try:
+                    self._storage.setex(key, out, ttl=ttl)
+                except Exception as e:
+                    sentry_sdk.capture_exception(e)
+        return out
+
+    def stats(self) -> dict:
+        """Por paso: aciertos L1/L2, fallos y hit_rate."""
+        with self._lock:
+            out = {}
+            for paso, st in self._stats.items():
+                total = st["l1"] + st["l2"] + st["miss"]
+                out[paso] = dict(st, hit_rate=round((st["l1"] + st["l2"]) / total, 3) if total else 0.0)
+            out["size"] = len(self._lru)
+            return out
+
+    def clear(self) -> None:
+        with self._lock:
+            self._lru.clear()
+            self._stats.clear()
+
+
+def _storage_compartido():
+    # Con backend "memory" el L2 sería otra copia en el mismo proceso: solo el LRU
+    if (settings.STORAGE_BACKEND or "").lower() != "redis":
+        return None
+    from storage import get_storage
+    return get_storage(settings)
+
+
+cache = IACache(_storage_compartido(), max_entries=settings.IA_CACHE_LOCAL_MAX_ENTRIES)
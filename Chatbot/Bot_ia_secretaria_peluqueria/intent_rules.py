@@ -0,0 +1,85 @@
+# intent_rules.py — clasificador local de intención (reservar / cancelar / duda) previo a la IA
+# - Léxico ponderado de regex sobre texto normalizado (sin tildes, minúsculas)
+# - Devuelve (intención | None, confianza 0..1); solo lo dudoso se manda a interpreta_ia
+from __future__ import annotations
+
+import re
+import unicodedata
+from typing import Iterable, Optional
+
+_DIAS = r"(hoy|manana|pasado manana|lunes|martes|miercoles|jueves|viernes|sabado|domingo|finde|fin de semana|semana que viene|proxima semana)"
+
+# (intención, peso, patrón)
+_LEXICO = [
+    ("reservar", 3.0, r"\breserv\w*"),
+    ("reservar", 3.0, r"\b(pedir|coger|sacar|agendar|apartar|programar|concertar)\b.{0,20}\b(cita|hora|turno|vez|hueco)\b"),
+    ("reservar", 1.0, r"\b(cita|turno|hueco)\b"),
+    ("reservar", 1.5, r"\b(hay|teneis|tienes|tendrias|quedan?)\b.{0,15}\b(hueco|sitio|libre|disponib\w*)"),
+    ("reservar", 0.5, r"\bhora\b"),
+    ("reservar", 1.0, r"\b(cortar(me|le)?|corte|tenir(me)?|tinte|mechas|peinado|peinar(me)?|barba|alisado)\b"),
+    ("reservar", 0.5, r"\b" + _DIAS + r"\b"),
+    ("reservar", 0.5, r"\b(quiero|quisiera|me gustaria|necesito)\b"),
+
+    ("cancelar", 6.0, r"\b(cancel\w*|anul\w*|desapunt\w*|desconvoc\w*)"),
+    ("cancelar", 4.0, r"\bno (voy a |vamos a |podre |puedo |podemos )?(ir|asistir|acudir|llegar)\b"),
+    ("cancelar", 3.0, r"\b(quitar|eliminar|borrar)\b.{0,20}\b(cita|reserva|hora|turno)\b"),
+
+    ("duda", 3.0, r"\b(duda|pregunta|consulta|informacion|info)\b"),
+    ("duda", 2.0, r"^(que|cual|cuales|cuanto|cuanta|cuando|donde|como|a que hora|hasta que hora|por que)\b"),
+    ("duda", 2.0, r"\b(precio|precios|cuesta|cuestan|cuanto vale|tarifa|horario|abr[ei]\w*|cerr\w*|direccion|donde esta\w*|telefono|aparcar|parking|tarjeta|bizum|efectivo)\b"),
+    ("duda", 1.0, r"\?"),
+]
+
+
+def normaliza(s: str) -> str:
+    s = (s or "").strip().lower()
+    s = "".join(c for c in unicodedata.normalize("NFD", s) if unicodedata.category(c) != "Mn")
+    s = re.sub(r"[^a-z0-9?\s]", " ", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+
+class IntentClassifier:
+    """Suma los pesos de cada intención; confianza = margen sobre la segunda / (ganadora + 1).
+
+    - `frases`: coincidencias exactas (p. ej. _INTENT_MAP) con peso alto
+    - `neutras`: textos sin intención (sí/no, comandos); si el mensaje es solo eso → (None, 1.0)
+    """
+
+    def __init__(self, frases: Optional[dict] = None, neutras: Iterable[str] = (), lexico=None):
+        self._frases = {normaliza(k): v for k, v in (frases or {}).items()}
+        self._neutras = {normaliza(w) for w in neutras}
+        self._reglas = [(i, w, re.compile(p)) for i, w, p in (lexico or _LEXICO)]
+        self._frases_re = [
+            (v, re.compile(r"\b" + re.escape(k) + r"\b"))
+            for k, v in sorted(self._frases.items(), key=lambda kv: -len(kv[0]))
+            if " " in k
+        ]
+
+    def puntuaciones(self, texto: str) -> dict:
+        t = normaliza(texto)
+        scores: dict = {}
+        for intent, peso, rx in self._reglas:
+            if rx.search(t):
+                scores[intent] = scores.get(intent, 0.0) + peso
+        for intent, rx in self._frases_re:
+            if rx.search(t):
+                scores[intent] = scores.get(intent, 0.0) + 3.0
+                break
+        return scores
+
+    def clasificar(self, texto: str) -> tuple[Optional[str], float]:
+        t = normaliza(texto).rstrip("?").strip()
+        if not t:
+            return None, 0.0
+        if t in self._frases:
+            return self._frases[t], 1.0
+        if t in self._neutras:
+            return None, 1.0
+        scores = self.puntuaciones(texto)
+        if not scores:
+            return None, 0.0
+        ranking = sorted(scores.values(), reverse=True)
+        top = ranking[0]
+        second = ranking[1] if len(ranking) > 1 else 0.0
+        intent = max(scores, key=scores.get)
+        return intent, round((top - second) / (top + 1.0), 3)
@@ -8,6 +8,9 @@ import dateparser
 import sentry_sdk
 
 from settings import settings
+from hora_es import parse_hora
+from fecha_es import parse_fecha
+import ia_cache
 
 # -----------------------
 # Cliente OpenAI (API moderna)
@@ -110,6 +113,13 @@ def _fmt_money_for_pelu(pelu, amount) -> str | None:
 # -----------------------
 
 def interpreta_ia(texto, paso, pelu):
+    # intencion/servicio/fecha solo dependen del texto, el catálogo y el día: se memoizan
+    if paso in ("intencion", "servicio", "fecha"):
+        return ia_cache.cache.memo(paso, pelu, texto, lambda: _interpreta_ia(texto, paso, pelu))
+    return _interpreta_ia(texto, paso, pelu)
+
+
+def _interpreta_ia(texto, paso, pelu):
     mensaje = _clean_leading(texto)
 
     if paso == "intencion":
@@ -207,13 +217,28 @@ def interpreta_ia(texto, paso, pelu):
         return "NO_ENTIENDO"
 
 def interpreta_hora(texto_usuario):
-    txt = _clean_leading(texto_usuario).lower()
+    # Gramática local primero; la IA solo si no reconoce nada o la hora es ambigua (am/pm)
+    local = parse_hora(texto_usuario)
+    if local and not local["ambigua"]:
+        return datetime.strptime(local["candidatas"][0], "%H:%M").time()
+
+    salida = ia_cache.cache.memo("hora", None, texto_usuario, lambda: _hora_ia(texto_usuario))
+    if not salida or salida.lower().replace("_", " ").startswith("no entiendo"):
+        return None
 
-    if txt in {"mediodia", "mediodía"}:
-        return datetime.strptime("12:00", "%H:%M").time()
-    if txt == "medianoche":
-        return datetime.strptime("00:00", "%H:%M").time()
+    hora = dateparser.parse(salida, languages=["es"])
+    if hora:
+        return hora.time()
 
+    if re.fullmatch(r"\d{2}:\d{2}", salida):
+        try:
+            return datetime.strptime(salida, "%H:%M").time()
+        except Exception:
+            pass
+    return None
+
+
+def _hora_ia(texto_usuario) -> str:
     prompt = (
         f"Extrae una hora del mensaje: '{texto_usuario}'. "
         "Devuelve SOLO una hora en 24h HH:MM (con cero inicial). "
@@ -230,43 +255,26 @@ def interpreta_hora(texto_usuario):
             max_tokens=12,
             temperature=0.2
         )
-        salida = (response.choices[0].message.content or "").strip()
-        if not salida or salida.lower().startswith("no entiendo"):
-            return None
-
-        hora = dateparser.parse(salida, languages=["es"])
-        if hora:
-            return hora.time()
-
-        if re.fullmatch(r"\d{2}:\d{2}", salida):
-            try:
-                return datetime.strptime(salida, "%H:%M").time()
-            except Exception:
-                pass
-
+        return (response.choices[0].message.content or "").strip() or "NO_ENTIENDO"
     except Exception as e:
         sentry_sdk.capture_exception(e)
         logging.error(f"Error en interpreta_hora: {e}", exc_info=True)
-    return None
+    return "NO_ENTIENDO"
 
 def interpreta_telefono(mensaje, default_region: str | None = None):
     from phone_utils import normalize_msisdn
     return normalize_msisdn(mensaje, default_region)
 
 def interpreta_fecha(texto, pelu):
-    dt = dateparser.parse(
-        texto,
-        languages=["es"],
-        settings={
-            "DATE_ORDER": "DMY",
-            "PREFER_DAY_OF_MONTH": "first",
-            "RELATIVE_BASE": datetime.now(
-                ZoneInfo(getattr(pelu, "tz", None) or settings.CAL_TZ)
-            ),
-        },
-    )
-    if dt:
-        return dt.date().strftime("%Y-%m-%d")
+    tzname = getattr(pelu, "tz", None) or settings.CAL_TZ
+    try:
+        hoy = datetime.now(ZoneInfo(tzname)).date()
+    except Exception:
+        hoy = datetime.utcnow().date()
+    # Gramática local + DateDataParser reutilizado; la IA solo si ninguno reconoce la fecha
+    f = parse_fecha(texto, hoy, tzname)
+    if f:
+        return f.strftime("%Y-%m-%d")
 
     out = interpreta_ia(texto, "fecha", pelu)
     norm = _normalize_date_output(out)
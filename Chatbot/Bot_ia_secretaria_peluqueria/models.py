@@ -1,5 +1,5 @@
 from sqlalchemy import (
-    Column, Integer, String, Float, ForeignKey, Date, Time, Index, text, UniqueConstraint, JSON, Boolean
+    Column, Integer, BigInteger, String, Float, ForeignKey, Date, Time, Index, text, UniqueConstraint, JSON, Boolean
 )
 from sqlalchemy.ext.mutable import MutableDict
 from sqlalchemy.orm import relationship, declarative_base
@@ -108,3 +108,28 @@ class Reserva(Base):
         Index("ix_reservas_peluquero_fecha", "peluquero_id", "fecha", "hora")
     )
 
+
+
+class SlotOcupacion(Base):
+    """Inventario de capacidad por tramo: cuántas reservas confirmadas ocupan cada 'minuto' del día."""
+    __tablename__ = "slot_ocupacion"
+    peluqueria_id = Column(Integer, ForeignKey("peluquerias.id", ondelete="CASCADE"), primary_key=True)
+    fecha = Column(Date, primary_key=True)
+    minuto = Column(Integer, primary_key=True)  # minutos desde 00:00, múltiplo de SLOT_INVENTARIO_STEP_MIN
+    usados = Column(Integer, nullable=False, default=0)
+
+
+class SlotOcupacionPeluquero(Base):
+    """Igual que SlotOcupacion pero por peluquero (capacidad 1)."""
+    __tablename__ = "slot_ocupacion_peluquero"
+    peluquero_id = Column(Integer, ForeignKey("peluqueros.id", ondelete="CASCADE"), primary_key=True)
+    fecha = Column(Date, primary_key=True)
+    minuto = Column(Integer, primary_key=True)
+    usados = Column(Integer, nullable=False, default=0)
+
+
+class SlotFence(Base):
+    """Último token de fencing (lease Redis de SLOT_LOCK_BACKEND) que escribió cada clave de slot."""
+    __tablename__ = "slot_fence"
+    clave = Column(String(64), primary_key=True)  # "slot:{peluqueria_id}:{fecha}:{minuto}" (ver _slot_keys)
+    fence = Column(BigInteger, nullable=False, default=0)
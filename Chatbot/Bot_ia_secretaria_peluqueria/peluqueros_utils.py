@@ -1,8 +1,8 @@
 # peluqueros_utils.py
-from typing import List, Optional, Tuple
+from typing import Dict, List, Optional, Tuple
 from sqlalchemy.orm import Session
 from sqlalchemy import and_
-from models import Peluqueria, Peluquero, Reserva
+from models import Peluqueria, Peluquero, Reserva, Servicio
 from datetime import date, time
 
 def get_active_peluqueros(session: Session, peluqueria_id: int) -> List[Peluquero]:
@@ -20,39 +20,68 @@ def exists_peluquero(session: Session, peluqueria_id: int, peluquero_id: int) ->
         Peluquero.activo == True
     ).first() is not None
 
+class AgendaPeluqueros:
+    """
+    Reservas no canceladas de (peluquería, fecha) agrupadas por peluquero_id,
+    cargadas con UNA query. Los solapes se resuelven en memoria.
+    """
+
+    def __init__(self, rangos_por_peluquero: Dict[Optional[int], List[Tuple[int, int]]]):
+        # peluquero_id -> [(inicio_min, fin_min), ...]  (None = reservas sin peluquero)
+        self.rangos = rangos_por_peluquero
+
+    @classmethod
+    def cargar(cls, session: Session, peluqueria_id: int, fecha: date) -> "AgendaPeluqueros":
+        from reserva_utils import _to_min
+
+        rows = (
+            session.query(Reserva.peluquero_id, Reserva.hora, Servicio.duracion_min)
+            .outerjoin(Servicio, Servicio.id == Reserva.servicio_id)
+            .filter(
+                Reserva.peluqueria_id == peluqueria_id,
+                Reserva.fecha == fecha,
+                Reserva.estado != "cancelada",
+            )
+            .all()
+        )
+        rangos: Dict[Optional[int], List[Tuple[int, int]]] = {}
+        for peluquero_id, hora, dur in rows:
+            try:
+                ini = _to_min(hora)
+            except Exception:
+                continue
+            rangos.setdefault(peluquero_id, []).append((ini, ini + int(dur or 30)))
+        return cls(rangos)
+
+    def solapa(self, peluquero_id: Optional[int], hora, duracion_min: int) -> bool:
+        """True si [hora, hora+dur) solapa alguna reserva del peluquero (o cualquiera si peluquero_id es None)."""
+        from reserva_utils import _to_min
+
+        a = _to_min(hora)
+        b = a + int(duracion_min)
+        if peluquero_id is None:
+            rangos = (r for lista in self.rangos.values() for r in lista)
+        else:
+            rangos = self.rangos.get(peluquero_id, ())
+        return any(x1 < b and a < x2 for x1, x2 in rangos)
+
+    def libres_en(self, peluquero_ids: List[int], hora, duracion_min: int) -> List[int]:
+        """Peluqueros (en el orden dado) sin solape en [hora, hora+dur)."""
+        return [pid for pid in peluquero_ids if not self.solapa(pid, hora, duracion_min)]
+
+
 def check_overlap_for_peluquero(session: Session, peluqueria_id: int, peluquero_id: Optional[int],
                                 fecha: date, hora: time, duracion_min: int) -> bool:
     """
     Devuelve True si existe solape parcial o total con otra reserva no cancelada.
     Si peluquero_id es None => solape global (modo antiguo).
+    Para varios slots/peluqueros del mismo día usa AgendaPeluqueros (una sola query).
     """
-    from reserva_utils import _to_min, _overlap
-
-    start = _to_min(hora)
-    end = start + duracion_min
-
-    q = session.query(Reserva).filter(
-        Reserva.peluqueria_id == peluqueria_id,
-        Reserva.fecha == fecha,
-        Reserva.estado != "cancelada",
-    )
-    if peluquero_id is not None:
-        q = q.filter(Reserva.peluquero_id == peluquero_id)
-
-    reservas = q.all()
-    for r in reservas:
-        try:
-            dur_exist = getattr(r, "duracion_min", None)
-            if dur_exist is None:
-                dur_exist = getattr(getattr(r, "servicio", None), "duracion_min", 30)
-            if _overlap(hora, duracion_min, r.hora, dur_exist):
-                return True
-        except Exception:
-            continue
-    return False
+    return AgendaPeluqueros.cargar(session, peluqueria_id, fecha).solapa(peluquero_id, hora, duracion_min)
 
 def pick_any_available(session: Session, peluqueria_id: int, fecha: date, hora: time, duracion_min: int) -> Optional[Peluquero]:
+    agenda = AgendaPeluqueros.cargar(session, peluqueria_id, fecha)
     for p in get_active_peluqueros(session, peluqueria_id):
-        if not check_overlap_for_peluquero(session, peluqueria_id, p.id, fecha, hora, duracion_min):
+        if not agenda.solapa(p.id, hora, duracion_min):
             return p
-    return None
\ No newline at end of file
+    return None
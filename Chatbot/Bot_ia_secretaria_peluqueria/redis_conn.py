@@ -0,0 +1,71 @@
+# redis_conn.py — conexión Redis compartida por todo el proceso
+# - Un único pool acotado por URL (BlockingConnectionPool: si se agotan las conexiones se espera
+#   REDIS_POOL_TIMEOUT_SECONDS en vez de abrir más), con timeouts de socket y health check
+# - Lo usan storage, slot_locks, Flask-Limiter, /ready y send_reminders (vía storage)
+# - redis-py reabre las conexiones del pool tras un fork (workers de gunicorn)
+from __future__ import annotations
+
+import threading
+from typing import Optional
+
+from settings import settings
+
+_lock = threading.Lock()
+_pools: dict = {}
+_clients: dict = {}
+
+
+def _pool_kwargs() -> dict:
+    return {
+        "decode_responses": True,
+        "max_connections": int(settings.REDIS_MAX_CONNECTIONS),
+        "timeout": float(settings.REDIS_POOL_TIMEOUT_SECONDS),
+        "socket_timeout": float(settings.REDIS_SOCKET_TIMEOUT_SECONDS),
+        "socket_connect_timeout": float(settings.REDIS_CONNECT_TIMEOUT_SECONDS),
+        "health_check_interval": int(settings.REDIS_HEALTH_CHECK_SECONDS),
+    }
+
+
+def get_pool(url: Optional[str] = None):
+    url = url or settings.REDIS_URL
+    with _lock:
+        pool = _pools.get(url)
+        if pool is None:
+            import redis  # type: ignore
+            pool = redis.BlockingConnectionPool.from_url(url, **_pool_kwargs())
+            _pools[url] = pool
+        return pool
+
+
+def get_client(url: Optional[str] = None):
+    """Cliente (decode_responses=True) sobre el pool compartido de esa URL."""
+    url = url or settings.REDIS_URL
+    pool = get_pool(url)
+    with _lock:
+        client = _clients.get(url)
+        if client is None:
+            import redis  # type: ignore
+            client = redis.Redis(connection_pool=pool)
+            _clients[url] = client
+        return client
+
+
+def limiter_storage_options(url: Optional[str] = None) -> dict:
+    """storage_options para Flask-Limiter: mismo pool en vez de crear el suyo."""
+    url = url or settings.REDIS_URL
+    if not url.startswith(("redis://", "rediss://", "unix://")):
+        return {}
+    return {"connection_pool": get_pool(url)}
+
+
+def reset() -> None:
+    """Cierra y olvida los pools (tests, o tras cambiar REDIS_URL en caliente)."""
+    with _lock:
+        pools = list(_pools.values())
+        _pools.clear()
+        _clients.clear()
+    for pool in pools:
+        try:
+            pool.disconnect()
+        except Exception:
+            pass
@@ -2,8 +2,8 @@
 
 import hashlib
 import logging
+from functools import lru_cache
 from datetime import datetime, time, date, timedelta
-from sqlite3 import IntegrityError
 from typing import List, Tuple, Optional
 
 from sqlalchemy.orm import selectinload
@@ -12,7 +12,7 @@ import sentry_sdk
 from db import SessionLocal
 from models import Reserva
 from time_utils import now_local
-from peluqueros_utils import check_overlap_for_peluquero, pick_any_available
+from peluqueros_utils import AgendaPeluqueros, check_overlap_for_peluquero
 
 
 # ————— Helpers de tiempo —————
@@ -98,77 +98,126 @@ def _tramos_para_fecha(horario_field, fecha: date) -> List[Tuple[str, str]]:
         # ante cualquier problema, intenta legacy
         return _parse_horario(str(horario_field))
 
-# ————— Cálculo de horas disponibles —————
-def horas_disponibles(db, peluqueria, servicio, fecha_str: str) -> list[str]:
-    """
-    Devuelve horas de inicio 'HH:MM' disponibles en 'fecha_str' leyendo
-    la OCUPACIÓN desde Google Calendar (peluqueria.cal_id).
+# ————— Ocupación del día (arrays por minuto) —————
+MIN_DIA = 24 * 60
 
-    Reglas:
-    - Un slot es válido si las reservas solapadas < num_peluqueros.
-    - Paso entre slots = peluqueria.rango_reservas (fallback 30).
-    - Respeta antelaciones y tramos horarios de la peluquería.
+
+class OcupacionDia:
     """
-    try:
-        capacidad = int(getattr(peluqueria, "num_peluqueros", 1) or 1)
-        step = getattr(peluqueria, "rango_reservas", 30) or 30
-        try:
-            step = int(step)
-        except Exception:
-            step = 30
+    Ocupación de un día construida UNA vez a partir de los rangos ocupados de Calendar.
+    Guarda, por minuto m (0..1440):
+      - _ini_antes[m]: nº de eventos que empiezan antes de m
+      - _fin_hasta[m]: nº de eventos que terminan en m o antes
+    Eventos que solapan [a, b) = _ini_antes[b] - _fin_hasta[a]  → O(1) por slot,
+    para cualquier duración de servicio y compartido entre servicios y peluqueros.
+    (Misma regla que _contar_solapes en BD: cuenta eventos solapados, no simultáneos.)
+    """
+    __slots__ = ("_ini_antes", "_fin_hasta")
+
+    def __init__(self, busy_ranges):
+        inicios = [0] * (MIN_DIA + 1)
+        fines = [0] * (MIN_DIA + 1)
+        for a, b in busy_ranges:
+            x1 = min(max(_to_min(a), 0), MIN_DIA)
+            x2 = min(max(_to_min(b), 0), MIN_DIA)
+            if x1 >= x2:
+                continue
+            inicios[x1] += 1
+            fines[x2] += 1
+        ini_antes = [0] * (MIN_DIA + 1)
+        fin_hasta = [0] * (MIN_DIA + 1)
+        acc_i = acc_f = 0
+        for m in range(MIN_DIA + 1):
+            ini_antes[m] = acc_i      # empiezan en < m
+            acc_i += inicios[m]
+            acc_f += fines[m]
+            fin_hasta[m] = acc_f      # terminan en <= m
+        self._ini_antes = ini_antes
+        self._fin_hasta = fin_hasta
+
+    def solapes(self, a: int, b: int) -> int:
+        """Nº de eventos que solapan [a, b) (minutos desde 00:00)."""
+        a = min(max(a, 0), MIN_DIA)
+        b = min(max(b, 0), MIN_DIA)
+        if a >= b:
+            return 0
+        return self._ini_antes[b] - self._fin_hasta[a]
+
+    def inicios_libres(self, tramos, dur: int, step: int, capacidad: int, cutoff_abs_min=None) -> list[str]:
+        """Horas 'HH:MM' de inicio dentro de 'tramos' con menos de 'capacidad' eventos solapados."""
+        slots: list[str] = []
+        for ini, fin in tramos:
+            cur = _to_min(ini)
+            end = _to_min(fin)
+            while cur + dur <= end:
+                if (cutoff_abs_min is None or cur >= cutoff_abs_min) and self.solapes(cur, cur + dur) < capacidad:
+                    slots.append(_from_min(cur))
+                cur += step
+        return slots
 
-        dur = int(getattr(servicio, "duracion_min", 30) or 30)
 
-        fecha = datetime.strptime(fecha_str, "%Y-%m-%d").date()
+@lru_cache(maxsize=512)
+def _ocupacion_cacheada(busy_key: tuple) -> OcupacionDia:
+    return OcupacionDia(busy_key)
 
-        # Antelaciones
-        ahora = now_local(peluqueria)
-        min_avance = int(getattr(peluqueria, "min_avance_min", 60) or 60)
-        max_dias = int(getattr(peluqueria, "max_avance_dias", 150) or 150)
 
-        if fecha > (ahora + timedelta(days=max_dias)).date():
-            return []
+def ocupacion_dia(busy_ranges) -> OcupacionDia:
+    """OcupacionDia memoizada por los rangos ocupados: mismo día sin cambios => mismo objeto."""
+    return _ocupacion_cacheada(tuple((a, b) for a, b in busy_ranges))
 
-        cutoff_abs_min = None
-        if fecha == ahora.date():
-            cutoff_abs_min = (ahora.hour * 60 + ahora.minute) + min_avance
 
-        # Tramos de horario del día
-        try:
-            tramos = _tramos_para_fecha(getattr(peluqueria, "horario", ""), fecha)
-        except Exception:
-            # Fallback simple "09:00-14:00,16:00-20:00"
-            tramos = _parse_horario(getattr(peluqueria, "horario", ""))
+def _dia_reservable(peluqueria, fecha: date):
+    """(tramos, cutoff_abs_min) del día, o None si 'fecha' supera max_avance_dias."""
+    ahora = now_local(peluqueria)
+    min_avance = int(getattr(peluqueria, "min_avance_min", 60) or 60)
+    max_dias = int(getattr(peluqueria, "max_avance_dias", 150) or 150)
 
-        # Ocupación del día desde Calendar
+    if fecha > (ahora + timedelta(days=max_dias)).date():
+        return None
+
+    cutoff_abs_min = None
+    if fecha == ahora.date():
+        cutoff_abs_min = (ahora.hour * 60 + ahora.minute) + min_avance
+
+    # Tramos de horario del día
+    try:
+        tramos = _tramos_para_fecha(getattr(peluqueria, "horario", ""), fecha)
+    except Exception:
+        # Fallback simple "09:00-14:00,16:00-20:00"
+        tramos = _parse_horario(getattr(peluqueria, "horario", ""))
+    return tramos, cutoff_abs_min
+
+
+def _step_de(peluqueria) -> int:
+    step = getattr(peluqueria, "rango_reservas", 30) or 30
+    try:
+        return int(step)
+    except Exception:
+        return 30
+
+
+def _ocupacion_calendar(peluqueria, fecha: date, busy_ranges) -> OcupacionDia:
+    if busy_ranges is None:
         from google_calendar_utils import list_event_ranges_for_day
         busy_ranges = list_event_ranges_for_day(peluqueria, fecha)  # [(HH:MM, HH:MM)]
-        busy_min = [(_to_min(a), _to_min(b)) for (a, b) in busy_ranges]
+    return ocupacion_dia(busy_ranges)
 
-        def concurrent_busy(a: int, b: int) -> int:
-            """Número de eventos de Calendar que solapan [a,b)."""
-            c = 0
-            for x1, x2 in busy_min:
-                if a < x2 and x1 < b:
-                    c += 1
-            return c
 
-        slots: list[str] = []
-        for ini, fin in tramos:
-            start = _to_min(ini)
-            end   = _to_min(fin)
-            cur   = start
-            while cur + dur <= end:
-                if cutoff_abs_min is not None and cur < cutoff_abs_min:
-                    cur += step
-                    continue
-                # libre si solapados reales < capacidad
-                if concurrent_busy(cur, cur + dur) < capacidad:
-                    slots.append(_from_min(cur))
-                cur += step
-
-        return slots
+# ————— Cálculo de horas disponibles —————
+def horas_disponibles(db, peluqueria, servicio, fecha_str: str, busy_ranges=None) -> list[str]:
+    """
+    Devuelve horas de inicio 'HH:MM' disponibles en 'fecha_str' leyendo
+    la OCUPACIÓN desde Google Calendar (peluqueria.cal_id).
+    Si se pasa 'busy_ranges' ([(HH:MM, HH:MM)], ya leídos de Calendar) no se consulta Calendar.
 
+    Reglas:
+    - Un slot es válido si las reservas solapadas < num_peluqueros.
+    - Paso entre slots = peluqueria.rango_reservas (fallback 30).
+    - Respeta antelaciones y tramos horarios de la peluquería.
+    """
+    try:
+        por_servicio = horas_disponibles_por_servicio(db, peluqueria, [servicio], fecha_str, busy_ranges=busy_ranges)
+        return por_servicio[getattr(servicio, "id", None)]
     except Exception as e:
         try:
             sentry_sdk.capture_exception(e)
@@ -178,80 +227,78 @@ def horas_disponibles(db, peluqueria, servicio, fecha_str: str) -> list[str]:
         logging.error("horas_disponibles (GCal) error", exc_info=True)
         return []
 
-def horas_disponibles_para_peluquero(db, peluqueria, servicio, peluquero_id: int, fecha_str: str) -> list[str]:
+def horas_disponibles_por_servicio(db, peluqueria, servicios, fecha_str: str, busy_ranges=None) -> dict:
+    """
+    {servicio.id: [HH:MM, ...]} para varios servicios del mismo día con UNA lectura de Calendar
+    y UNA ocupación del día; cada servicio solo cuesta recorrer sus slots.
+    """
+    capacidad = int(getattr(peluqueria, "num_peluqueros", 1) or 1)
+    step = _step_de(peluqueria)
+    fecha = datetime.strptime(fecha_str, "%Y-%m-%d").date()
+
+    dia = _dia_reservable(peluqueria, fecha)
+    if dia is None:
+        return {getattr(s, "id", None): [] for s in servicios}
+    tramos, cutoff_abs_min = dia
+
+    ocupacion = _ocupacion_calendar(peluqueria, fecha, busy_ranges)
+    return {
+        getattr(s, "id", None): ocupacion.inicios_libres(
+            tramos, int(getattr(s, "duracion_min", 30) or 30), step, capacidad, cutoff_abs_min
+        )
+        for s in servicios
+    }
+
+def horas_disponibles_para_peluquero(db, peluqueria, servicio, peluquero_id: int, fecha_str: str, busy_ranges=None) -> list[str]:
     """
     Devuelve horas disponibles SOLO para el peluquero indicado,
     combinando calendario (ocupaciones generales) + reservas de BD de ese peluquero.
     Ahora también respeta min_avance_min y max_avance_dias como horas_disponibles().
+    'busy_ranges' igual que en horas_disponibles().
+    Es peluqueros_libres_por_hora() con un solo peluquero: una lectura de Calendar y una query de reservas.
+    """
+    return list(peluqueros_libres_por_hora(
+        db, peluqueria, servicio, fecha_str, peluquero_ids=[peluquero_id], busy_ranges=busy_ranges
+    ))
+
+
+def peluqueros_libres_por_hora(db, peluqueria, servicio, fecha_str: str, peluquero_ids=None, busy_ranges=None) -> dict:
+    """
+    {HH:MM: [peluquero_id, ...]} con los peluqueros libres en cada hora de inicio del día
+    (antelación, horario del día y Calendar con capacidad 1). Una lectura de Calendar y una query de
+    reservas para todos los peluqueros: la usan horas_disponibles_para_peluquero y la autoasignación
+    "sin preferencia" de la confirmación (app.autoasigna_peluquero). Horas sin nadie libre no aparecen.
+    'peluquero_ids' por defecto = peluqueros activos, en su orden.
     """
     try:
-        step = getattr(peluqueria, "rango_reservas", 30) or 30
+        step = _step_de(peluqueria)
         dur = int(getattr(servicio, "duracion_min", 30) or 30)
         fecha = datetime.strptime(fecha_str, "%Y-%m-%d").date()
 
-        # --- 🕒 Validaciones de antelación ---
-        ahora = now_local(peluqueria)
-        min_avance = int(getattr(peluqueria, "min_avance_min", 60) or 60)
-        max_dias = int(getattr(peluqueria, "max_avance_dias", 150) or 150)
-
-        # Demasiado en el futuro
-        if fecha > (ahora + timedelta(days=max_dias)).date():
-            return []
-
-        # Si es hoy, calcula el límite absoluto en minutos
-        cutoff_abs_min = None
-        if fecha == ahora.date():
-            cutoff_abs_min = (ahora.hour * 60 + ahora.minute) + min_avance
-
-        # Horario del día (usa los mismos helpers que horas_disponibles)
-        try:
-            tramos = _tramos_para_fecha(getattr(peluqueria, "horario", ""), fecha)
-        except Exception:
-            tramos = _parse_horario(getattr(peluqueria, "horario", ""))
-
-        # Bloqueos desde Google Calendar (no por peluquero, sino del salón)
-        from google_calendar_utils import list_event_ranges_for_day
-        busy_ranges = list_event_ranges_for_day(peluqueria, fecha)
-        busy_min = [(_to_min(a), _to_min(b)) for (a, b) in busy_ranges]
+        dia = _dia_reservable(peluqueria, fecha)
+        if dia is None:
+            return {}
+        tramos, cutoff_abs_min = dia
 
-        def concurrent_busy(a: int, b: int) -> bool:
-            """True si el rango solapa con Calendar."""
-            for x1, x2 in busy_min:
-                if a < x2 and x1 < b:
-                    return True
-            return False
+        if peluquero_ids is None:
+            from peluqueros_utils import get_active_peluqueros
+            peluquero_ids = [p.id for p in get_active_peluqueros(db, peluqueria.id)]
 
-        slots: list[str] = []
-        for ini, fin in tramos:
-            start = _to_min(ini)
-            end = _to_min(fin)
-            cur = start
-            while cur + dur <= end:
-                # ⛔ Saltar si antes del tiempo mínimo permitido
-                if cutoff_abs_min is not None and cur < cutoff_abs_min:
-                    cur += step
-                    continue
-
-                # ⛔ Saltar si solapa con Calendar
-                if concurrent_busy(cur, cur + dur):
-                    cur += step
-                    continue
-
-                hora_str = _from_min(cur)
-                # ✅ Verificar solape con otras reservas de ese peluquero
-                if not check_overlap_for_peluquero(
-                    db, peluqueria.id, peluquero_id, fecha,
-                    datetime.strptime(hora_str, "%H:%M").time(), dur
-                ):
-                    slots.append(hora_str)
-
-                cur += step
-        return slots
+        candidatas = _ocupacion_calendar(peluqueria, fecha, busy_ranges).inicios_libres(
+            tramos, dur, step, 1, cutoff_abs_min
+        )
+        agenda = AgendaPeluqueros.cargar(db, peluqueria.id, fecha)
+        out = {}
+        for h in candidatas:
+            libres = agenda.libres_en(peluquero_ids, h, dur)
+            if libres:
+                out[h] = libres
+        return out
 
     except Exception as e:
         sentry_sdk.capture_exception(e)
-        logging.error("horas_disponibles_para_peluquero error", exc_info=True)
-        return []
+        logging.error("peluqueros_libres_por_hora error", exc_info=True)
+        return {}
 
 
 def formatea_fecha_es(fecha_in) -> str:
@@ -378,82 +425,3 @@ def hay_solape(session, peluqueria, fecha_in, hora_in, dur_min: int, peluquero_i
     enable_sel = bool(getattr(peluqueria, "enable_peluquero_selection", False))
     target_peluquero_id = peluquero_id if enable_sel else None
     return check_overlap_for_peluquero(session, peluqueria.id, target_peluquero_id, fecha, hora, dur_min)
-
-# --- FUNCIÓN: creación de reserva con peluquero (si aplica) ---
-def crear_reserva(session, peluqueria, datos: dict):
-    """
-    datos esperados:
-      'fecha': date | 'YYYY-MM-DD' | 'dd/mm/aaaa'
-      'hora': time | 'HH:MM'
-      'duracion_min': int (opcional; si no viene se intenta tomar de 'servicio' o 30)
-      'telefono': str
-      'nombre': str (opcional)
-      'servicio_id': int (opcional si pasas 'servicio')
-      'servicio': obj con .id y .duracion_min (opcional)
-      'peluquero_id': Optional[int] (opcional)
-    """
-    # Normalización de entradas
-    fecha = _ensure_date(datos.get("fecha"))
-    hora = _ensure_time(datos.get("hora"))
-
-    # Duración
-    dur = datos.get("duracion_min")
-    if dur is None:
-        servicio = datos.get("servicio")
-        if servicio is not None:
-            try:
-                dur = int(getattr(servicio, "duracion_min", 30) or 30)
-            except Exception:
-                dur = 30
-        else:
-            try:
-                dur = int(datos.get("duracion_min", 30) or 30)
-            except Exception:
-                dur = 30
-
-    # Peluquero (si procede)
-    peluquero_id = datos.get("peluquero_id")
-    enable_sel = bool(getattr(peluqueria, "enable_peluquero_selection", False))
-    required_sel = bool(getattr(peluqueria, "peluquero_selection_required", False))
-
-    if enable_sel and peluquero_id is None:
-        if required_sel:
-            raise ValueError("Debes elegir peluquero.")
-        # No es requerido: intentamos asignar automáticamente uno libre
-        asignado = pick_any_available(session, peluqueria.id, fecha, hora, dur)
-        peluquero_id = asignado.id if asignado else None
-
-    # Chequeo de solape (por peluquero si aplica)
-    if hay_solape(session, peluqueria, fecha, hora, dur, peluquero_id):
-        if enable_sel:
-            raise ValueError("La hora seleccionada ya no está disponible para ese peluquero.")
-        else:
-            raise ValueError("La hora seleccionada ya no está disponible.")
-
-    # Construcción de la reserva
-    servicio_id = datos.get("servicio_id")
-    if servicio_id is None and datos.get("servicio") is not None:
-        try:
-            servicio_id = int(getattr(datos["servicio"], "id"))
-        except Exception:
-            servicio_id = None
-
-    r = Reserva(
-        peluqueria_id=getattr(peluqueria, "id"),
-        fecha=fecha,
-        hora=hora,
-        telefono=datos.get("telefono"),
-        nombre=datos.get("nombre"),
-        servicio_id=servicio_id,
-        peluquero_id=peluquero_id,
-    )
-    try:
-        session.flush()  # asegura r.id
-    except IntegrityError:
-        session.rollback()
-        # Mensaje claro si alguien cogió el hueco justo antes
-        if peluquero_id:
-            raise ValueError("Esa hora ya se ha ocupado para ese profesional. Elige otra hora.")
-        else:
-            raise ValueError("Esa hora acaba de ocuparse. Prueba con otra.")
-    return r
\ No newline at end of file
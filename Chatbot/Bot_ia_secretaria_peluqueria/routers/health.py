@@ -29,6 +29,15 @@ def health():
     return jsonify({"status": "OK"}), 200
 
 
+@bp.get("/stats")
+def stats():
+    """Contadores en proceso de las cachés de IA y de FAQ (aciertos, fallos y hit_rate de este worker)."""
+    from faq_cache import faq
+    from ia_cache import cache
+
+    return jsonify({"ia_cache": cache.stats(), "faq_cache": faq.stats()}), 200
+
+
 @bp.get("/ready")
 def ready():
     """Readiness: DB + Redis + GCal."""
@@ -57,9 +66,10 @@ def ready():
     redis_url = os.getenv("REDIS_URL")
     if redis_url:
         try:
-            import redis  # type: ignore
+            import redis_conn
 
-            client = redis.Redis.from_url(redis_url)
+            # Pool compartido del proceso: el probe no abre una conexión TCP nueva cada vez
+            client = redis_conn.get_client(redis_url)
             client.setex("probe", 5, "1")
             payload["redis"] = True
         except Exception as exc:  # pragma: no cover - rutas de error
@@ -13,7 +13,6 @@ Requisitos:
 """
 
 import logging
-import requests
 from datetime import datetime, timedelta
 from zoneinfo import ZoneInfo
 
@@ -25,6 +24,7 @@ from models import Reserva, Peluqueria  # asumiendo relación Reserva.peluqueria
 from sqlalchemy.orm import selectinload
 from settings import settings
 from storage import get_storage
+from graph_client import graph
 
 # Opcional: si tienes util para formato en español
 try:
@@ -67,16 +67,14 @@ def hhmm_str(value) -> str:
         return str(value)
 
 def wa_send_text(token: str, graph_ver: str, phone_number_id: str, to: str, body: str) -> bool:
-    url = f"https://graph.facebook.com/{graph_ver}/{phone_number_id}/messages"
     payload = {
         "messaging_product": "whatsapp",
         "to": to,
         "type": "text",
         "text": {"preview_url": False, "body": body[:4096]},
     }
-    headers = {"Authorization": f"Bearer {token}", "Content-Type": "application/json"}
     try:
-        r = requests.post(url, headers=headers, json=payload, timeout=10)
+        r = graph.post_message(phone_number_id, payload, token=token, graph_ver=graph_ver)
         if not r.ok:
             log.warning("WA reminder failed %s: %s", r.status_code, r.text[:200])
         return r.ok
@@ -0,0 +1,128 @@
+# session_executor.py — ejecutor con orden por sesión
+# - Serializa el trabajo de una misma clave (session_id): los mensajes de un usuario
+#   se procesan en orden y nunca en paralelo
+# - Claves distintas corren en paralelo sobre un pool configurable
+# - Cola acotada por tenant (backpressure) + métricas + drenado al apagar
+from __future__ import annotations
+
+import logging
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Hashable
+
+import sentry_sdk
+
+
+class KeyedExecutor:
+    def __init__(self, max_workers: int = 8, max_pending_per_tenant: int = 200, name: str = "core"):
+        self._pool = ThreadPoolExecutor(max_workers=max(1, int(max_workers)), thread_name_prefix=name)
+        self._max_pending = max(1, int(max_pending_per_tenant))
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        # key -> deque[(tenant, fn, args, kwargs, enqueued_at)]
+        self._queues: dict[Hashable, deque] = {}
+        self._pending_by_tenant: dict[Hashable, int] = {}
+        self._closed = False      # no se aceptan tareas nuevas (se sigue drenando)
+        self._stopped = False     # el pool ya no admite submit: lo que quede en cola se descarta
+        self._counters = {"submitted": 0, "rejected": 0, "completed": 0, "failed": 0, "dropped": 0}
+        self._max_wait_ms = 0.0
+
+    def submit(self, key: Hashable, tenant: Hashable, fn: Callable, *args, **kwargs) -> bool:
+        """
+        Encola fn(*args, **kwargs) detrás del trabajo pendiente de 'key'.
+        Devuelve False si el tenant ha llenado su cola o el ejecutor está cerrando.
+        """
+        with self._lock:
+            if self._closed or self._pending_by_tenant.get(tenant, 0) >= self._max_pending:
+                self._counters["rejected"] += 1
+                return False
+            self._pending_by_tenant[tenant] = self._pending_by_tenant.get(tenant, 0) + 1
+            self._counters["submitted"] += 1
+            q = self._queues.get(key)
+            start_runner = q is None
+            if start_runner:
+                q = self._queues[key] = deque()
+            q.append((tenant, fn, args, kwargs, time.monotonic()))
+        if start_runner:
+            self._pool.submit(self._run_next, key)
+        return True
+
+    def _run_next(self, key: Hashable) -> None:
+        # Un único runner vivo por clave: ejecuta UNA tarea y se re-encola si quedan más,
+        # así una sesión con muchos mensajes no monopoliza un hilo del pool.
+        with self._lock:
+            tenant, fn, args, kwargs, enqueued_at = self._queues[key][0]
+            wait_ms = (time.monotonic() - enqueued_at) * 1000
+            self._max_wait_ms = max(self._max_wait_ms, wait_ms)
+        ok = True
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            ok = False
+            sentry_sdk.capture_exception(e)
+            logging.error("Error en tarea del core (key=%s): %s", key, e, exc_info=True)
+        finally:
+            with self._lock:
+                q = self._queues[key]
+                q.popleft()
+                self._counters["completed" if ok else "failed"] += 1
+                left = self._pending_by_tenant.get(tenant, 1) - 1
+                if left > 0:
+                    self._pending_by_tenant[tenant] = left
+                else:
+                    self._pending_by_tenant.pop(tenant, None)
+                if q and self._stopped:
+                    self._drop_locked(key)
+                elif q:
+                    # bajo el lock: shutdown() no puede cerrar el pool entre la comprobación y el submit
+                    self._pool.submit(self._run_next, key)
+                else:
+                    self._queues.pop(key, None)
+                    if not self._queues:
+                        self._idle.notify_all()
+
+    def _drop_locked(self, key: Hashable) -> None:
+        """Descarta la cola de 'key' (apagado sin drenar)."""
+        for tenant, *_ in self._queues.pop(key, ()):
+            self._counters["dropped"] += 1
+            left = self._pending_by_tenant.get(tenant, 1) - 1
+            if left > 0:
+                self._pending_by_tenant[tenant] = left
+            else:
+                self._pending_by_tenant.pop(tenant, None)
+        if not self._queues:
+            self._idle.notify_all()
+
+    def stats(self) -> dict:
+        """Métricas de backpressure (para logs/Sentry)."""
+        with self._lock:
+            return {
+                **self._counters,
+                "active_keys": len(self._queues),
+                "pending": sum(self._pending_by_tenant.values()),
+                "pending_by_tenant": dict(self._pending_by_tenant),
+                "max_wait_ms": round(self._max_wait_ms, 1),
+            }
+
+    def shutdown(self, timeout: float = 25.0) -> bool:
+        """
+        Deja de aceptar trabajo y espera (hasta 'timeout' s) a que se vacíen las colas.
+        Devuelve True si se drenó todo.
+        """
+        deadline = time.monotonic() + max(0.0, float(timeout))
+        with self._lock:
+            self._closed = True
+            while self._queues:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self._idle.wait(remaining)
+            drained = not self._queues
+            pending = sum(self._pending_by_tenant.values())
+            self._stopped = True
+        if not drained:
+            logging.warning("Apagado con %d mensajes del core sin procesar", pending)
+        self._pool.shutdown(wait=drained, cancel_futures=not drained)
+        return drained
@@ -26,20 +26,41 @@ class Settings(BaseSettings):
 
     # ---------------- OpenAI ----------------
     OPENAI_API_KEY: str = "changeme"
+    INTENT_LOCAL_MIN_CONFIDENCE: float = 0.5  # intención por reglas si confianza >= esto; si no, IA
 
     # ---------------- Calendario / TZ ----------------
     CAL_TZ: str = "Europe/Madrid"
     GOOGLE_SERVICE_ACCOUNT_FILE: str = "credentials.json"
+    CAL_MIRROR_ENABLED: bool = True                # ocupación desde el espejo local (syncToken)
+                                                   # lo alimentan sync_calendars.py (cron) y los push: con
+                                                   # STORAGE_BACKEND=memory cada worker lee en vivo
+    CAL_MIRROR_MAX_STALENESS_SECONDS: int = 180    # más viejo que esto => se consulta Calendar en vivo
+    CAL_MIRROR_HORIZON_DAYS: int = 200             # días por delante en el espejo (>= max_avance_dias)
+    GCAL_WEBHOOK_URL: Optional[str] = None         # URL pública https de /webhook/gcal (vacío = sin push)
+    GCAL_WEBHOOK_SECRET: str = "changeme"          # firma el token de cada canal push
+    HORAS_CACHE_TTL_SECONDS: int = 120             # caché de horas sin push
+    HORAS_CACHE_TTL_PUSH_SECONDS: int = 6 * 3600   # caché de horas con canal push activo
 
     # ---------------- WhatsApp Cloud API ----------------
     WABA_VERIFY_TOKEN: str = "changeme"
     WABA_APP_SECRET: str = "changeme"
     WABA_TOKEN: Optional[str] = None
     GRAPH_API_VERSION: str = "v23.0"
+    GRAPH_CONNECT_TIMEOUT_SECONDS: float = 3.05
+    GRAPH_READ_TIMEOUT_SECONDS: float = 10
+    GRAPH_POOL_MAXSIZE: int = 16          # >= CORE_WORKERS + threads de gunicorn
+    GRAPH_MAX_RETRIES: int = 2            # solo fallos de conexión y 429
+    GRAPH_RETRY_AFTER_MAX_SECONDS: float = 2.0  # tope al Retry-After de un 429 (bloquea un hilo del core)
 
     # ---------------- Estado / Rate limit ----------------
     STORAGE_BACKEND: str = "memory"  # "memory" | "redis"
     REDIS_URL: str = "redis://localhost:6379/0"
+    MEMORY_STORAGE_MAX_ENTRIES: int = 100_000  # backend "memory": tope de claves (expulsión LRU)
+    REDIS_MAX_CONNECTIONS: int = 32            # pool compartido por proceso (storage, limiter, locks, /ready)
+    REDIS_POOL_TIMEOUT_SECONDS: float = 2      # espera por una conexión libre del pool
+    REDIS_SOCKET_TIMEOUT_SECONDS: float = 2
+    REDIS_CONNECT_TIMEOUT_SECONDS: float = 2
+    REDIS_HEALTH_CHECK_SECONDS: int = 30       # PING antes de reutilizar una conexión ociosa
 
     # Límites TEXTUALES (Flask-Limiter)
     GLOBAL_PER_IP: str = "200/minute"      # <-- FALTABA ESTE CAMPO
@@ -53,7 +74,34 @@ class Settings(BaseSettings):
     OUTBOUND_WA_PER_USER: int = 70
 
     STRICT_LOCKS: bool = True
-    LOOPBACK_TIMEOUT_SECONDS: int = 40
+
+    # ---------------- Locks de franja (reservas) ----------------
+    SLOT_LOCK_BACKEND: str = "mysql"      # "mysql" (GET_LOCK) | "redis" (lease con TTL + fencing en slot_fence)
+    SLOT_LOCK_TTL_SECONDS: int = 15       # vida del lease en Redis; se renueva al comprobarlo antes del commit
+    SLOT_INVENTARIO_ENABLED: bool = False # capacidad desde slot_ocupacion (ejecutar backfill_slots.py antes)
+    SLOT_INVENTARIO_STEP_MIN: int = 5     # tamaño del tramo del inventario; no cambiar sin volver a hacer backfill
+
+    # ---------------- Caché de peluquerías (en proceso) ----------------
+    # Cota de staleness tras editar Peluqueria/Servicio/Peluquero desde el panel (no hay invalidación
+    # entre procesos); también la heredan las cachés de IA/FAQ, que cuelgan del fingerprint
+    TENANT_CACHE_TTL_SECONDS: int = 60
+    TENANT_CACHE_MAX_ENTRIES: int = 256
+
+    # ---------------- Caché de respuestas de la IA ----------------
+    IA_CACHE_ENABLED: bool = True
+    IA_CACHE_LOCAL_MAX_ENTRIES: int = 5000      # LRU en proceso (delante de storage)
+    IA_CACHE_TTL_INTENCION: int = 7 * 86400
+    IA_CACHE_TTL_SERVICIO: int = 86400          # la clave incluye el fingerprint del catálogo
+    IA_CACHE_TTL_FECHA: int = 86400             # la clave incluye la fecha local de hoy
+    IA_CACHE_TTL_HORA: int = 7 * 86400
+    FAQ_CACHE_ENABLED: bool = True               # respuestas de 'duda' por peluquería (exacta + casi-duplicada)
+    FAQ_CACHE_TTL_SECONDS: int = 86400           # además se invalida al cambiar el fingerprint del tenant
+    FAQ_CACHE_MAX_PER_PELU: int = 200
+    FAQ_CACHE_MIN_SIMILARITY: float = 0.75       # Jaccard de tokens para dar por repetida una pregunta
+
+    # ---------------- Cola del core (webhook WhatsApp) ----------------
+    CORE_WORKERS: int = 8                 # hilos por worker de gunicorn
+    CORE_MAX_PENDING_PER_PELU: int = 200  # mensajes encolados por peluquería antes de rechazar
 
     @property
     def RATE_LIMITS(self) -> Dict[str, object]:
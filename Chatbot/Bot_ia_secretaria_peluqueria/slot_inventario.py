@@ -0,0 +1,141 @@
+# slot_inventario.py — inventario de capacidad por tramo (tablas slot_ocupacion y slot_ocupacion_peluquero)
+# - Un tramo = SLOT_INVENTARIO_STEP_MIN minutos de un día; 'usados' = reservas confirmadas que lo cubren
+# - Reservar: UPDATE ... SET usados = usados + 1 WHERE usados < capacidad sobre los tramos de la franja.
+#   Si no se actualizan TODOS, no hay hueco y el llamante hace rollback. Sin named locks ni leer el día entero.
+# - Las filas se crean a 0 la primera vez (INSERT IGNORE en MySQL / INSERT OR IGNORE en SQLite)
+# - Cancelar: usados - 1 en los mismos tramos
+# - backfill(): reconstruye el inventario desde las reservas confirmadas (ver backfill_slots.py)
+from __future__ import annotations
+
+from collections import Counter
+from datetime import date, time
+from typing import Optional
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.orm import selectinload
+
+from settings import settings
+from models import Reserva, SlotOcupacion, SlotOcupacionPeluquero
+
+
+def _step() -> int:
+    return max(1, int(getattr(settings, "SLOT_INVENTARIO_STEP_MIN", 5) or 5))
+
+
+def tramos(hora: time, dur_min: int) -> list[int]:
+    """Minutos (desde 00:00) de los tramos que cubre [hora, hora+dur_min)."""
+    step = _step()
+    start = hora.hour * 60 + hora.minute
+    end = min(start + int(dur_min or 0), 24 * 60)
+    return list(range(start - start % step, end, step))
+
+
+def _asegurar_filas(db, model, owner: dict, fecha: date, mins: list[int]) -> None:
+    # Lectura sin bloqueo: solo se inserta lo que falta (evita el lock compartido de INSERT IGNORE
+    # sobre filas existentes, que con dos reservas a la vez acaba en deadlock)
+    (col, owner_id), = owner.items()
+    existentes = set(db.execute(
+        select(model.minuto).where(
+            getattr(model, col) == owner_id, model.fecha == fecha, model.minuto.in_(mins)
+        )
+    ).scalars())
+    faltan = [m for m in mins if m not in existentes]
+    if not faltan:
+        return
+    stmt = insert(model).prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite")
+    db.execute(stmt, [{col: owner_id, "fecha": fecha, "minuto": m, "usados": 0} for m in faltan])
+
+
+def _ocupar_en(db, model, col: str, owner_id: int, fecha: date, mins: list[int], capacidad: int) -> bool:
+    _asegurar_filas(db, model, {col: owner_id}, fecha, mins)
+    res = db.execute(
+        update(model)
+        .where(
+            getattr(model, col) == owner_id,
+            model.fecha == fecha,
+            model.minuto.in_(mins),
+            model.usados < capacidad,
+        )
+        .values(usados=model.usados + 1)
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount == len(mins)
+
+
+def ocupar(db, peluqueria_id: int, fecha: date, hora: time, dur_min: int, capacidad: int,
+           peluquero_id: Optional[int] = None) -> bool:
+    """
+    Suma 1 a los tramos de la franja si TODOS tienen hueco (y los del peluquero, si viene).
+    False => no hay hueco; lo ya sumado se deshace con el rollback del llamante.
+    """
+    mins = tramos(hora, dur_min)
+    if not mins:
+        return True
+    if not _ocupar_en(db, SlotOcupacion, "peluqueria_id", peluqueria_id, fecha, mins, capacidad):
+        return False
+    if peluquero_id:
+        return _ocupar_en(db, SlotOcupacionPeluquero, "peluquero_id", peluquero_id, fecha, mins, 1)
+    return True
+
+
+def liberar(db, peluqueria_id: int, fecha: date, hora: time, dur_min: int,
+            peluquero_id: Optional[int] = None) -> None:
+    """Resta 1 a los tramos de la franja (sin bajar de 0)."""
+    mins = tramos(hora, dur_min)
+    if not mins:
+        return
+    targets = [(SlotOcupacion, "peluqueria_id", peluqueria_id)]
+    if peluquero_id:
+        targets.append((SlotOcupacionPeluquero, "peluquero_id", peluquero_id))
+    for model, col, owner_id in targets:
+        db.execute(
+            update(model)
+            .where(
+                getattr(model, col) == owner_id,
+                model.fecha == fecha,
+                model.minuto.in_(mins),
+                model.usados > 0,
+            )
+            .values(usados=model.usados - 1)
+            .execution_options(synchronize_session=False)
+        )
+
+
+def duracion_de(reserva) -> int:
+    d = getattr(reserva, "duracion_min", None)
+    if d is None:
+        d = getattr(getattr(reserva, "servicio", None), "duracion_min", 0)
+    return int(d or 0)
+
+
+def backfill(db, desde: date) -> int:
+    """
+    Rehace el inventario a partir de 'desde' con las reservas confirmadas. Devuelve cuántas se contaron.
+    Hacer commit después. Pensado para ejecutarse con SLOT_INVENTARIO_ENABLED=False (o sin tráfico).
+    """
+    db.query(SlotOcupacion).filter(SlotOcupacion.fecha >= desde).delete(synchronize_session=False)
+    db.query(SlotOcupacionPeluquero).filter(SlotOcupacionPeluquero.fecha >= desde).delete(synchronize_session=False)
+
+    por_pelu: Counter = Counter()
+    por_peluquero: Counter = Counter()
+    reservas = (
+        db.query(Reserva)
+        .options(selectinload(Reserva.servicio))
+        .filter(Reserva.fecha >= desde, Reserva.estado == "confirmada")
+        .all()
+    )
+    for r in reservas:
+        for m in tramos(r.hora, duracion_de(r)):
+            por_pelu[(r.peluqueria_id, r.fecha, m)] += 1
+            if r.peluquero_id:
+                por_peluquero[(r.peluquero_id, r.fecha, m)] += 1
+
+    if por_pelu:
+        db.execute(insert(SlotOcupacion), [
+            {"peluqueria_id": pid, "fecha": f, "minuto": m, "usados": n} for (pid, f, m), n in por_pelu.items()
+        ])
+    if por_peluquero:
+        db.execute(insert(SlotOcupacionPeluquero), [
+            {"peluquero_id": pid, "fecha": f, "minuto": m, "usados": n} for (pid, f, m), n in por_peluquero.items()
+        ])
+    return len(reservas)
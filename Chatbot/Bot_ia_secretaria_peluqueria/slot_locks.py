@@ -0,0 +1,171 @@
+# slot_locks.py — backends de lock por franja para guardar_reserva_db (SLOT_LOCK_BACKEND)
+# - "mysql": named locks GET_LOCK en la propia sesión de BD (una sentencia para todas las claves)
+# - "redis": lease con TTL + token de fencing; todas las claves se toman a la vez con un script Lua,
+#            y se toma ANTES de abrir la sesión de la reserva: la espera por un hueco disputado no
+#            retiene una conexión del pool de MySQL.
+#            El fence se persiste en slot_fence con un UPDATE condicional DENTRO de la transacción de la
+#            reserva: si el lease caducó y otro ya escribió con un fence mayor, el UPDATE no toca la fila
+#            y la reserva hace rollback (el lease solo no basta: puede caducar entre la comprobación y el commit)
+from __future__ import annotations
+
+import logging
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Optional
+
+import sentry_sdk
+from sqlalchemy import insert, select, update
+
+from settings import settings
+from models import SlotFence
+
+FENCE_KEY = "slotlock:fence"
+RETRY_SLEEP_SECONDS = 0.05
+
+# KEYS[1] = contador de fencing, KEYS[2..] = slots; ARGV[1] = token, ARGV[2] = ttl ms
+_ACQUIRE_LUA = """
+for i = 2, #KEYS do
+  if redis.call('EXISTS', KEYS[i]) == 1 then return 0 end
+end
+local fence = redis.call('INCR', KEYS[1])
+for i = 2, #KEYS do
+  redis.call('SET', KEYS[i], ARGV[1], 'PX', ARGV[2])
+end
+return fence
+"""
+
+# Solo toca las claves que siguen siendo nuestras (no borra el lease de otro tras expirar el nuestro)
+_RELEASE_LUA = """
+local n = 0
+for i = 1, #KEYS do
+  if redis.call('GET', KEYS[i]) == ARGV[1] then
+    redis.call('DEL', KEYS[i])
+    n = n + 1
+  end
+end
+return n
+"""
+
+# 1 si todas las claves siguen con nuestro token (y les renueva el TTL), 0 si alguna expiró
+_CHECK_LUA = """
+for i = 1, #KEYS do
+  if redis.call('GET', KEYS[i]) ~= ARGV[1] then return 0 end
+end
+for i = 1, #KEYS do
+  redis.call('PEXPIRE', KEYS[i], ARGV[2])
+end
+return 1
+"""
+
+
+@dataclass
+class SlotLease:
+    keys: list = field(default_factory=list)
+    token: str = ""
+    fence: int = 0
+
+
+class MySQLSlotLocks:
+    """GET_LOCK ... AND GET_LOCK ... en la sesión de la reserva (no-op fuera de MySQL)."""
+
+    name = "mysql"
+    needs_session = True   # GET_LOCK va en la sesión de la reserva
+
+    def acquire(self, db, keys: list, timeout_sec: int = 5) -> Optional[SlotLease]:
+        from bd_utils import _acquire_locks_batch
+        got = _acquire_locks_batch(db, keys, timeout_sec=timeout_sec)
+        return None if got is None else SlotLease(keys=got)
+
+    def fence_write(self, db, lease: SlotLease) -> bool:
+        # los named locks viven lo que la sesión: no caducan a mitad de transacción
+        return True
+
+    def release(self, db, lease: SlotLease) -> None:
+        if lease and lease.keys:
+            from bd_utils import _release_all_locks
+            _release_all_locks(db)
+
+
+class RedisSlotLocks:
+    """Lease en Redis: todas las claves o ninguna, con TTL y un token de fencing creciente."""
+
+    name = "redis"
+    needs_session = False  # se toma antes de abrir la sesión de BD (db=None)
+
+    def __init__(self, client, ttl_seconds: int = 15):
+        self._r = client
+        self._ttl_ms = int(ttl_seconds * 1000)
+        self._acquire = client.register_script(_ACQUIRE_LUA)
+        self._release = client.register_script(_RELEASE_LUA)
+        self._check = client.register_script(_CHECK_LUA)
+
+    def acquire(self, db, keys: list, timeout_sec: int = 5) -> Optional[SlotLease]:
+        keys = sorted(set(keys or []))
+        if not keys:
+            return SlotLease()
+        token = uuid.uuid4().hex
+        deadline = time.monotonic() + timeout_sec
+        while True:
+            try:
+                fence = int(self._acquire(keys=[FENCE_KEY] + keys, args=[token, self._ttl_ms]) or 0)
+            except Exception as e:
+                sentry_sdk.capture_exception(e)
+                logging.error("Redis no disponible para locks de slot: %s", e)
+                return None if getattr(settings, "STRICT_LOCKS", True) else SlotLease(keys=[])
+            if fence:
+                return SlotLease(keys=keys, token=token, fence=fence)
+            if time.monotonic() >= deadline:
+                return None
+            time.sleep(RETRY_SLEEP_SECONDS)
+
+    def fence_write(self, db, lease: SlotLease) -> bool:
+        """
+        Justo antes del commit, en la transacción de la reserva: renueva el lease y deja el fence en
+        slot_fence solo si es mayor que el último escrito en cada clave. False => otro lease más nuevo
+        ya escribió (o el nuestro caducó) y el llamante hace rollback.
+        """
+        if not lease.keys:
+            return True
+        try:
+            if int(self._check(keys=lease.keys, args=[lease.token, self._ttl_ms]) or 0) != 1:
+                return False
+        except Exception as e:
+            sentry_sdk.capture_exception(e)
+            return False
+        return _escribir_fence(db, lease.keys, lease.fence)
+
+    def release(self, db, lease: SlotLease) -> None:
+        if not lease or not lease.keys:
+            return
+        try:
+            self._release(keys=lease.keys, args=[lease.token])
+        except Exception as e:
+            # el TTL lo soltará igualmente
+            sentry_sdk.capture_exception(e)
+
+
+def _escribir_fence(db, keys: list, fence: int) -> bool:
+    # filas a 0 la primera vez (como slot_inventario); luego UPDATE ... WHERE fence < :fence, que además
+    # deja bloqueadas las filas hasta el commit: un lease más nuevo espera y después ve nuestro fence
+    existentes = set(db.execute(select(SlotFence.clave).where(SlotFence.clave.in_(keys))).scalars())
+    faltan = [k for k in keys if k not in existentes]
+    if faltan:
+        stmt = insert(SlotFence).prefix_with("IGNORE", dialect="mysql").prefix_with("OR IGNORE", dialect="sqlite")
+        db.execute(stmt, [{"clave": k, "fence": 0} for k in faltan])
+    res = db.execute(
+        update(SlotFence)
+        .where(SlotFence.clave.in_(keys), SlotFence.fence < fence)
+        .values(fence=fence)
+        .execution_options(synchronize_session=False)
+    )
+    return res.rowcount == len(keys)
+
+
+def get_slot_locks(_settings=None):
+    st = _settings or settings
+    if (getattr(st, "SLOT_LOCK_BACKEND", "mysql") or "mysql").lower() == "redis":
+        import redis_conn
+        client = redis_conn.get_client(st.REDIS_URL)
+        return RedisSlotLocks(client, ttl_seconds=st.SLOT_LOCK_TTL_SECONDS)
+    return MySQLSlotLocks()
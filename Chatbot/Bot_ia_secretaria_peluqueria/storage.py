@@ -1,5 +1,9 @@
 # storage.py — abstracción de almacenamiento (memoria o Redis)
+import heapq
+import re
+import threading
 import time
+from collections import OrderedDict
 from typing import Optional
 from settings import settings
 
@@ -12,33 +16,338 @@ class Storage:
         raise NotImplementedError
     def delete(self, key: str) -> None:
         raise NotImplementedError
+    def expire(self, key: str, ttl: int) -> None:
+        """Renueva el TTL de la clave si existe (sin tocar el valor)."""
+        raise NotImplementedError
+    def set_if_absent(self, key: str, value: str, ttl: int) -> bool:
+        """SET NX EX: True si la clave no existía y se ha guardado."""
+        raise NotImplementedError
+
+    def admit_message(self, ts_key: str, seen_key: Optional[str], ts: int, ttl: int,
+                      peek_key: Optional[str] = None) -> tuple[str, Optional[str]]:
+        """
+        Puerta de entrada de un mensaje: dedup (seen_key) + orden (ts >= last_ts) en UNA operación atómica.
+        Devuelve (veredicto, valor de peek_key leído en el mismo viaje); veredicto: ADMIT | DUPLICATE | STALE.
+        Si admite, guarda ts en ts_key y marca seen_key.
+        """
+        raise NotImplementedError
+
+    def set_versioned(self, key: str, body: str, ttl: int, expected: Optional[int] = None) -> Optional[int]:
+        """
+        Guarda un objeto JSON (body, sin '_v') con versión creciente en '_v' (primer campo).
+        Con expected: compare-and-set, solo si la versión guardada coincide.
+        Devuelve la nueva versión, o None si hubo conflicto.
+        """
+        raise NotImplementedError
+
+    # Lotes: versión genérica (una llamada por clave); los backends la sobrescriben con una sola ida y vuelta
+    def mget(self, keys: list[str]) -> list[Optional[str]]:
+        return [self.get(k) for k in keys]
+    def mset_ex(self, items: dict[str, str], ttl: int) -> None:
+        for k, v in items.items():
+            self.setex(k, v, ttl)
+    def delete_many(self, keys: list[str]) -> None:
+        for k in keys:
+            self.delete(k)
+    def pipeline(self) -> "Pipeline":
+        return Pipeline(self)
+
+
+ADMIT = "admit"
+DUPLICATE = "duplicate"
+STALE = "stale"
+
+# KEYS[1]=last_ts, KEYS[2]=seen_wamid ('' si no hay), KEYS[3]=clave a devolver ('' si ninguna)
+# ARGV[1]=ts, ARGV[2]=ttl
+_ADMIT_LUA = """
+local peek = false
+if KEYS[3] ~= '' then peek = redis.call('GET', KEYS[3]) end
+if KEYS[2] ~= '' and redis.call('EXISTS', KEYS[2]) == 1 then return {'duplicate', peek} end
+local last = tonumber(redis.call('GET', KEYS[1]) or '0') or 0
+if tonumber(ARGV[1]) < last then return {'stale', peek} end
+redis.call('SET', KEYS[1], ARGV[1], 'EX', ARGV[2])
+if KEYS[2] ~= '' then redis.call('SET', KEYS[2], '1', 'EX', ARGV[2]) end
+return {'admit', peek}
+"""
+
+
+def _last_ts(raw: Optional[str]) -> int:
+    try:
+        return int(float(raw)) if raw is not None else 0
+    except (TypeError, ValueError):
+        return 0
+
+
+# Documentos versionados: '{"_v":N,' + resto del JSON. Se lee la versión sin decodificar el documento.
+_VERSION_RE = re.compile(r'^\{"_v":(\d+)')
+
+
+def doc_version(raw: Optional[str]) -> int:
+    m = _VERSION_RE.match(raw or "")
+    return int(m.group(1)) if m else 0
+
+
+def with_version(body: str, version: int) -> str:
+    rest = body.strip()[1:]
+    return '{"_v":%d%s' % (version, rest if rest.lstrip().startswith("}") else "," + rest)
+
+
+# KEYS[1]=documento; ARGV[1]=body JSON sin _v, ARGV[2]=ttl, ARGV[3]=versión esperada ('' = sin CAS)
+_SET_VERSIONED_LUA = """
+local cur = redis.call('GET', KEYS[1])
+local v = 0
+if cur then v = tonumber(string.match(cur, '^{"_v":(%d+)') or '0') end
+if ARGV[3] ~= '' and tonumber(ARGV[3]) ~= v then return -1 end
+local rest = string.sub(ARGV[1], 2)
+if string.sub(rest, 1, 1) ~= '}' then rest = ',' .. rest end
+redis.call('SET', KEYS[1], '{"_v":' .. (v + 1) .. rest, 'EX', ARGV[2])
+return v + 1
+"""
+
+
+class Pipeline:
+    """
+    Operaciones encoladas que se ejecutan juntas al salir del 'with' (o con execute()).
+    Resultados en .results, en el mismo orden. Memoria: bajo su lock; Redis: MULTI/EXEC en un viaje.
+
+        with storage.pipeline() as p:
+            p.incr("rl:x", ttl=60)
+            p.get("state:x")
+        count, raw = p.results
+    """
+    def __init__(self, storage: Storage):
+        self._storage = storage
+        self._ops: list[tuple[str, tuple]] = []
+        self.results: Optional[list] = None
+
+    def get(self, key: str) -> "Pipeline":
+        self._ops.append(("get", (key,)))
+        return self
+    def setex(self, key: str, value: str, ttl: int) -> "Pipeline":
+        self._ops.append(("setex", (key, value, ttl)))
+        return self
+    def incr(self, key: str, ttl: int) -> "Pipeline":
+        self._ops.append(("incr", (key, ttl)))
+        return self
+    def delete(self, key: str) -> "Pipeline":
+        self._ops.append(("delete", (key,)))
+        return self
+    def set_if_absent(self, key: str, value: str, ttl: int) -> "Pipeline":
+        self._ops.append(("set_if_absent", (key, value, ttl)))
+        return self
+
+    def execute(self) -> list:
+        ops, self._ops = self._ops, []
+        self.results = self._run(ops) if ops else []
+        return self.results
+
+    def _run(self, ops: list[tuple[str, tuple]]) -> list:
+        return [getattr(self._storage, name)(*args) for name, args in ops]
+
+    def __enter__(self) -> "Pipeline":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        if exc_type is None:
+            self.execute()
+        return False
+
+
+class _MemoryPipeline(Pipeline):
+    def _run(self, ops):
+        # RLock: las operaciones vuelven a cogerlo; el lote entero es atómico frente a otros hilos
+        with self._storage._lock:
+            return super()._run(ops)
+
+
+class _RedisPipeline(Pipeline):
+    def __init__(self, storage: Storage, client):
+        super().__init__(storage)
+        self._r = client
+
+    def _run(self, ops):
+        pipe = self._r.pipeline()  # transaction=True => MULTI/EXEC
+        spans = []  # (nº de respuestas que consume la op, conversión)
+        for name, args in ops:
+            if name == "get":
+                pipe.get(args[0])
+                spans.append((1, lambda v: v[0]))
+            elif name == "setex":
+                key, value, ttl = args
+                pipe.setex(key, ttl, value)
+                spans.append((1, lambda v: None))
+            elif name == "incr":
+                key, ttl = args
+                pipe.incr(key)
+                pipe.expire(key, ttl)
+                spans.append((2, lambda v: int(v[0])))
+            elif name == "delete":
+                pipe.delete(args[0])
+                spans.append((1, lambda v: None))
+            elif name == "set_if_absent":
+                key, value, ttl = args
+                pipe.set(key, value, nx=True, ex=ttl)
+                spans.append((1, lambda v: bool(v[0])))
+        raw = pipe.execute()
+        out, i = [], 0
+        for n, conv in spans:
+            out.append(conv(raw[i:i + n]))
+            i += n
+        return out
 
 class MemoryStorage(Storage):
-    def __init__(self):
-        self._data: dict[str, tuple[str, float]] = {}
-    def get(self, key: str) -> Optional[str]:
+    """
+    Almacén en proceso para despliegues de un solo nodo (sin Redis):
+    - Caducidad por heap (exp, key): cada escritura barre lo vencido en tandas pequeñas
+    - Límite de entradas con expulsión LRU (las lecturas renuevan la posición)
+    - Todo bajo un lock: incr, set_if_absent y los pipelines son atómicos entre hilos
+    """
+    def __init__(self, max_entries: Optional[int] = None, sweep_batch: int = 64, clock=time.time):
+        self._data: "OrderedDict[str, tuple[str, float]]" = OrderedDict()
+        self._heap: list[tuple[float, str]] = []
+        self._lock = threading.RLock()
+        self._max_entries = max(1, int(max_entries or getattr(settings, "MEMORY_STORAGE_MAX_ENTRIES", 100_000)))
+        self._sweep_batch = max(1, int(sweep_batch))
+        self._clock = clock
+        self._hits = self._misses = self._expired = self._evictions = 0
+
+    # ---------- internos (con el lock cogido) ----------
+    def _get_locked(self, key: str, now: float) -> Optional[str]:
         row = self._data.get(key)
-        if not row:
+        if row is None:
             return None
         value, exp = row
-        if exp and exp < time.time():
-            self._data.pop(key, None)
+        if exp and exp <= now:
+            del self._data[key]
+            self._expired += 1
             return None
+        self._data.move_to_end(key)
         return value
+
+    def _set_locked(self, key: str, value: str, ttl: int, now: float) -> None:
+        exp = now + int(ttl)
+        self._data[key] = (value, exp)
+        self._data.move_to_end(key)
+        heapq.heappush(self._heap, (exp, key))
+        self._sweep_locked(now, self._sweep_batch)
+        while len(self._data) > self._max_entries:
+            self._data.popitem(last=False)
+            self._evictions += 1
+        # Entradas del heap de claves reescritas o expulsadas: se compacta si crece demasiado
+        if len(self._heap) > 2 * len(self._data) + 1024:
+            self._heap = [(e, k) for k, (_, e) in self._data.items()]
+            heapq.heapify(self._heap)
+
+    def _sweep_locked(self, now: float, limit: Optional[int]) -> int:
+        removed = 0
+        while self._heap and self._heap[0][0] <= now and (limit is None or removed < limit):
+            exp, key = heapq.heappop(self._heap)
+            row = self._data.get(key)
+            # solo si la entrada del heap sigue siendo la vigente (la clave pudo reescribirse)
+            if row is not None and row[1] == exp:
+                del self._data[key]
+                self._expired += 1
+                removed += 1
+        return removed
+
+    # ---------- API ----------
+    def get(self, key: str) -> Optional[str]:
+        with self._lock:
+            value = self._get_locked(key, self._clock())
+            if value is None:
+                self._misses += 1
+            else:
+                self._hits += 1
+            return value
     def setex(self, key: str, value: str, ttl: int) -> None:
-        self._data[key] = (value, time.time() + int(ttl))
+        with self._lock:
+            self._set_locked(key, value, ttl, self._clock())
     def incr(self, key: str, ttl: int) -> int:
-        value = int(self.get(key) or "0") + 1
-        self.setex(key, str(value), ttl)
-        return value
+        with self._lock:
+            now = self._clock()
+            value = int(self._get_locked(key, now) or "0") + 1
+            self._set_locked(key, str(value), ttl, now)
+            return value
     def delete(self, key: str) -> None:
-        self._data.pop(key, None)
+        with self._lock:
+            self._data.pop(key, None)
+    def expire(self, key: str, ttl: int) -> None:
+        with self._lock:
+            now = self._clock()
+            value = self._get_locked(key, now)
+            if value is not None:
+                self._set_locked(key, value, ttl, now)
+    def set_if_absent(self, key: str, value: str, ttl: int) -> bool:
+        with self._lock:
+            now = self._clock()
+            if self._get_locked(key, now) is not None:
+                return False
+            self._set_locked(key, value, ttl, now)
+            return True
+
+    def admit_message(self, ts_key, seen_key, ts, ttl, peek_key=None):
+        with self._lock:
+            now = self._clock()
+            peek = self._get_locked(peek_key, now) if peek_key else None
+            if seen_key and self._get_locked(seen_key, now) is not None:
+                return DUPLICATE, peek
+            if int(ts) < _last_ts(self._get_locked(ts_key, now)):
+                return STALE, peek
+            self._set_locked(ts_key, str(int(ts)), ttl, now)
+            if seen_key:
+                self._set_locked(seen_key, "1", ttl, now)
+            return ADMIT, peek
+
+    def set_versioned(self, key, body, ttl, expected=None):
+        with self._lock:
+            now = self._clock()
+            v = doc_version(self._get_locked(key, now))
+            if expected is not None and int(expected) != v:
+                return None
+            self._set_locked(key, with_version(body, v + 1), ttl, now)
+            return v + 1
+
+    def mget(self, keys: list[str]) -> list[Optional[str]]:
+        with self._lock:
+            now = self._clock()
+            out = [self._get_locked(k, now) for k in keys]
+            hits = sum(v is not None for v in out)
+            self._hits += hits
+            self._misses += len(out) - hits
+            return out
+    def mset_ex(self, items: dict[str, str], ttl: int) -> None:
+        with self._lock:
+            now = self._clock()
+            for k, v in items.items():
+                self._set_locked(k, v, ttl, now)
+    def delete_many(self, keys: list[str]) -> None:
+        with self._lock:
+            for k in keys:
+                self._data.pop(k, None)
+    def pipeline(self) -> Pipeline:
+        return _MemoryPipeline(self)
+
+    def sweep(self) -> int:
+        """Elimina todo lo caducado ya; devuelve cuántas claves quitó."""
+        with self._lock:
+            return self._sweep_locked(self._clock(), None)
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "hits": self._hits,
+                "misses": self._misses,
+                "expired": self._expired,
+                "evictions": self._evictions,
+                "size": len(self._data),
+                "max_entries": self._max_entries,
+            }
 
 def get_storage(_settings=None) -> Storage:
     st = _settings or settings
     if st.STORAGE_BACKEND.lower() == "redis":
-        import redis  # type: ignore
-        r = redis.Redis.from_url(st.REDIS_URL, decode_responses=True)
+        import redis_conn
+        r = redis_conn.get_client(st.REDIS_URL)
         class RedisStorage(Storage):
             def get(self, key: str) -> Optional[str]:
                 return r.get(key)
@@ -52,5 +361,41 @@ def get_storage(_settings=None) -> Storage:
                 return int(res[0])
             def delete(self, key: str) -> None:
                 r.delete(key)
+            def expire(self, key: str, ttl: int) -> None:
+                r.expire(key, ttl)
+            _admit_script = None
+
+            def set_if_absent(self, key: str, value: str, ttl: int) -> bool:
+                return bool(r.set(key, value, nx=True, ex=ttl))
+            def admit_message(self, ts_key, seen_key, ts, ttl, peek_key=None):
+                if self._admit_script is None:
+                    self._admit_script = r.register_script(_ADMIT_LUA)
+                verdict, peek = self._admit_script(
+                    keys=[ts_key, seen_key or "", peek_key or ""], args=[int(ts), int(ttl)]
+                )
+                return verdict, peek
+            _versioned_script = None
+
+            def set_versioned(self, key, body, ttl, expected=None):
+                if self._versioned_script is None:
+                    self._versioned_script = r.register_script(_SET_VERSIONED_LUA)
+                v = int(self._versioned_script(
+                    keys=[key], args=[body, int(ttl), "" if expected is None else int(expected)]
+                ))
+                return None if v < 0 else v
+            def mget(self, keys: list[str]) -> list[Optional[str]]:
+                return list(r.mget(keys)) if keys else []
+            def mset_ex(self, items: dict[str, str], ttl: int) -> None:
+                if not items:
+                    return
+                pipe = r.pipeline(transaction=False)
+                for k, v in items.items():
+                    pipe.setex(k, ttl, v)
+                pipe.execute()
+            def delete_many(self, keys: list[str]) -> None:
+                if keys:
+                    r.delete(*keys)
+            def pipeline(self) -> Pipeline:
+                return _RedisPipeline(self, r)
         return RedisStorage()
     return MemoryStorage()
\ No newline at end of file
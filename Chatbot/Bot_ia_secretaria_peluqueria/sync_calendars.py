@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+sync_calendars.py — Mantiene al día el espejo local de Google Calendar (calendar_mirror)
+y los canales push (calendar_watch) de cada peluquería.
+
+Uso recomendado (cron cada minuto, con STORAGE_BACKEND=redis para compartir el espejo con la app):
+    * * * * * /opt/bot-pelu/.venv/bin/python /opt/bot-pelu/sync_calendars.py >> /var/log/gcal_sync.log 2>&1
+
+Cada ejecución hace una sync incremental (syncToken) por calendario; si el token ha
+caducado (410) o la ventana del espejo se queda corta se rehace la sync completa.
+La app NO sincroniza al leer: si el espejo tiene más de CAL_MIRROR_MAX_STALENESS_SECONDS
+consulta Calendar en vivo, así que este cron es lo que mantiene el espejo en uso.
+
+Si GCAL_WEBHOOK_URL está configurada (y STORAGE_BACKEND=redis, para que la app vea los canales),
+registra el canal events.watch de cada calendario y lo renueva antes de que caduque parando
+el anterior (los avisos llegan a /webhook/gcal).
+"""
+
+import logging
+
+from db import SessionLocal
+from models import Peluqueria
+from calendar_mirror import mirror
+from calendar_watch import watcher
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s %(levelname)s %(message)s")
+log = logging.getLogger("gcal_sync")
+
+
+def main():
+    with SessionLocal() as db:
+        pelus = db.query(Peluqueria).filter(Peluqueria.cal_id.isnot(None)).all()
+        db.expunge_all()
+    pelus = [p for p in pelus if p.cal_id]
+
+    ok = failed = watched = 0
+    # el espejo se trocea por día local: zona de la (primera) peluquería de cada calendario
+    tz_por_cal = {}
+    for p in pelus:
+        tz_por_cal.setdefault(p.cal_id, p.tz or None)
+    for cal_id in sorted(tz_por_cal):
+        if mirror.sync(cal_id, tz_por_cal[cal_id]):
+            ok += 1
+        else:
+            failed += 1
+    for pelu in pelus:
+        if watcher.ensure_watch(pelu):
+            watched += 1
+    log.info("Resumen: sincronizados=%d, fallidos=%d, canales push=%d", ok, failed, watched)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,241 @@
+# tenant_registry.py — caché en proceso de la configuración de cada peluquería
+# - Snapshots de SOLO LECTURA (Peluqueria + servicios + peluqueros activos)
+# - Índices por id, api_key y wa_phone_number_id
+# - TTL, tamaño máximo (LRU) e invalidación explícita
+# - Staleness acotada a propósito: la configuración se edita fuera de este servicio (panel / SQL), así que
+#   ningún camino de este proceso puede invalidar; un cambio se ve como mucho TENANT_CACHE_TTL_SECONDS después
+#   (y con él las cachés que cuelgan del fingerprint: ia_cache, faq_cache)
+from __future__ import annotations
+
+import hashlib
+import json
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Optional
+
+import sentry_sdk
+from sqlalchemy import inspect as sa_inspect
+from sqlalchemy.orm import selectinload
+
+from settings import settings
+
+LOOKUP_FIELDS = ("id", "api_key", "wa_phone_number_id")
+
+
+class Snapshot:
+    """Objeto inmutable con los atributos de una fila (acceso por getattr como el ORM)."""
+
+    def __init__(self, **attrs):
+        object.__setattr__(self, "_attrs", dict(attrs))
+
+    def __getattr__(self, name):
+        try:
+            return self._attrs[name]
+        except KeyError:
+            raise AttributeError(name) from None
+
+    def __setattr__(self, name, value):
+        raise AttributeError(f"{type(self).__name__} es de solo lectura")
+
+    def __repr__(self):
+        return f"<{type(self).__name__} id={self._attrs.get('id')!r}>"
+
+
+class TenantSnapshot(Snapshot):
+    """Peluquería + servicios (tupla) + peluqueros_activos (tupla) + fingerprint del catálogo."""
+
+
+def _columns(obj) -> dict:
+    data = {}
+    for attr in sa_inspect(type(obj)).column_attrs:
+        value = getattr(obj, attr.key, None)
+        if isinstance(value, dict):
+            value = dict(value)  # MutableDict -> dict plano, desacoplado de la sesión
+        data[attr.key] = value
+    return data
+
+
+def _fingerprint(pelu_cols: dict, servicios: list[dict], peluqueros: list[dict]) -> str:
+    """Hash estable de la configuración; cambia si cambia la peluquería o su catálogo."""
+    raw = json.dumps(
+        {"pelu": pelu_cols, "servicios": servicios, "peluqueros": peluqueros},
+        sort_keys=True, default=str, ensure_ascii=False,
+    )
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()[:16]
+
+
+def build_snapshot(pelu, peluqueros_activos) -> TenantSnapshot:
+    """Copia una Peluqueria ORM (con servicios cargados) a un snapshot desacoplado de la BD."""
+    pelu_cols = _columns(pelu)
+    srv_cols = [_columns(s) for s in (pelu.servicios or [])]
+    pel_cols = [_columns(p) for p in (peluqueros_activos or [])]
+    # Los secretos no entran en el fingerprint (se usa como clave de caché en otros módulos)
+    fp_cols = {k: v for k, v in pelu_cols.items() if k not in ("api_key", "wa_token")}
+    return TenantSnapshot(
+        **pelu_cols,
+        servicios=tuple(Snapshot(**c) for c in srv_cols),
+        peluqueros_activos=tuple(Snapshot(**c) for c in pel_cols),
+        fingerprint=_fingerprint(fp_cols, srv_cols, pel_cols),
+    )
+
+
+def load_tenant_from_db(field: str, value) -> Optional[TenantSnapshot]:
+    """Loader por defecto: una sesión, una query con servicios + peluqueros activos."""
+    from db import SessionLocal
+    from models import Peluqueria
+    from peluqueros_utils import get_active_peluqueros
+
+    db = SessionLocal()
+    try:
+        pelu = (
+            db.query(Peluqueria)
+            .options(selectinload(Peluqueria.servicios))
+            .filter_by(**{field: value})
+            .first()
+        )
+        if not pelu:
+            return None
+        return build_snapshot(pelu, get_active_peluqueros(db, pelu.id))
+    finally:
+        db.close()
+
+
+class TenantRegistry:
+    """
+    Caché LRU+TTL de snapshots de peluquería, thread-safe.
+    Un mensaje de WhatsApp resuelve el tenant varias veces (rate scope, webhook, envíos...):
+    con el registro solo la primera vez (por TTL) va a BD.
+    """
+
+    def __init__(
+        self,
+        loader: Callable[[str, object], Optional[TenantSnapshot]] = load_tenant_from_db,
+        ttl: int = 60,
+        max_entries: int = 256,
+        negative_ttl: int = 10,
+    ):
+        self._loader = loader
+        self._ttl = int(ttl)
+        self._negative_ttl = int(negative_ttl)
+        self._max_entries = max(1, int(max_entries))
+        self._lock = threading.Lock()
+        # id -> (snapshot, expires_at)
+        self._by_id: "OrderedDict[int, tuple[TenantSnapshot, float]]" = OrderedDict()
+        # (field, value) -> id   |   (field, value) -> expires_at de un "no existe"
+        self._index: dict[tuple[str, object], int] = {}
+        self._misses: dict[tuple[str, object], float] = {}
+
+    # ---------- lecturas ----------
+    def get_by_id(self, peluqueria_id) -> Optional[TenantSnapshot]:
+        return self._get("id", peluqueria_id)
+
+    def get_by_api_key(self, api_key: str) -> Optional[TenantSnapshot]:
+        return self._get("api_key", api_key)
+
+    def get_by_wa_phone_number_id(self, phone_number_id: str) -> Optional[TenantSnapshot]:
+        return self._get("wa_phone_number_id", phone_number_id)
+
+    def _get(self, field: str, value) -> Optional[TenantSnapshot]:
+        if value is None or value == "":
+            return None
+        key = (field, value)
+        now = time.monotonic()
+        with self._lock:
+            snap = self._lookup_locked(key, now)
+            if snap is not None:
+                return snap
+            miss_exp = self._misses.get(key)
+            if miss_exp is not None:
+                if miss_exp > now:
+                    return None
+                self._misses.pop(key, None)
+
+        snap = self._loader(field, value)
+
+        with self._lock:
+            if snap is None:
+                if self._negative_ttl > 0:
+                    self._misses[key] = now + self._negative_ttl
+                    if len(self._misses) > self._max_entries:
+                        self._misses.pop(next(iter(self._misses)))
+                return None
+            self._store_locked(snap, now)
+        return snap
+
+    def _lookup_locked(self, key, now: float) -> Optional[TenantSnapshot]:
+        pelu_id = key[1] if key[0] == "id" else self._index.get(key)
+        if pelu_id is None:
+            return None
+        row = self._by_id.get(pelu_id)
+        if row is None:
+            self._index.pop(key, None)
+            return None
+        snap, expires_at = row
+        if expires_at <= now:
+            self._drop_locked(pelu_id)
+            return None
+        self._by_id.move_to_end(pelu_id)
+        return snap
+
+    def _store_locked(self, snap: TenantSnapshot, now: float) -> None:
+        self._drop_locked(snap.id)
+        self._by_id[snap.id] = (snap, now + self._ttl)
+        for field in LOOKUP_FIELDS[1:]:
+            value = getattr(snap, field, None)
+            if value:
+                self._index[(field, value)] = snap.id
+                self._misses.pop((field, value), None)
+        while len(self._by_id) > self._max_entries:
+            oldest_id = next(iter(self._by_id))
+            self._drop_locked(oldest_id)
+
+    def _drop_locked(self, pelu_id) -> None:
+        row = self._by_id.pop(pelu_id, None)
+        if row is None:
+            return
+        snap = row[0]
+        for field in LOOKUP_FIELDS[1:]:
+            value = getattr(snap, field, None)
+            if value and self._index.get((field, value)) == pelu_id:
+                self._index.pop((field, value), None)
+
+    # ---------- invalidación ----------
+    def invalidate(self, peluqueria_id=None) -> None:
+        """
+        Invalida una peluquería (o todo el registro si peluqueria_id es None).
+        Para código que modifique Peluqueria/Servicio/Peluquero en ESTE proceso; los cambios hechos
+        desde fuera solo se ven al caducar el TTL.
+        """
+        with self._lock:
+            if peluqueria_id is None:
+                self._by_id.clear()
+                self._index.clear()
+                self._misses.clear()
+                return
+            self._drop_locked(peluqueria_id)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._by_id)
+
+
+def active_peluqueros(pelu) -> list:
+    """Peluqueros activos del snapshot; si 'pelu' es un objeto ORM/stub, consulta BD como antes."""
+    cached = getattr(pelu, "peluqueros_activos", None)
+    if cached is not None:
+        return list(cached)
+    from db import SessionLocal
+    from peluqueros_utils import get_active_peluqueros
+    try:
+        with SessionLocal() as db:
+            return get_active_peluqueros(db, pelu.id) or []
+    except Exception as e:
+        sentry_sdk.capture_exception(e)
+        return []
+
+
+tenants = TenantRegistry(
+    ttl=settings.TENANT_CACHE_TTL_SECONDS,
+    max_entries=settings.TENANT_CACHE_MAX_ENTRIES,
+)
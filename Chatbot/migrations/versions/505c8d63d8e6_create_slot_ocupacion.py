@@ -0,0 +1,51 @@
+"""Create slot_ocupacion and slot_ocupacion_peluquero (capacity inventory per time slot)."""
+
+from alembic import op
+import sqlalchemy as sa
+
+# --- IDs de Alembic ---
+revision = "505c8d63d8e6"
+down_revision = "994f4cad19a1"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Crea las tablas de inventario (vacías: rellenar con backfill_slots.py)."""
+    bind = op.get_bind()
+    existing = set(sa.inspect(bind).get_table_names())
+
+    if "slot_ocupacion" not in existing:
+        op.create_table(
+            "slot_ocupacion",
+            sa.Column("peluqueria_id", sa.Integer(),
+                      sa.ForeignKey("peluquerias.id", ondelete="CASCADE"), nullable=False),
+            sa.Column("fecha", sa.Date(), nullable=False),
+            sa.Column("minuto", sa.Integer(), nullable=False),
+            sa.Column("usados", sa.Integer(), nullable=False, server_default=sa.text("0")),
+            sa.PrimaryKeyConstraint("peluqueria_id", "fecha", "minuto"),
+        )
+
+    if "slot_ocupacion_peluquero" not in existing:
+        # 'peluqueros' no la crea ninguna revisión anterior (puede venir de init_db): FK solo si existe
+        fk = [sa.ForeignKey("peluqueros.id", ondelete="CASCADE")] if "peluqueros" in existing else []
+        op.create_table(
+            "slot_ocupacion_peluquero",
+            sa.Column("peluquero_id", sa.Integer(), *fk, nullable=False),
+            sa.Column("fecha", sa.Date(), nullable=False),
+            sa.Column("minuto", sa.Integer(), nullable=False),
+            sa.Column("usados", sa.Integer(), nullable=False, server_default=sa.text("0")),
+            sa.PrimaryKeyConstraint("peluquero_id", "fecha", "minuto"),
+        )
+
+
+def downgrade() -> None:
+    """Elimina las tablas de inventario si existen."""
+    bind = op.get_bind()
+    existing = set(sa.inspect(bind).get_table_names())
+
+    if "slot_ocupacion_peluquero" in existing:
+        op.drop_table("slot_ocupacion_peluquero")
+
+    if "slot_ocupacion" in existing:
+        op.drop_table("slot_ocupacion")
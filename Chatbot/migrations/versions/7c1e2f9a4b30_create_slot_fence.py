@@ -0,0 +1,33 @@
+"""Create slot_fence (last Redis fencing token written per slot key)."""
+
+from alembic import op
+import sqlalchemy as sa
+
+# --- IDs de Alembic ---
+revision = "7c1e2f9a4b30"
+down_revision = "505c8d63d8e6"
+branch_labels = None
+depends_on = None
+
+
+def upgrade() -> None:
+    """Crea slot_fence (vacía: las filas se crean al reservar con SLOT_LOCK_BACKEND=redis)."""
+    bind = op.get_bind()
+    existing = set(sa.inspect(bind).get_table_names())
+
+    if "slot_fence" not in existing:
+        op.create_table(
+            "slot_fence",
+            sa.Column("clave", sa.String(64), nullable=False),
+            sa.Column("fence", sa.BigInteger(), nullable=False, server_default=sa.text("0")),
+            sa.PrimaryKeyConstraint("clave"),
+        )
+
+
+def downgrade() -> None:
+    """Elimina slot_fence si existe."""
+    bind = op.get_bind()
+    existing = set(sa.inspect(bind).get_table_names())
+
+    if "slot_fence" in existing:
+        op.drop_table("slot_fence")
@@ -43,6 +43,13 @@ def post_recorder(monkeypatch):
     monkeypatch.setattr(requests, "post", rec, raising=True)
     return rec
 
+@pytest.fixture(autouse=True)
+def graph_via_requests_post(monkeypatch):
+    # el cliente Graph usa una Session con pool; la enrutamos por requests.post
+    # para que los fakes de requests.post de los tests sigan capturando los envíos
+    import requests
+    monkeypatch.setattr(appmod.graph.session, "post", lambda *a, **k: requests.post(*a, **k), raising=False)
+
 @pytest.fixture(autouse=True)
 def fake_wa_creds(monkeypatch):
     # evita BD real para token y versión
@@ -19,6 +19,51 @@ class FakeStorage:
     def setex(self, key: str, value: str, ttl: int):
         self._data[key] = value
 
+    def delete(self, key: str):
+        self._data.pop(key, None)
+
+    def expire(self, key: str, ttl: int):
+        pass
+
+    def set_if_absent(self, key: str, value: str, ttl: int) -> bool:
+        if key in self._data:
+            return False
+        self._data[key] = value
+        return True
+
+    def admit_message(self, ts_key, seen_key, ts, ttl, peek_key=None):
+        peek = self._data.get(peek_key) if peek_key else None
+        if seen_key and seen_key in self._data:
+            return "duplicate", peek
+        if int(ts) < int(float(self._data.get(ts_key) or 0)):
+            return "stale", peek
+        self._data[ts_key] = str(ts)
+        if seen_key:
+            self._data[seen_key] = "1"
+        return "admit", peek
+
+    def set_versioned(self, key, body, ttl, expected=None):
+        from storage import doc_version, with_version
+        v = doc_version(self._data.get(key))
+        if expected is not None and int(expected) != v:
+            return None
+        self._data[key] = with_version(body, v + 1)
+        return v + 1
+
+    def mget(self, keys):
+        return [self._data.get(k) for k in keys]
+
+    def mset_ex(self, items, ttl: int):
+        self._data.update(items)
+
+    def delete_many(self, keys):
+        for k in keys:
+            self._data.pop(k, None)
+
+    def pipeline(self):
+        from storage import Pipeline
+        return Pipeline(self)
+
 class FakeResp:
     def __init__(self, ok=True, status_code=200, text="{}", json_data=None):
         self.ok = ok
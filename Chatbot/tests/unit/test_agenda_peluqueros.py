@@ -0,0 +1,98 @@
+# tests/unit/test_agenda_peluqueros.py
+from datetime import date, time
+from importlib import import_module
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture
+def db():
+    models = import_module("models")
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    s = sessionmaker(bind=engine)()
+    s.add(models.Peluqueria(id=1, nombre="P", api_key="K", num_peluqueros=2, rango_reservas=30))
+    s.add_all([models.Servicio(id=1, peluqueria_id=1, nombre="Corte", duracion_min=30),
+               models.Servicio(id=2, peluqueria_id=1, nombre="Tinte", duracion_min=90)])
+    s.add_all([models.Peluquero(id=10, peluqueria_id=1, nombre="Ana", orden=1),
+               models.Peluquero(id=20, peluqueria_id=1, nombre="Luis", orden=2)])
+    d = date(2025, 9, 20)
+    s.add_all([
+        models.Reserva(peluqueria_id=1, servicio_id=2, nombre_cliente="a", telefono="1", fecha=d, hora=time(10, 0), peluquero_id=10),
+        models.Reserva(peluqueria_id=1, servicio_id=1, nombre_cliente="b", telefono="2", fecha=d, hora=time(9, 0), peluquero_id=20),
+        models.Reserva(peluqueria_id=1, servicio_id=1, nombre_cliente="c", telefono="3", fecha=d, hora=time(12, 0), peluquero_id=20,
+                       estado="cancelada"),
+    ])
+    s.commit()
+    queries = []
+    event.listen(engine, "before_cursor_execute", lambda *a: queries.append(a[2]))
+    yield s, queries
+    s.close()
+
+
+PELU = SimpleNamespace(id=1, num_peluqueros=2, rango_reservas=30, horario="09:00-13:00",
+                       min_avance_min=60, max_avance_dias=150, tz="Europe/Madrid")
+
+
+def test_agenda_una_query_y_solapes_por_peluquero(db):
+    s, queries = db
+    pu = import_module("peluqueros_utils")
+    agenda = pu.AgendaPeluqueros.cargar(s, 1, date(2025, 9, 20))
+    assert len(queries) == 1
+    assert agenda.solapa(10, time(11, 0), 30)          # tinte 10:00-11:30
+    assert not agenda.solapa(10, time(11, 30), 30)
+    assert not agenda.solapa(20, time(12, 0), 30)      # cancelada no cuenta
+    assert agenda.solapa(None, time(9, 15), 30)        # global
+    assert agenda.libres_en([10, 20], "09:00", 30) == [10]
+    assert len(queries) == 1
+
+
+def test_horas_para_peluquero_sin_query_por_slot(db):
+    s, queries = db
+    ru = import_module("reserva_utils")
+    horas = ru.horas_disponibles_para_peluquero(s, PELU, SimpleNamespace(duracion_min=30), 10, "2025-09-20", busy_ranges=[])
+    assert horas == ["09:00", "09:30", "11:30", "12:00", "12:30"]
+    assert len(queries) == 1
+
+
+def test_peluqueros_libres_por_hora(db):
+    s, queries = db
+    ru = import_module("reserva_utils")
+    libres = ru.peluqueros_libres_por_hora(s, PELU, SimpleNamespace(duracion_min=30), "2025-09-20", busy_ranges=[("12:30", "13:00")])
+    assert libres["09:00"] == [10]
+    assert libres["10:00"] == [20]
+    assert libres["11:30"] == [10, 20]
+    assert "12:30" not in libres                        # bloqueado por Calendar
+    assert len(queries) == 2                            # peluqueros activos + reservas del día
+
+
+def test_pick_any_available_una_query_de_reservas(db):
+    s, queries = db
+    pu = import_module("peluqueros_utils")
+    assert pu.pick_any_available(s, 1, date(2025, 9, 20), time(10, 0), 30).id == 20
+    assert pu.pick_any_available(s, 1, date(2025, 9, 20), time(9, 0), 30).id == 10
+    assert len(queries) == 4
+
+
+def test_autoasigna_peluquero_con_una_carga_del_dia(appm, monkeypatch):
+    activos = (SimpleNamespace(id=10, nombre="Ana"), SimpleNamespace(id=20, nombre="Luis"))
+    pelu = SimpleNamespace(id=1, enable_peluquero_selection=True, peluqueros_activos=activos, servicios=())
+    llamadas = []
+
+    def fake_libres(db, p, srv, fecha, peluquero_ids=None, busy_ranges=None):
+        llamadas.append((fecha, peluquero_ids))
+        return {"10:00": [20], "11:00": [10, 20]}
+    monkeypatch.setattr(appm, "peluqueros_libres_por_hora", fake_libres)
+
+    datos = {"fecha": "2025-09-20", "hora": "10:00"}
+    assert appm.autoasigna_peluquero(pelu, datos) == (20, "Luis")
+    assert llamadas == [("2025-09-20", [10, 20])]
+    assert "peluquero_id" not in datos                     # no se fija en el estado
+    assert appm.autoasigna_peluquero(pelu, dict(datos, hora="12:00")) == (None, None)
+    assert appm.autoasigna_peluquero(pelu, dict(datos, peluquero_id=10)) == (None, None)
+    sin_sel = SimpleNamespace(id=1, enable_peluquero_selection=False, peluqueros_activos=activos, servicios=())
+    assert appm.autoasigna_peluquero(sin_sel, datos) == (None, None)
+    assert len(llamadas) == 2
@@ -0,0 +1,96 @@
+# tests/unit/test_availability_window.py
+from datetime import date
+from importlib import import_module
+from types import SimpleNamespace
+
+
+class _FakeEvents:
+    def __init__(self, pages):
+        self.pages = pages
+        self.calls = []
+
+    def list(self, **kw):
+        self.calls.append(kw)
+        page = self.pages[len(self.calls) - 1]
+        return SimpleNamespace(execute=lambda: page)
+
+
+class _FakeService:
+    def __init__(self, pages):
+        self._events = _FakeEvents(pages)
+
+    def events(self):
+        return self._events
+
+
+def _ev(s, e, **kw):
+    return {"start": {"dateTime": s}, "end": {"dateTime": e}, **kw}
+
+
+def test_ventana_paginada_y_repartida_por_dia_local(monkeypatch):
+    gcal = import_module("google_calendar_utils")
+    pages = [
+        {
+            "items": [
+                _ev("2025-09-19T10:00:00+02:00", "2025-09-19T10:30:00+02:00"),
+                _ev("2025-09-19T08:00:00Z", "2025-09-19T09:00:00Z"),  # 10:00-11:00 en Madrid
+                _ev("2025-09-19T11:00:00+02:00", "2025-09-19T12:00:00+02:00", status="cancelled"),
+            ],
+            "nextPageToken": "p2",
+        },
+        {
+            "items": [
+                _ev("2025-09-20T23:00:00+02:00", "2025-09-21T01:00:00+02:00"),
+                {"start": {"date": "2025-09-21"}, "end": {"date": "2025-09-22"}},
+            ],
+        },
+    ]
+    svc = _FakeService(pages)
+    monkeypatch.setattr(gcal.settings, "CAL_MIRROR_ENABLED", False)
+    monkeypatch.setattr(gcal, "get_calendar_service", lambda *a, **k: svc)
+    pelu = SimpleNamespace(cal_id="cal", tz="Europe/Madrid")
+
+    por_dia = gcal.list_event_ranges_for_days(pelu, date(2025, 9, 19), 3)
+
+    assert len(svc._events.calls) == 2
+    assert svc._events.calls[1]["pageToken"] == "p2"
+    assert svc._events.calls[0]["timeMin"] == "2025-09-19T00:00:00+02:00"
+    assert svc._events.calls[0]["timeMax"] == "2025-09-22T00:00:00+02:00"
+    assert por_dia == {
+        date(2025, 9, 19): [("10:00", "10:30"), ("10:00", "11:00")],
+        date(2025, 9, 20): [("23:00", "23:59")],
+        date(2025, 9, 21): [("00:00", "01:00"), ("00:00", "23:59")],
+    }
+
+
+def test_ventana_error_de_calendar_devuelve_none(monkeypatch):
+    gcal = import_module("google_calendar_utils")
+    monkeypatch.setattr(gcal.settings, "CAL_MIRROR_ENABLED", False)
+    monkeypatch.setattr(gcal, "_retry", lambda *a, **k: None)
+    monkeypatch.setattr(gcal, "get_calendar_service", lambda *a, **k: _FakeService([]))
+    pelu = SimpleNamespace(cal_id="cal", tz="Europe/Madrid")
+    assert gcal.list_event_ranges_for_days(pelu, date(2025, 9, 19), 3) is None
+
+
+def test_proximas_fechas_una_consulta_por_ventana(appm, monkeypatch):
+    calls = []
+
+    def fake_window(pelu, desde, dias):
+        calls.append((desde, dias))
+        # solo el primer día de la ventana tiene un evento que lo ocupa entero
+        return {desde: [("00:00", "23:59")]}
+
+    def fake_horas(db, pelu, servicio, fecha_str, busy_ranges=None):
+        assert busy_ranges is not None
+        return [] if busy_ranges else ["10:00"]
+
+    monkeypatch.setattr(appm, "list_event_ranges_for_days", fake_window, raising=True)
+    monkeypatch.setattr(appm, "horas_disponibles", fake_horas, raising=True)
+    monkeypatch.setattr(appm, "filtra_horas_desde_ahora", lambda pelu, horas, f: horas, raising=True)
+
+    pelu = SimpleNamespace(id=1, max_avance_dias=150, horario=None, tz="Europe/Madrid")
+    out = appm._proximas_fechas_con_hueco(pelu, SimpleNamespace(id=3), date(2025, 9, 18), max_items=3)
+
+    # el día 19 (primer día de la ventana) está lleno; 20, 21 y 22 libres
+    assert out == ["20/09/2025", "21/09/2025", "22/09/2025"]
+    assert calls == [(date(2025, 9, 19), appm.VENTANA_DISPONIBILIDAD_DIAS)]
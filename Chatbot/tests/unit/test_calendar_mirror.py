@@ -0,0 +1,193 @@
+# tests/unit/test_calendar_mirror.py
+from datetime import date
+from importlib import import_module
+from types import SimpleNamespace
+
+import httplib2
+import pytest
+from googleapiclient.errors import HttpError
+
+
+class _Events:
+    def __init__(self, responses):
+        self.responses = list(responses)
+        self.calls = []
+
+    def list(self, **kw):
+        self.calls.append(kw)
+        resp = self.responses.pop(0)
+
+        def execute():
+            if isinstance(resp, Exception):
+                raise resp
+            return resp
+        return SimpleNamespace(execute=execute)
+
+
+def _ev(eid, s, e, **kw):
+    return {"id": eid, "start": {"dateTime": s}, "end": {"dateTime": e}, "summary": "Corte - Ana", **kw}
+
+
+@pytest.fixture
+def make_mirror():
+    mod = import_module("calendar_mirror")
+    storage = import_module("storage").MemoryStorage()
+    now = {"t": 1_758_182_400.0}   # 2025-09-18 10:00 Europe/Madrid
+
+    def _make(responses, max_staleness=60):
+        events = _Events(responses)
+        m = mod.CalendarMirror(
+            storage=storage,
+            service_factory=lambda: SimpleNamespace(events=lambda: events),
+            max_staleness=max_staleness,
+            clock=lambda: now["t"],
+        )
+        return m, events
+    return mod, _make, now
+
+
+PELU = SimpleNamespace(cal_id="cal", tz="Europe/Madrid")
+TZ = "Europe/Madrid"
+
+
+def test_sync_completo_y_luego_incremental(make_mirror):
+    mod, make, now = make_mirror
+    m, events = make([
+        {"items": [_ev("a", "2025-09-19T10:00:00+02:00", "2025-09-19T10:30:00+02:00")], "nextPageToken": "p2"},
+        {"items": [_ev("b", "2025-09-19T12:00:00+02:00", "2025-09-19T13:00:00+02:00")], "nextSyncToken": "s1"},
+        {"items": [{"id": "a", "status": "cancelled"},
+                   _ev("c", "2025-09-20T09:00:00+02:00", "2025-09-20T09:30:00+02:00")], "nextSyncToken": "s2"},
+    ])
+    assert m.sync("cal", TZ)
+    first = events.calls[0]
+    assert "syncToken" not in first and events.calls[1]["pageToken"] == "p2"
+    # sync completa acotada a la ventana (ayer .. hoy + horizonte), no todo el histórico
+    assert first["timeMin"] == "2025-09-17T00:00:00+02:00"
+    assert first["timeMax"].startswith("2026-")
+    meta = m.load("cal")
+    assert meta["sync_token"] == "s1" and meta["tz"] == TZ and meta["desde"] == "2025-09-17"
+
+    assert m.sync("cal", TZ)
+    assert events.calls[2]["syncToken"] == "s1" and "timeMin" not in events.calls[2]
+    assert m.load("cal")["sync_token"] == "s2"
+    dia = m._load_days("cal", [date(2025, 9, 19), date(2025, 9, 20)])
+    assert set(dia[date(2025, 9, 19)]) == {"b"} and set(dia[date(2025, 9, 20)]) == {"c"}
+    assert "summary" not in dia[date(2025, 9, 19)]["b"]  # sin PII en el espejo
+
+
+def test_token_caducado_410_resync_completo(make_mirror):
+    mod, make, now = make_mirror
+    gone = HttpError(httplib2.Response({"status": 410}), b"gone")
+    m, events = make([
+        {"items": [_ev("a", "2025-09-19T10:00:00+02:00", "2025-09-19T10:30:00+02:00")], "nextSyncToken": "s1"},
+        gone,
+        {"items": [_ev("b", "2025-09-19T12:00:00+02:00", "2025-09-19T13:00:00+02:00")], "nextSyncToken": "s9"},
+    ])
+    assert m.sync("cal", TZ)
+    assert m.sync("cal", TZ)
+    assert "syncToken" not in events.calls[2]
+    assert m.load("cal")["sync_token"] == "s9"
+    assert set(m._load_days("cal", [date(2025, 9, 19)])[date(2025, 9, 19)]) == {"b"}
+
+
+def test_lectura_desde_espejo_sin_red(make_mirror):
+    mod, make, now = make_mirror
+    m, events = make([
+        {"items": [_ev("a", "2025-09-19T10:00:00+02:00", "2025-09-19T10:30:00+02:00"),
+                   _ev("n", "2025-09-19T23:00:00+02:00", "2025-09-20T01:00:00+02:00")], "nextSyncToken": "s1"},
+    ], max_staleness=60)
+
+    d = date(2025, 9, 19)
+    assert m.ranges_for_days(PELU, d, 1) is None       # sin espejo: en vivo, sin sincronizar al leer
+    assert events.calls == []
+    m.sync("cal", TZ)
+    assert m.ranges_for_days(PELU, d, 2) == {
+        d: [("10:00", "10:30"), ("23:00", "23:59")], date(2025, 9, 20): [("00:00", "01:00")],
+    }
+    now["t"] += 61
+    assert m.ranges_for_days(PELU, d, 1) is None       # viejo: en vivo, tampoco sincroniza
+    assert len(events.calls) == 1
+
+
+def test_lectura_fuera_de_ventana_o_de_otra_zona(make_mirror):
+    mod, make, now = make_mirror
+    m, _ = make([{"items": [], "nextSyncToken": "s1"}])
+    m.sync("cal", TZ)
+    hasta = date.fromisoformat(m.load("cal")["hasta"])
+    assert m.ranges_for_days(PELU, hasta, 1) == {hasta: []}
+    assert m.ranges_for_days(PELU, hasta, 2) is None
+    assert m.ranges_for_days(PELU, date(2025, 9, 16), 1) is None
+    assert m.ranges_for_days(SimpleNamespace(cal_id="cal", tz="America/Montevideo"), date(2025, 9, 19), 1) is None
+
+
+def test_escrituras_propias_actualizan_el_espejo(make_mirror):
+    mod, make, now = make_mirror
+    m, _ = make([{"items": [], "nextSyncToken": "s1"}])
+    m.sync("cal", TZ)
+    m.apply_event("cal", _ev("x", "2025-09-19T17:00:00+02:00", "2025-09-19T17:30:00+02:00"))
+    d = date(2025, 9, 19)
+    assert m.ranges_for_days(PELU, d, 1) == {d: [("17:00", "17:30")]}
+    m.apply_event("cal", _ev("x", "2025-09-20T17:00:00+02:00", "2025-09-20T17:30:00+02:00"))   # movido
+    assert m.ranges_for_days(PELU, d, 2) == {d: [], date(2025, 9, 20): [("17:00", "17:30")]}
+    m.remove_event("cal", "x")
+    assert m.ranges_for_days(PELU, d, 2) == {d: [], date(2025, 9, 20): []}
+
+
+def test_sync_falla_devuelve_none(make_mirror):
+    mod, make, now = make_mirror
+    m, _ = make([RuntimeError("sin red")])
+    assert not m.sync("cal", TZ)
+    assert m.ranges_for_days(PELU, date(2025, 9, 19), 1) is None
+
+
+def test_sync_con_lock_de_otro_proceso_no_pisa(make_mirror, monkeypatch):
+    mod, make, now = make_mirror
+    monkeypatch.setattr(mod, "SYNC_LOCK_WAIT", 0.0)
+    m, events = make([{"items": [], "nextSyncToken": "s1"}])
+    m._storage.set_if_absent(mod._lock_key("cal"), "otro", ttl=60)
+    assert m.sync_changes("cal", TZ) is None
+    assert events.calls == []
+    m._storage.delete(mod._lock_key("cal"))
+    assert m.sync("cal", TZ)
+
+
+def test_sync_changes_devuelve_solo_dias_afectados(make_mirror):
+    mod, make, now = make_mirror
+    m, _ = make([
+        {"items": [_ev("a", "2025-09-19T10:00:00+02:00", "2025-09-19T10:30:00+02:00"),
+                   _ev("b", "2025-09-23T10:00:00+02:00", "2025-09-23T10:30:00+02:00")], "nextSyncToken": "s1"},
+        {"items": [_ev("a", "2025-09-20T10:00:00+02:00", "2025-09-20T10:30:00+02:00"),   # movido
+                   _ev("b", "2025-09-23T10:00:00+02:00", "2025-09-23T10:30:00+02:00")],  # sin cambios
+         "nextSyncToken": "s2"},
+    ])
+    assert m.sync_changes("cal", TZ) == {date(2025, 9, 19), date(2025, 9, 23)}   # sync inicial
+    assert m.sync_changes("cal", TZ) == {date(2025, 9, 19), date(2025, 9, 20)}
+
+
+def test_ventana_corta_rehace_sync_completa(make_mirror):
+    mod, make, now = make_mirror
+    m, events = make([{"items": [], "nextSyncToken": "s1"}, {"items": [], "nextSyncToken": "s2"},
+                      {"items": [], "nextSyncToken": "s3"}])
+    m.sync("cal", TZ)
+    m.sync("cal", TZ)
+    assert events.calls[1]["syncToken"] == "s1"
+    now["t"] += mod.RESYNC_MARGIN_DAYS * 86400
+    m.sync("cal", TZ)
+    assert "syncToken" not in events.calls[2] and events.calls[2]["timeMin"].startswith("2025-09-20")
+
+
+def test_sync_changes_recoge_lo_que_sincronizaron_otros(make_mirror):
+    mod, make, now = make_mirror
+    m, _ = make([
+        {"items": [], "nextSyncToken": "s1"},
+        {"items": [], "nextSyncToken": "s2"},
+        {"items": [_ev("a", "2025-09-22T10:00:00+02:00", "2025-09-22T10:30:00+02:00")], "nextSyncToken": "s3"},
+        {"items": [], "nextSyncToken": "s4"},
+        {"items": [], "nextSyncToken": "s5"},
+    ])
+    m.sync("cal", TZ)
+    assert m.sync_changes("cal", TZ) == set()
+    m.sync("cal", TZ)                      # el cron consume el diff antes que el aviso push
+    m.apply_event("cal", _ev("x", "2025-09-24T17:00:00+02:00", "2025-09-24T17:30:00+02:00"))
+    assert m.sync_changes("cal", TZ) == {date(2025, 9, 22), date(2025, 9, 24)}
+    assert m.sync_changes("cal", TZ) == set()   # consumidos una sola vez
@@ -0,0 +1,47 @@
+# tests/unit/test_calendar_service_cache.py
+import threading
+from importlib import import_module
+
+import pytest
+
+
+@pytest.fixture
+def gcal(monkeypatch):
+    mod = import_module("google_calendar_utils")
+    loads, builds = [], []
+    monkeypatch.setattr(
+        mod.service_account.Credentials, "from_service_account_file",
+        lambda path, scopes=None: loads.append(path) or object(),
+    )
+    monkeypatch.setattr(mod, "build_from_document", lambda doc, credentials=None: builds.append(doc) or object())
+    mod.reset_calendar_service()
+    yield mod, loads, builds
+    mod.reset_calendar_service()
+
+
+def test_servicio_reutilizado_en_el_mismo_hilo(gcal):
+    mod, loads, builds = gcal
+    a = mod.get_calendar_service()
+    b = mod.get_calendar_service()
+    assert a is b
+    assert len(loads) == 1 and len(builds) == 1
+    assert builds[0]["name"] == "calendar"  # documento estático de discovery
+
+
+def test_un_servicio_por_hilo_con_credenciales_compartidas(gcal):
+    mod, loads, builds = gcal
+    main = mod.get_calendar_service()
+    out = []
+    t = threading.Thread(target=lambda: out.append(mod.get_calendar_service()))
+    t.start()
+    t.join()
+    assert out[0] is not main
+    assert len(loads) == 1 and len(builds) == 2
+
+
+def test_reset_reconstruye(gcal):
+    mod, loads, _ = gcal
+    a = mod.get_calendar_service()
+    mod.reset_calendar_service()
+    assert mod.get_calendar_service() is not a
+    assert len(loads) == 2
@@ -0,0 +1,55 @@
+# tests/unit/test_core_dispatch.py
+from types import SimpleNamespace
+
+
+def _pelu():
+    return SimpleNamespace(id=1, nombre="Pelu 1", tipo_negocio="peluquería", servicios=(), api_key="K1")
+
+
+def test_procesar_mensaje_sesion_nueva_da_bienvenida(appm):
+    body, status = appm.procesar_mensaje(_pelu(), "wa_PH_1_600", "hola")
+    assert status == 200
+    assert body["ui"] == "main_menu"
+    assert "Pelu 1" in body["respuesta"]
+    assert appm.cargar_estado("wa_PH_1_600")["paso"] == "inicio"
+
+
+def test_procesar_mensaje_session_invalida(appm):
+    body, status = appm.procesar_mensaje(_pelu(), "x", "hola")
+    assert status == 200
+    assert body["ui"] == "main_menu"
+
+
+def test_process_core_and_reply_llama_al_core_sin_loopback(appm, monkeypatch):
+    import requests
+
+    def _no_http(*a, **k):
+        raise AssertionError("no debe haber loopback HTTP")
+    monkeypatch.setattr(requests, "post", _no_http, raising=True)
+    monkeypatch.setattr(appm, "get_peluqueria_by_wa_phone_number_id", lambda _: _pelu(), raising=True)
+
+    seen = {}
+
+    def fake_core(pelu, session_id, mensaje, origin="text", idempotency_key=None):
+        seen.update(session_id=session_id, mensaje=mensaje, origin=origin, idem=idempotency_key)
+        return {"respuesta": "elige hora", "ui": "hours", "choices": ["10:00", "10:30"]}, 200
+    monkeypatch.setattr(appm, "procesar_mensaje", fake_core, raising=True)
+
+    sent = []
+    monkeypatch.setattr(appm, "wa_send_text", lambda *a, **k: sent.append(("text", a[2])), raising=True)
+    monkeypatch.setattr(appm, "wa_send_hours_page", lambda *a, **k: sent.append(("hours", a[3])), raising=True)
+
+    appm._process_core_and_reply("PH_1", "600", "wa_PH_1_600", "mañana", "text", "wamid.1")
+
+    assert seen == {"session_id": "wa_PH_1_600", "mensaje": "mañana", "origin": "text", "idem": "wamid.1"}
+    assert sent == [("text", "elige hora"), ("hours", ["10:00", "10:30"])]
+
+
+def test_process_core_and_reply_error_del_core_no_envia(appm, monkeypatch):
+    monkeypatch.setattr(appm, "get_peluqueria_by_wa_phone_number_id", lambda _: _pelu(), raising=True)
+    monkeypatch.setattr(appm, "procesar_mensaje", lambda *a, **k: ({"respuesta": "boom"}, 500), raising=True)
+    sent = []
+    monkeypatch.setattr(appm, "wa_send_text", lambda *a, **k: sent.append(a), raising=True)
+
+    appm._process_core_and_reply("PH_1", "600", "wa_PH_1_600", "hola", "text", "wamid.2")
+    assert sent == []
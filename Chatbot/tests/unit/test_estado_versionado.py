@@ -0,0 +1,115 @@
+# tests/unit/test_estado_versionado.py
+import types
+from importlib import import_module
+
+import pytest
+
+
+@pytest.fixture
+def st(appm, monkeypatch):
+    st = import_module("storage").MemoryStorage()
+    monkeypatch.setattr(appm, "storage", st)
+    return st
+
+
+def test_cas_detecta_turno_concurrente(appm, st):
+    appm.guardar_estado("s1", {"paso": "inicio", "datos": {}, "tipo_accion": None})
+    mio = appm.cargar_estado("s1")
+    assert mio["_v"] == 1
+
+    # otro worker avanza la conversación entre medias
+    otro = appm._parse_estado(st.get("state:s1"))
+    otro["paso"] = "servicio"
+    assert st.set_versioned("state:s1", appm._estado_body(otro), ttl=60, expected=otro["_v"]) == 2
+
+    mio["paso"] = "fecha"
+    assert appm.guardar_estado("s1", mio) is False
+    assert appm.cargar_estado("s1")["paso"] == "servicio"
+
+
+def test_mismo_turno_varias_escrituras_y_sin_cambios(appm, st, monkeypatch):
+    appm.guardar_estado("s2", {"paso": "inicio", "datos": {}, "tipo_accion": None})
+    estado = appm.cargar_estado("s2")
+    estado["paso"] = "fecha"
+    assert appm.guardar_estado("s2", estado) and estado["_v"] == 2
+    appm.reset_estado("s2")                               # escritura "a ciegas" del mismo turno
+    estado["paso"] = "hora"
+    assert appm.guardar_estado("s2", estado)              # no es conflicto: la versión nueva es nuestra
+
+    writes = []
+    monkeypatch.setattr(st, "set_versioned", lambda *a, **k: writes.append(a) or 99)
+    assert appm.guardar_estado("s2", estado)               # idéntico a lo último escrito
+    assert writes == []
+
+
+def test_actualizar_estado_solo_campos(appm, st):
+    appm.guardar_estado("s3", {"paso": "fecha", "datos": {"servicio_id": 3}, "tipo_accion": "reservar"})
+    appm.actualizar_estado("s3", force_welcome=False)
+    e = appm.cargar_estado("s3")
+    assert e["paso"] == "fecha" and e["datos"] == {"servicio_id": 3} and e["force_welcome"] is False
+    assert st.get("state:s3").startswith('{"_v":2,')
+
+
+def test_redis_cas_via_script(monkeypatch):
+    calls = []
+
+    def register_script(src):
+        return lambda keys, args: calls.append((keys, args)) or -1
+    client = types.SimpleNamespace(register_script=register_script)
+    monkeypatch.setattr(import_module("redis_conn"), "get_client", lambda url=None: client)
+    rs = import_module("storage").get_storage(types.SimpleNamespace(STORAGE_BACKEND="redis", REDIS_URL="redis://x"))
+    assert rs.set_versioned("state:x", '{"paso": "inicio"}', ttl=60, expected=4) is None
+    assert calls == [(["state:x"], ['{"paso": "inicio"}', 60, 4])]
+
+
+def test_sin_cambios_renueva_el_ttl(appm, monkeypatch):
+    now = {"t": 1000.0}
+    st = import_module("storage").MemoryStorage(clock=lambda: now["t"])
+    monkeypatch.setattr(appm, "storage", st)
+    appm.guardar_estado("s4", {"paso": "fecha", "datos": {}, "tipo_accion": "reservar"})
+    estado = appm.cargar_estado("s4")
+    now["t"] += appm.ESTADO_TTL - 10
+    assert appm.guardar_estado("s4", estado)               # sin cambios: no escribe, pero renueva
+    now["t"] += 60
+    assert appm.cargar_estado("s4")["paso"] == "fecha"
+
+
+def test_conflicto_en_el_turno_se_responde_como_error(appm, st, monkeypatch):
+    def turno(pelu, session_id, *a):
+        estado = appm.cargar_estado(session_id)
+        st.set_versioned(f"state:{session_id}", '{"paso": "servicio"}', ttl=60, expected=estado["_v"])
+        estado["paso"] = "fecha"
+        appm.guardar_estado(session_id, estado)
+        return {"respuesta": "¿Qué día te viene bien?"}, 200
+
+    appm.guardar_estado("s5", {"paso": "inicio", "datos": {}, "tipo_accion": None})
+    monkeypatch.setattr(appm, "_procesar_turno", turno)
+    body, status = appm.procesar_mensaje(None, "s5", "corte")
+    assert status == 200 and "repites" in body["respuesta"]
+    assert appm.cargar_estado("s5")["paso"] == "servicio"
+
+    # actualizar_estado reintenta el CAS: si acaba guardando, no cuenta como conflicto
+    real, fallos = st.set_versioned, [None]
+    monkeypatch.setattr(st, "set_versioned", lambda *a, **k: fallos.pop() if fallos else real(*a, **k))
+    monkeypatch.setattr(appm, "_procesar_turno", lambda *a: (appm.actualizar_estado("s5", force_welcome=False), 200))
+    body, _ = appm.procesar_mensaje(None, "s5", "hola")
+    assert body["force_welcome"] is False
+
+
+def test_conflicto_tras_confirmar_en_bd_no_tapa_la_respuesta(appm, st, monkeypatch):
+    def turno(pelu, session_id, *a):
+        estado = appm.cargar_estado(session_id)
+        st.set_versioned(f"state:{session_id}", '{"paso": "servicio"}', ttl=60, expected=estado["_v"])
+        appm._efecto_confirmado()                 # la reserva ya está en BD
+        estado["paso"] = "nombre"
+        appm.guardar_estado(session_id, estado)   # conflicto en una escritura posterior
+        estado["paso"] = "post_confirm"
+        appm._guardar_estado_tras_commit(session_id, estado)
+        return {"respuesta": "✅ ¡Reserva confirmada!"}, 200
+
+    appm.guardar_estado("s6", {"paso": "confirmar", "datos": {}, "tipo_accion": "reservar"})
+    monkeypatch.setattr(appm, "_procesar_turno", turno)
+    body, status = appm.procesar_mensaje(None, "s6", "si")
+    assert status == 200 and body["respuesta"] == "✅ ¡Reserva confirmada!"
+    assert appm.cargar_estado("s6")["paso"] == "post_confirm"
+
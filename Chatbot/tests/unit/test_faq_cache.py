@@ -0,0 +1,56 @@
+# tests/unit/test_faq_cache.py
+from importlib import import_module
+from types import SimpleNamespace as NS
+
+from tests.helpers.fakes import FakeStorage
+
+
+def _pelu(fp="fp1"):
+    return NS(id=1, fingerprint=fp, servicios=(NS(nombre="Corte de pelo"), NS(nombre="Tinte")))
+
+
+def _ia(calls, out):
+    return lambda: calls.append(out) or out
+
+
+def test_exacta_casi_duplicada_y_servicios_distintos():
+    faq = import_module("faq_cache").FAQCache()
+    calls = []
+    assert faq.responder(_pelu(), "¿Cuánto cuesta un corte de pelo?", _ia(calls, "15 €")) == "15 €"
+    assert faq.responder(_pelu(), "cuanto cuesta un corte de pelo", _ia(calls, "X")) == "15 €"
+    assert faq.responder(_pelu(), "cuanto cuesta el corte de pelo?", _ia(calls, "X")) == "15 €"
+    assert faq.responder(_pelu(), "cuanto cuesta el tinte", _ia(calls, "30 €")) == "30 €"
+    assert calls == ["15 €", "30 €"]
+    s = faq.stats()
+    assert s["exacta"] == 1 and s["similar"] == 1 and s["miss"] == 2
+
+
+def test_cambio_de_fingerprint_invalida_y_no_cachea_no_entiendo():
+    faq = import_module("faq_cache").FAQCache()
+    calls = []
+    faq.responder(_pelu("fp1"), "donde estais", _ia(calls, "Calle A"))
+    assert faq.responder(_pelu("fp2"), "donde estais", _ia(calls, "Calle B")) == "Calle B"
+    faq.responder(_pelu("fp2"), "algo", _ia(calls, "NO_ENTIENDO"))
+    faq.responder(_pelu("fp2"), "algo", _ia(calls, "NO_ENTIENDO"))
+    assert calls == ["Calle A", "Calle B", "NO_ENTIENDO", "NO_ENTIENDO"]
+
+
+def test_l2_compartida_entre_workers():
+    faq_cache = import_module("faq_cache")
+    st = FakeStorage()
+    calls = []
+    faq_cache.FAQCache(st).responder(_pelu(), "horario", _ia(calls, "9 a 20"))
+    assert faq_cache.FAQCache(st).responder(_pelu(), "Horario?", _ia(calls, "X")) == "9 a 20"
+    assert calls == ["9 a 20"]
+
+
+def test_stats_de_las_caches_en_el_endpoint(appm, monkeypatch):
+    faq_cache = import_module("faq_cache")
+    faq = faq_cache.FAQCache()
+    monkeypatch.setattr(faq_cache, "faq", faq)
+    faq.responder(_pelu(), "horario", _ia([], "9 a 20"))
+    faq.responder(_pelu(), "horario", _ia([], "X"))
+    body = appm.app.test_client().get("/stats").get_json()
+    assert body["faq_cache"]["exacta"] == 1 and body["faq_cache"]["miss"] == 1
+    assert body["faq_cache"]["hit_rate"] == 0.5
+    assert "size" in body["ia_cache"]
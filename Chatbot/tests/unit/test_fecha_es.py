@@ -0,0 +1,42 @@
+# tests/unit/test_fecha_es.py
+from datetime import date
+from importlib import import_module
+
+import pytest
+
+HOY = date(2025, 9, 18)   # jueves
+
+
+@pytest.mark.parametrize("texto,esperado", [
+    ("03/09/2025", date(2025, 9, 3)),
+    ("3-9-25", date(2025, 9, 3)),
+    ("2025-09-03", date(2025, 9, 3)),
+    ("15 de octubre", date(2025, 10, 15)),
+    ("oct 15", date(2025, 10, 15)),
+    ("octubre 15, 2025", date(2025, 10, 15)),
+    ("15 de enero", date(2026, 1, 15)),
+    ("mañana", date(2025, 9, 19)),
+    ("pasado mañana", date(2025, 9, 20)),
+    ("el lunes", date(2025, 9, 22)),
+    ("el jueves que viene", date(2025, 9, 25)),
+    ("el 5", date(2025, 10, 5)),
+])
+def test_gramatica(texto, esperado):
+    assert import_module("fecha_es").parse_fecha_regex(texto, HOY) == esperado
+
+
+def test_fecha_inexistente_y_respaldo():
+    fecha_es = import_module("fecha_es")
+    assert fecha_es.parse_fecha_regex("31/02", HOY) is None
+    assert fecha_es.parse_fecha_regex("cuando podáis", HOY) is None
+    p = fecha_es._date_data_parser("Europe/Madrid", HOY.isoformat())
+    assert fecha_es._date_data_parser("Europe/Madrid", HOY.isoformat()) is p   # se reutiliza
+
+
+def test_interpreta_fecha_sin_ia(monkeypatch):
+    ia = import_module("interpretador_ia")
+
+    def _no_ia(*a, **k):
+        raise AssertionError("no debería llamar a la IA")
+    monkeypatch.setattr(ia, "interpreta_ia", _no_ia)
+    assert ia.interpreta_fecha("15 de octubre", pelu=None) == "2025-10-15"
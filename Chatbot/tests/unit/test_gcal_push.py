@@ -0,0 +1,134 @@
+# tests/unit/test_gcal_push.py
+import json
+from datetime import date
+from importlib import import_module
+from types import SimpleNamespace
+
+import pytest
+
+
+class _Calls:
+    def __init__(self):
+        self.watch, self.stop = [], []
+
+    def events(self):
+        def watch(calendarId, body):
+            self.watch.append((calendarId, body))
+            return SimpleNamespace(execute=lambda: {"resourceId": f"R{len(self.watch)}", "expiration": str(2_000_000 * 1000)})
+        return SimpleNamespace(watch=watch)
+
+    def channels(self):
+        def stop(body):
+            self.stop.append(body)
+            return SimpleNamespace(execute=lambda: None)
+        return SimpleNamespace(stop=stop)
+
+
+@pytest.fixture
+def watcher_env():
+    mod = import_module("calendar_watch")
+    storage = import_module("storage").MemoryStorage()
+    calls = _Calls()
+    now = {"t": 1_000_000.0}
+    w = mod.CalendarWatcher(storage=storage, service_factory=lambda: calls,
+                            address="https://bot.example/webhook/gcal", clock=lambda: now["t"], shared=True)
+    return mod, w, calls, now
+
+
+PELU = SimpleNamespace(id=1, cal_id="cal", tz="Europe/Madrid")
+
+
+def test_registra_y_solo_renueva_cerca_de_caducar(watcher_env):
+    mod, w, calls, now = watcher_env
+    assert w.ensure_watch(PELU)
+    cal_id, body = calls.watch[0]
+    assert cal_id == "cal" and body["address"].endswith("/webhook/gcal")
+    assert body["token"] == mod.channel_token(body["id"])
+    assert w.is_watched(1)
+
+    assert w.ensure_watch(PELU)
+    assert len(calls.watch) == 1
+
+    now["t"] = 2_000_000 - mod.RENEW_MARGIN_SECONDS + 1
+    assert w.ensure_watch(PELU)
+    assert len(calls.watch) == 2
+    assert calls.stop == [{"id": body["id"], "resourceId": "R1"}]
+    assert w.verify(body["id"], body["token"], "R1") is None  # canal viejo ya no vale
+
+
+def test_verify_token_y_resource(watcher_env):
+    mod, w, calls, now = watcher_env
+    w.ensure_watch(PELU)
+    body = calls.watch[0][1]
+    assert w.verify(body["id"], body["token"], "R1")["pelu_id"] == 1
+    assert w.verify(body["id"], "otro", "R1") is None
+    assert w.verify(body["id"], body["token"], "R999") is None
+
+
+def test_sin_url_no_registra(watcher_env):
+    mod, w, calls, now = watcher_env
+    w._address = None
+    assert not w.ensure_watch(PELU)
+    assert calls.watch == []
+
+
+def test_sin_storage_compartido_no_registra(watcher_env):
+    mod, w, calls, now = watcher_env
+    w._shared = False
+    assert not w.ensure_watch(PELU)
+    assert not w.ensure_watch(PELU)
+    assert calls.watch == []
+
+
+def test_renovacion_para_el_canal_viejo_antes_de_registrar(watcher_env):
+    mod, w, calls, now = watcher_env
+    orden = []
+    events, channels = calls.events, calls.channels
+    calls.events = lambda: orden.append("watch") or events()
+    calls.channels = lambda: orden.append("stop") or channels()
+    w.ensure_watch(PELU)
+    now["t"] = 2_000_000 - mod.RENEW_MARGIN_SECONDS + 1
+    w.ensure_watch(PELU)
+    assert orden == ["watch", "stop", "watch"]
+
+
+def _post(appm, headers):
+    appm.app.config["TESTING"] = True
+    return appm.app.test_client().post("/webhook/gcal", headers=headers)
+
+
+def test_webhook_gcal_purga_solo_dias_cambiados(appm, monkeypatch):
+    chan = {"cal_id": "cal", "pelu_id": 1}
+    monkeypatch.setattr(appm.watcher, "verify", lambda cid, tok, rid: chan if tok == "ok" else None)
+    pelu = SimpleNamespace(id=1, tz="Europe/Madrid", servicios=())
+    monkeypatch.setattr(appm.tenants, "get_by_id", lambda _id: pelu)
+    monkeypatch.setattr(appm.mirror, "sync_changes", lambda cal_id, tz: {date(2025, 9, 20), date(2025, 9, 22)})
+    purged = []
+    monkeypatch.setattr(appm, "purge_horas_cache", lambda p, f: purged.append(f))
+
+    class _Inline:
+        def submit(self, key, tenant, fn, *a):
+            fn(*a)
+            return True
+    monkeypatch.setattr(appm, "CORE_EXECUTOR", _Inline())
+
+    assert _post(appm, {"X-Goog-Channel-ID": "c", "X-Goog-Channel-Token": "bad"}).status_code == 403
+    assert _post(appm, {"X-Goog-Channel-ID": "c", "X-Goog-Channel-Token": "ok", "X-Goog-Resource-State": "sync"}).status_code == 200
+    assert purged == []
+
+    r = _post(appm, {"X-Goog-Channel-ID": "c", "X-Goog-Channel-Token": "ok", "X-Goog-Resource-State": "exists"})
+    assert r.status_code == 200
+    assert purged == ["2025-09-20", "2025-09-22"]
+
+
+def test_ttl_de_horas_largo_con_push(appm, monkeypatch, fake_storage):
+    monkeypatch.setattr(appm, "horas_disponibles", lambda *a, **k: ["10:00"])
+    pelu = SimpleNamespace(id=1)
+    ttls = []
+    monkeypatch.setattr(fake_storage, "setex", lambda k, v, ttl: ttls.append(ttl))
+
+    monkeypatch.setattr(appm.watcher, "is_watched", lambda _id: False)
+    appm.horas_disponibles_cached(None, pelu, None, "2025-09-20")
+    monkeypatch.setattr(appm.watcher, "is_watched", lambda _id: True)
+    appm.horas_disponibles_cached(None, pelu, None, "2025-09-21")
+    assert ttls == [appm.settings.HORAS_CACHE_TTL_SECONDS, appm.settings.HORAS_CACHE_TTL_PUSH_SECONDS]
@@ -0,0 +1,60 @@
+# tests/unit/test_graph_client.py
+from importlib import import_module
+
+from tests.helpers.fakes import PostRecorder
+
+
+def test_post_message_url_auth_y_timeout(monkeypatch):
+    mod = import_module("graph_client")
+    client = mod.GraphClient(version="v21.0", connect_timeout=1, read_timeout=5)
+    rec = PostRecorder()
+    monkeypatch.setattr(client.session, "post", rec, raising=False)
+
+    r = client.post_message("PH_1", {"to": "600"}, token="T1", headers={"X-Idempotency-Key": "k"})
+    assert r.ok
+    call = rec.calls[0]
+    assert call["url"] == "https://graph.facebook.com/v21.0/PH_1/messages"
+    assert call["headers"]["Authorization"] == "Bearer T1"
+    assert call["headers"]["X-Idempotency-Key"] == "k"
+    assert call["timeout"] == (1, 5)
+
+    client.post_message("PH_2", {}, token="T2", graph_ver="v23.0")
+    assert rec.calls[1]["url"].endswith("/v23.0/PH_2/messages")
+    assert rec.calls[1]["headers"]["Authorization"] == "Bearer T2"
+
+
+def test_session_con_pool_y_reintentos_solo_de_conexion():
+    mod = import_module("graph_client")
+    client = mod.GraphClient(pool_maxsize=7, max_retries=3)
+    adapter = client.session.get_adapter("https://graph.facebook.com")
+    assert adapter._pool_maxsize == 7
+    assert adapter.max_retries.connect == 3
+    assert adapter.max_retries.read == 0
+    assert tuple(adapter.max_retries.status_forcelist) == (429,)
+
+
+def test_wa_send_text_usa_cliente_compartido(appm, monkeypatch):
+    rec = PostRecorder()
+    monkeypatch.setattr(appm.graph.session, "post", rec, raising=False)
+    monkeypatch.setattr(appm, "_wa_outbound_allow", lambda *_: True, raising=True)
+
+    assert appm.wa_send_text("PH_1", "600", "hola", session_id="wa_PH_1_600") is True
+    assert rec.calls[0]["url"].endswith("/PH_1/messages")
+    assert rec.calls[0]["headers"]["Authorization"] == "Bearer FAKE_TOKEN"
+    assert rec.calls[0]["json"]["text"]["body"] == "hola"
+
+
+def test_retry_after_de_429_con_tope(monkeypatch):
+    from urllib3.response import HTTPResponse
+
+    mod = import_module("graph_client")
+    monkeypatch.setattr(mod.CappedRetry, "MAX_RETRY_AFTER", 2.0)
+    client = mod.GraphClient(max_retries=2)
+    retry = client.session.get_adapter("https://graph.facebook.com").max_retries
+    assert isinstance(retry, mod.CappedRetry)
+
+    r429 = HTTPResponse(status=429, headers={"Retry-After": "3600"})
+    assert retry.get_retry_after(r429) == 2.0
+    assert retry.new(total=1).get_retry_after(r429) == 2.0   # se mantiene tras cada intento
+    assert retry.get_retry_after(HTTPResponse(status=429, headers={"Retry-After": "1"})) == 1.0
+    assert retry.get_retry_after(HTTPResponse(status=429)) is None
@@ -0,0 +1,95 @@
+# tests/unit/test_guardar_reserva_rango.py
+from datetime import date, time
+from importlib import import_module
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+
+@pytest.fixture
+def bd(monkeypatch):
+    models = import_module("models")
+    bd = import_module("bd_utils")
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    s = Session()
+    s.add(models.Peluqueria(id=1, nombre="P", api_key="K", num_peluqueros=1, rango_reservas=30))
+    s.add_all([models.Servicio(id=1, peluqueria_id=1, nombre="Corte", duracion_min=30),
+               models.Servicio(id=2, peluqueria_id=1, nombre="Tinte", duracion_min=90)])
+    s.add(models.Reserva(peluqueria_id=1, servicio_id=2, nombre_cliente="a", telefono="1",
+                         fecha=date(2025, 9, 20), hora=time(9, 0)))
+    s.commit()
+    s.close()
+    queries = []
+    event.listen(engine, "before_cursor_execute", lambda *a: queries.append(a[2]))
+    monkeypatch.setattr(bd, "SessionLocal", Session)
+    return bd, queries
+
+
+def test_consulta_de_reservas_acotada_por_hora(bd):
+    bd, queries = bd
+    rid = bd.guardar_reserva_db(1, 1, "B", "2", "2025-09-20", "11:00")
+    assert isinstance(rid, int)
+    sel_reservas = [q for q in queries if "FROM reservas" in q]
+    assert sel_reservas and "reservas.hora >" in sel_reservas[0] and "reservas.hora <" in sel_reservas[0]
+
+
+def test_rango_acotado_sigue_viendo_reserva_larga(bd):
+    bd, _ = bd
+    # el tinte de las 09:00 dura hasta las 10:30: a las 10:00 no hay hueco, a las 10:30 sí
+    assert bd.guardar_reserva_db(1, 1, "B", "2", "2025-09-20", "10:00") == {"error": "no_slot"}
+    assert isinstance(bd.guardar_reserva_db(1, 1, "C", "3", "2025-09-20", "10:30"), int)
+
+
+def test_peluquero_ocupado_aunque_quede_capacidad(bd):
+    bd, _ = bd
+    models = import_module("models")
+    with bd.SessionLocal() as s:
+        s.get(models.Peluqueria, 1).num_peluqueros = 3
+        s.add_all([models.Peluquero(id=10, peluqueria_id=1, nombre="Ana"),
+                   models.Peluquero(id=20, peluqueria_id=1, nombre="Luis")])
+        s.commit()
+    assert isinstance(bd.guardar_reserva_db(1, 1, "B", "2", "2025-09-20", "12:00", peluquero_id=10), int)
+    assert bd.guardar_reserva_db(1, 1, "C", "3", "2025-09-20", "12:00", peluquero_id=10) == {"error": "no_slot"}
+    assert isinstance(bd.guardar_reserva_db(1, 1, "D", "4", "2025-09-20", "12:00", peluquero_id=20), int)
+
+
+def test_lease_redis_sin_sesion_de_bd_abierta(bd, monkeypatch):
+    bd, _ = bd
+    sl = import_module("slot_locks")
+    abiertas, vistas = [0], []
+    Session = bd.SessionLocal
+
+    def _contada():
+        s = Session()
+        abiertas[0] += 1
+        close = s.close
+
+        def _close():
+            if not getattr(s, "_cerrada", False):
+                s._cerrada = True
+                abiertas[0] -= 1
+            close()
+        s.close = _close
+        return s
+
+    class _Locks:
+        needs_session = False
+
+        def acquire(self, db, keys, timeout_sec=5):
+            vistas.append((db, abiertas[0]))
+            return sl.SlotLease(keys=keys)
+
+        def fence_write(self, db, lease):
+            return True
+
+        def release(self, db, lease):
+            pass
+
+    monkeypatch.setattr(bd, "SessionLocal", _contada)
+    monkeypatch.setattr(bd, "SLOT_LOCKS", _Locks())
+    assert isinstance(bd.guardar_reserva_db(1, 1, "B", "2", "2025-09-20", "11:00"), int)
+    assert vistas == [(None, 0)]          # el lease se espera sin ninguna sesión de BD abierta
+    assert abiertas[0] == 0
@@ -0,0 +1,53 @@
+# tests/unit/test_hora_es.py
+from importlib import import_module
+
+import pytest
+
+
+@pytest.mark.parametrize("texto,candidatas,ambigua", [
+    ("17:30", ["17:30"], False),
+    ("17h30", ["17:30"], False),
+    ("a las 5", ["05:00", "17:00"], True),
+    ("cinco y media", ["05:30", "17:30"], True),
+    ("a las seis menos cuarto", ["05:45", "17:45"], True),
+    ("a las 7 de la tarde", ["19:00"], False),
+    ("5pm", ["17:00"], False),
+    ("a las 9 de la mañana", ["09:00"], False),
+    ("mediodía", ["12:00"], False),
+    ("a las 12 de la noche", ["00:00"], False),
+    ("el 15 a las 5", ["05:00", "17:00"], True),
+    ("20", ["20:00"], False),
+    ("10 en punto", ["10:00", "22:00"], True),
+    ("17 horas", ["17:00"], False),
+    ("5 de la tarde", ["17:00"], False),
+    ("mediodía y media", ["12:30"], False),
+    ("al mediodía y cuarto", ["12:15"], False),
+    ("a las 2 del mediodía", ["14:00"], False),
+    ("17h", ["17:00"], False),
+    ("a las 11h", ["11:00", "23:00"], True),
+    ("17hrs", ["17:00"], False),
+    ("las 9h de la mañana", ["09:00"], False),
+    ("a las 5 y 3 cuartos", ["05:45", "17:45"], True),
+    ("a las cinco y tres cuartos", ["05:45", "17:45"], True),
+])
+def test_gramatica(texto, candidatas, ambigua):
+    r = import_module("hora_es").parse_hora(texto)
+    assert r["candidatas"] == candidatas and r["ambigua"] is ambigua
+
+
+def test_sin_hora():
+    hora_es = import_module("hora_es")
+    assert hora_es.parse_hora("quiero una cita") is None
+    assert hora_es.parse_hora("a las 25") is None
+    # números sin marca de hora (fechas, plazos): no son horas
+    assert hora_es.parse_hora("mejor el dia 20") is None
+    assert hora_es.parse_hora("en 2 semanas") is None
+    assert hora_es.parse_hora("el 15 de octubre") is None
+
+
+def test_normaliza_hora_no_llama_a_la_ia(appm, monkeypatch):
+    def _no_ia(*a, **k):
+        raise AssertionError("no debería llamar a la IA")
+    monkeypatch.setattr(appm, "interpreta_hora", _no_ia)
+    p = appm.normaliza_hora_ia("a las 5 y media de la tarde")
+    assert appm.elegir_hora_final(["17:00", "17:30"], p) == {"ok": True, "hora": "17:30"}
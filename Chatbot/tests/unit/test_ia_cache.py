@@ -0,0 +1,48 @@
+# tests/unit/test_ia_cache.py
+from importlib import import_module
+from types import SimpleNamespace
+
+from tests.helpers.fakes import FakeStorage
+
+PELU = SimpleNamespace(id=1, tz="Europe/Madrid", fingerprint="fp1", servicios=())
+
+
+def test_memo_l1_l2_y_no_cachea_no_entiendo():
+    ia_cache = import_module("ia_cache")
+    st = FakeStorage()
+    a = ia_cache.IACache(storage=st)
+    calls = []
+
+    def llm(out):
+        return lambda: calls.append(out) or out
+
+    assert a.memo("servicio", PELU, "Corte ", llm("Corte")) == "Corte"
+    assert a.memo("servicio", PELU, "  corte", llm("X")) == "Corte"           # L1, texto normalizado
+    b = ia_cache.IACache(storage=st)                                          # otro worker: L2
+    assert b.memo("servicio", PELU, "CORTE", llm("X")) == "Corte"
+    assert calls == ["Corte"]
+
+    a.memo("servicio", PELU, "algo raro", llm("NO_ENTIENDO"))
+    a.memo("servicio", PELU, "algo raro", llm("NO_ENTIENDO"))
+    assert calls.count("NO_ENTIENDO") == 2
+    s = a.stats()["servicio"]
+    assert s["l1"] == 1 and s["miss"] == 3 and b.stats()["servicio"]["l2"] == 1
+
+
+def test_clave_cambia_con_catalogo_y_solo_fecha_lleva_dia():
+    ia_cache = import_module("ia_cache")
+    otro = SimpleNamespace(**dict(vars(PELU), fingerprint="fp2"))
+    assert ia_cache.clave("servicio", PELU, "corte") != ia_cache.clave("servicio", otro, "corte")
+    assert ia_cache.clave("intencion", PELU, "corte") == ia_cache.clave("intencion", otro, "corte")
+    assert ":2025-09-18:" in ia_cache.clave("fecha", PELU, "el finde")
+
+
+def test_interpreta_ia_memoiza(monkeypatch):
+    ia = import_module("interpretador_ia")
+    ia_cache = import_module("ia_cache")
+    monkeypatch.setattr(ia_cache, "cache", ia_cache.IACache())
+    calls = []
+    monkeypatch.setattr(ia, "_interpreta_ia", lambda t, paso, pelu: calls.append(t) or "reservar")
+    for _ in range(3):
+        assert ia.interpreta_ia("quiero una cita", "intencion", PELU) == "reservar"
+    assert calls == ["quiero una cita"]
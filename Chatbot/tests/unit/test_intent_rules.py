@@ -0,0 +1,34 @@
+# tests/unit/test_intent_rules.py
+from importlib import import_module
+
+import pytest
+
+
+@pytest.mark.parametrize("texto,esperado", [
+    ("quiero pedir hora para mañana", "reservar"),
+    ("buenas, quería reservar para un corte", "reservar"),
+    ("no podré ir a la cita del viernes", "cancelar"),
+    ("¿Dónde estáis?", "duda"),
+    ("cuánto cuesta un tinte?", "duda"),
+])
+def test_reglas_resuelven_sin_ia(appm, monkeypatch, texto, esperado):
+    def _no_ia(*a, **k):
+        raise AssertionError("no debería llamar a la IA")
+    monkeypatch.setattr(appm, "interpreta_ia", _no_ia)
+    assert appm.intencion_desde_texto_o_ia(texto, pelu=None) == esperado
+
+
+def test_neutras_y_baja_confianza():
+    ir = import_module("intent_rules")
+    clf = ir.IntentClassifier(frases={"pedir cita": "reservar"}, neutras={"sí", "menu"})
+    assert clf.clasificar("Sí") == (None, 1.0)
+    assert clf.clasificar("pedir cita") == ("reservar", 1.0)
+    assert clf.clasificar("hola")[1] == 0.0
+    assert clf.clasificar("hora")[1] < 0.5
+
+
+def test_baja_confianza_cae_a_la_ia(appm, monkeypatch):
+    calls = []
+    monkeypatch.setattr(appm, "interpreta_ia", lambda m, paso, pelu: calls.append(m) or "duda")
+    assert appm.intencion_desde_texto_o_ia("hola, una cosita", pelu=None) == "duda"
+    assert calls == ["hola, una cosita"]
@@ -0,0 +1,54 @@
+# tests/unit/test_memory_storage.py
+import threading
+from importlib import import_module
+
+
+def _make(**kw):
+    now = {"t": 1000.0}
+    st = import_module("storage").MemoryStorage(clock=lambda: now["t"], **kw)
+    return st, now
+
+
+def test_barrido_de_caducadas_sin_leerlas():
+    st, now = _make(sweep_batch=10)
+    for i in range(5):
+        st.setex(f"seen_wamid:{i}", "1", ttl=10)
+    st.setex("state:x", "{}", ttl=3600)
+    now["t"] += 11
+    st.setex("otra", "v", ttl=60)          # cualquier escritura barre lo vencido
+    assert st.stats()["size"] == 2
+    assert st.stats()["expired"] == 5
+
+
+def test_reescritura_no_caduca_por_ttl_viejo():
+    st, now = _make()
+    st.setex("k", "a", ttl=10)
+    st.setex("k", "b", ttl=100)
+    now["t"] += 11
+    assert st.sweep() == 0
+    assert st.get("k") == "b"
+
+
+def test_lru_expulsa_la_menos_usada():
+    st, _ = _make(max_entries=2)
+    st.setex("a", "1", ttl=60)
+    st.setex("b", "2", ttl=60)
+    assert st.get("a") == "1"              # 'a' pasa a ser la más reciente
+    st.setex("c", "3", ttl=60)
+    assert st.get("b") is None and st.get("a") == "1" and st.get("c") == "3"
+    s = st.stats()
+    assert s["evictions"] == 1 and s["size"] == 2 and s["hits"] == 3 and s["misses"] == 1
+
+
+def test_incr_atomico_entre_hilos():
+    st, _ = _make()
+
+    def worker():
+        for _ in range(500):
+            st.incr("rl:x", ttl=60)
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert st.get("rl:x") == "4000"
@@ -0,0 +1,59 @@
+# tests/unit/test_ocupacion_dia.py
+import random
+from importlib import import_module
+from types import SimpleNamespace
+
+
+def _ru():
+    return import_module("reserva_utils")
+
+
+def _naive(busy_min, a, b):
+    return sum(1 for x1, x2 in busy_min if a < x2 and x1 < b)
+
+
+def test_solapes_igual_que_el_recorrido_lineal():
+    ru = _ru()
+    rnd = random.Random(7)
+    for _ in range(50):
+        busy = []
+        for _ in range(rnd.randint(0, 12)):
+            s = rnd.randrange(0, 1400, 5)
+            busy.append((ru._from_min(s), ru._from_min(min(1439, s + rnd.choice([15, 30, 45, 90])))))
+        oc = ru.OcupacionDia(busy)
+        busy_min = [(ru._to_min(a), ru._to_min(b)) for a, b in busy]
+        for a in range(0, 1400, 15):
+            for dur in (15, 30, 60):
+                assert oc.solapes(a, a + dur) == _naive(busy_min, a, a + dur)
+
+
+def test_dia_completo_all_day():
+    ru = _ru()
+    oc = ru.OcupacionDia([("00:00", "23:59")])
+    assert oc.solapes(600, 630) == 1
+    assert oc.inicios_libres([("09:00", "10:00")], 30, 30, 1) == []
+
+
+def test_inicios_libres_respeta_capacidad_y_cutoff():
+    ru = _ru()
+    oc = ru.OcupacionDia([("10:00", "10:30"), ("10:15", "11:00")])
+    tramos = [("09:00", "12:00")]
+    assert oc.inicios_libres(tramos, 30, 30, 1) == ["09:00", "09:30", "11:00", "11:30"]
+    assert oc.inicios_libres(tramos, 30, 30, 2) == ["09:00", "09:30", "10:30", "11:00", "11:30"]
+    assert oc.inicios_libres(tramos, 30, 30, 1, cutoff_abs_min=10 * 60) == ["11:00", "11:30"]
+
+
+def test_varios_servicios_una_sola_lectura_de_calendar(monkeypatch):
+    ru = _ru()
+    gcal = import_module("google_calendar_utils")
+    reads = []
+    monkeypatch.setattr(gcal, "list_event_ranges_for_day", lambda pelu, f: reads.append(f) or [("10:00", "11:00")])
+    pelu = SimpleNamespace(id=1, num_peluqueros=1, rango_reservas=30, horario="09:00-12:00",
+                           min_avance_min=60, max_avance_dias=150, tz="Europe/Madrid")
+    corto = SimpleNamespace(id=1, duracion_min=30)
+    largo = SimpleNamespace(id=2, duracion_min=60)
+
+    out = ru.horas_disponibles_por_servicio(None, pelu, [corto, largo], "2025-09-20")
+    assert out == {1: ["09:00", "09:30", "11:00", "11:30"], 2: ["09:00", "11:00"]}
+    assert len(reads) == 1
+    assert ru.horas_disponibles(None, pelu, largo, "2025-09-20", busy_ranges=[]) == ["09:00", "09:30", "10:00", "10:30", "11:00"]
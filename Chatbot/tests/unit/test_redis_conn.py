@@ -0,0 +1,36 @@
+# tests/unit/test_redis_conn.py
+from importlib import import_module
+
+
+def test_un_pool_por_url_compartido(monkeypatch):
+    rc = import_module("redis_conn")
+    rc.reset()
+    monkeypatch.setattr(rc.settings, "REDIS_MAX_CONNECTIONS", 7)
+    try:
+        a = rc.get_client("redis://localhost:6379/3")
+        b = rc.get_client("redis://localhost:6379/3")
+        assert a is b
+        pool = rc.get_pool("redis://localhost:6379/3")
+        assert a.connection_pool is pool and pool.max_connections == 7
+        assert pool.connection_kwargs["decode_responses"] is True
+        assert rc.limiter_storage_options("redis://localhost:6379/3") == {"connection_pool": pool}
+        assert rc.limiter_storage_options("memory://") == {}
+        assert rc.get_client("redis://localhost:6379/4") is not a
+    finally:
+        rc.reset()
+
+
+def test_ready_reutiliza_cliente(appm, monkeypatch):
+    rc = import_module("redis_conn")
+    calls = []
+
+    class _C:
+        def setex(self, *a):
+            calls.append(a)
+    client = _C()
+    monkeypatch.setattr(rc, "get_client", lambda url=None: client)
+    monkeypatch.setenv("REDIS_URL", "redis://x")
+    c = appm.app.test_client()
+    c.get("/ready")
+    c.get("/ready")
+    assert len(calls) == 2
@@ -0,0 +1,95 @@
+# tests/unit/test_session_executor.py
+import threading
+import time
+from importlib import import_module
+
+
+def _executor(**kw):
+    return import_module("session_executor").KeyedExecutor(**kw)
+
+
+def test_misma_sesion_en_orden_y_sin_solapes():
+    ex = _executor(max_workers=4)
+    seen, running = [], {"n": 0, "max": 0}
+    lock = threading.Lock()
+
+    def task(i):
+        with lock:
+            running["n"] += 1
+            running["max"] = max(running["max"], running["n"])
+        time.sleep(0.005)
+        with lock:
+            seen.append(i)
+            running["n"] -= 1
+
+    for i in range(20):
+        assert ex.submit("wa_PH_1_600", 1, task, i)
+    assert ex.shutdown(timeout=5)
+    assert seen == list(range(20))
+    assert running["max"] == 1
+
+
+def test_sesiones_distintas_en_paralelo():
+    ex = _executor(max_workers=2)
+    barrier = threading.Barrier(2, timeout=2)
+    ex.submit("a", 1, barrier.wait)
+    ex.submit("b", 1, barrier.wait)
+    assert ex.shutdown(timeout=5)
+    assert ex.stats()["failed"] == 0
+
+
+def test_cola_acotada_por_peluqueria():
+    ex = _executor(max_workers=1, max_pending_per_tenant=2)
+    gate = threading.Event()
+    assert ex.submit("a", 1, gate.wait, 2)
+    assert ex.submit("b", 1, lambda: None)
+    assert not ex.submit("c", 1, lambda: None)   # pelu 1 llena
+    assert ex.submit("d", 2, lambda: None)       # otra pelu no se ve afectada
+    gate.set()
+    assert ex.shutdown(timeout=5)
+    stats = ex.stats()
+    assert stats["rejected"] == 1 and stats["completed"] == 3 and stats["pending"] == 0
+
+
+def test_error_en_tarea_no_bloquea_la_sesion():
+    ex = _executor(max_workers=1)
+    out = []
+
+    def boom():
+        raise RuntimeError("x")
+
+    ex.submit("s", 1, boom)
+    ex.submit("s", 1, out.append, "ok")
+    assert ex.shutdown(timeout=5)
+    assert out == ["ok"]
+    assert ex.stats()["failed"] == 1
+
+
+def test_shutdown_rechaza_trabajo_nuevo():
+    ex = _executor()
+    assert ex.shutdown(timeout=1)
+    assert not ex.submit("s", 1, lambda: None)
+
+
+def test_shutdown_sin_drenar_descarta_la_cola_sin_reencolar():
+    ex = _executor(max_workers=1)
+    started, gate, done = threading.Event(), threading.Event(), threading.Event()
+    out = []
+
+    def lenta():
+        started.set()
+        gate.wait(2)
+
+    ex.submit("s", 1, lenta)
+    ex.submit("s", 1, out.append, "tarde")
+    assert started.wait(2)
+    assert not ex.shutdown(timeout=0)
+    gate.set()
+    for _ in range(200):
+        if ex.stats()["dropped"]:
+            done.set()
+            break
+        time.sleep(0.005)
+    assert done.is_set()
+    stats = ex.stats()
+    assert out == [] and stats["completed"] == 1 and stats["pending"] == 0 and stats["active_keys"] == 0
@@ -0,0 +1,65 @@
+# tests/unit/test_slot_inventario.py
+from datetime import date, time
+from importlib import import_module
+
+import pytest
+from sqlalchemy import create_engine, event
+from sqlalchemy.orm import sessionmaker
+
+D = date(2025, 9, 20)
+
+
+@pytest.fixture
+def env(monkeypatch):
+    models = import_module("models")
+    bd = import_module("bd_utils")
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    Session = sessionmaker(bind=engine)
+    s = Session()
+    s.add(models.Peluqueria(id=1, nombre="P", api_key="K", num_peluqueros=2, rango_reservas=30))
+    s.add_all([models.Servicio(id=1, peluqueria_id=1, nombre="Corte", duracion_min=30),
+               models.Servicio(id=2, peluqueria_id=1, nombre="Tinte", duracion_min=90)])
+    s.add(models.Peluquero(id=10, peluqueria_id=1, nombre="Ana"))
+    s.add(models.Reserva(peluqueria_id=1, servicio_id=2, nombre_cliente="a", telefono="1", fecha=D, hora=time(9, 0)))
+    s.commit()
+    s.close()
+    monkeypatch.setattr(bd, "SessionLocal", Session)
+    monkeypatch.setattr(bd.settings, "SLOT_INVENTARIO_ENABLED", True)
+    monkeypatch.setattr(bd.settings, "SLOT_INVENTARIO_STEP_MIN", 15)
+    queries = []
+    event.listen(engine, "before_cursor_execute", lambda *a: queries.append(a[2]))
+    return bd, Session, queries
+
+
+def _usados(Session, model_name="SlotOcupacion"):
+    model = getattr(import_module("models"), model_name)
+    with Session() as s:
+        return {r.minuto: r.usados for r in s.query(model).filter_by(fecha=D)}
+
+
+def test_backfill_y_capacidad_por_update_condicional(env):
+    bd, Session, queries = env
+    inv = import_module("slot_inventario")
+    with Session() as s:
+        assert inv.backfill(s, D) == 1
+        s.commit()
+    assert _usados(Session) == {540: 1, 555: 1, 570: 1, 585: 1, 600: 1, 615: 1}
+
+    queries.clear()
+    assert isinstance(bd.guardar_reserva_db(1, 1, "B", "2", "2025-09-20", "10:00"), int)   # 2º hueco
+    assert not any("WHERE reservas.peluqueria_id" in q for q in queries)                   # sin leer el día
+    assert bd.guardar_reserva_db(1, 1, "C", "3", "2025-09-20", "10:15") == {"error": "no_slot"}
+    assert _usados(Session)[600] == 2 and _usados(Session).get(630, 0) == 0   # el rollback deshace lo sumado
+
+
+def test_cancelar_libera_tramos_y_peluquero(env):
+    bd, Session, _ = env
+    rid = bd.guardar_reserva_db(1, 1, "B", "2", "2025-09-20", "12:00", peluquero_id=10)
+    assert _usados(Session, "SlotOcupacionPeluquero") == {720: 1, 735: 1}
+    # el mismo peluquero no puede tener dos a la vez aunque la peluquería tenga capacidad 2
+    assert bd.guardar_reserva_db(1, 1, "C", "3", "2025-09-20", "12:15", peluquero_id=10) == {"error": "no_slot"}
+
+    assert bd.cancelar_reserva_db(rid) == {"ok": True}
+    assert _usados(Session) == {720: 0, 735: 0}
+    assert _usados(Session, "SlotOcupacionPeluquero") == {720: 0, 735: 0}
@@ -0,0 +1,141 @@
+# tests/unit/test_slot_locks.py
+from importlib import import_module
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+
+
+class _MySQLDB:
+    """Sesión falsa con dialecto mysql que registra las sentencias ejecutadas."""
+
+    def __init__(self, result=1):
+        self.bind = SimpleNamespace(dialect=SimpleNamespace(name="mysql"))
+        self.result = result
+        self.sql = []
+
+    def execute(self, stmt, params=None):
+        self.sql.append((str(stmt), dict(params or {})))
+        return SimpleNamespace(scalar=lambda: self.result)
+
+
+def test_batch_una_sola_sentencia_ordenada():
+    bd = import_module("bd_utils")
+    db = _MySQLDB()
+    keys = bd._slot_keys(1, "2025-09-20", "10:00", 90, 15)
+    got = bd._acquire_locks_batch(db, list(reversed(keys)), timeout_sec=6)
+
+    assert got == sorted(keys)
+    assert len(db.sql) == 1
+    sql, params = db.sql[0]
+    assert sql.count("GET_LOCK") == 6
+    assert [params[f"k{i}"] for i in range(6)] == sorted(keys)
+    assert params["t"] == 1
+
+
+def test_batch_timeout_suelta_todo():
+    bd = import_module("bd_utils")
+    db = _MySQLDB(result=0)
+    assert bd._acquire_locks_batch(db, ["slot:1:2025-09-20:0600"]) is None
+    assert db.sql[-1][0] == "SELECT RELEASE_ALL_LOCKS()"
+
+
+def test_batch_noop_fuera_de_mysql():
+    bd = import_module("bd_utils")
+    db = SimpleNamespace(bind=SimpleNamespace(dialect=SimpleNamespace(name="sqlite")))
+    assert bd._acquire_locks_batch(db, ["b", "a", "a"]) == ["a", "b"]
+
+
+class _FakeRedis:
+    """Redis mínimo: cada script registrado se emula en Python (atómico por construcción)."""
+
+    def __init__(self):
+        self.data = {}
+        self.calls = []
+
+    def register_script(self, src):
+        sl = import_module("slot_locks")
+        impl = {sl._ACQUIRE_LUA: self._acquire, sl._RELEASE_LUA: self._release, sl._CHECK_LUA: self._check}[src]
+
+        def run(keys, args):
+            self.calls.append((impl.__name__, list(keys)))
+            return impl(keys, args)
+        return run
+
+    def _acquire(self, keys, args):
+        fence_key, slots = keys[0], keys[1:]
+        if any(k in self.data for k in slots):
+            return 0
+        self.data[fence_key] = int(self.data.get(fence_key, 0)) + 1
+        for k in slots:
+            self.data[k] = args[0]
+        return self.data[fence_key]
+
+    def _release(self, keys, args):
+        mine = [k for k in keys if self.data.get(k) == args[0]]
+        for k in mine:
+            del self.data[k]
+        return len(mine)
+
+    def _check(self, keys, args):
+        return int(all(self.data.get(k) == args[0] for k in keys))
+
+
+@pytest.fixture
+def db():
+    models = import_module("models")
+    engine = create_engine("sqlite://")
+    models.Base.metadata.create_all(engine)
+    s = sessionmaker(bind=engine)()
+    yield s
+    s.close()
+
+
+def test_redis_lease_todo_o_nada_con_fencing(monkeypatch, db):
+    sl = import_module("slot_locks")
+    monkeypatch.setattr(sl, "RETRY_SLEEP_SECONDS", 0)
+    r = _FakeRedis()
+    locks = sl.RedisSlotLocks(r, ttl_seconds=5)
+
+    a = locks.acquire(None, ["s:0615", "s:0600"], timeout_sec=1)
+    assert a.keys == ["s:0600", "s:0615"] and a.fence == 1
+    assert r.calls == [("_acquire", [sl.FENCE_KEY, "s:0600", "s:0615"])]  # un solo script para todas
+
+    # franja que pisa un slot ocupado: no se lleva ninguno
+    assert locks.acquire(None, ["s:0615", "s:0630"], timeout_sec=0) is None
+    assert "s:0630" not in r.data
+
+    assert locks.fence_write(db, a)
+    locks.release(None, a)
+    b = locks.acquire(None, ["s:0615", "s:0630"], timeout_sec=0)
+    assert b.fence == 2
+
+
+def test_redis_lease_caducado_no_se_libera_ajeno(monkeypatch, db):
+    sl = import_module("slot_locks")
+    r = _FakeRedis()
+    locks = sl.RedisSlotLocks(r, ttl_seconds=5)
+    a = locks.acquire(None, ["s:0600"], timeout_sec=0)
+    r.data["s:0600"] = "otro-token"     # nuestro lease expiró y otra reserva lo tomó
+    assert not locks.fence_write(db, a)
+    locks.release(None, a)
+    assert r.data["s:0600"] == "otro-token"
+
+
+def test_fence_viejo_no_escribe_aunque_el_lease_parezca_vivo(db):
+    sl = import_module("slot_locks")
+    models = import_module("models")
+    r = _FakeRedis()
+    locks = sl.RedisSlotLocks(r, ttl_seconds=5)
+    a = locks.acquire(None, ["s:0600", "s:0615"], timeout_sec=0)
+    # a se queda parado: su lease caduca, b reserva y confirma con un fence mayor
+    r.data.clear()
+    b = locks.acquire(None, ["s:0615"], timeout_sec=0)
+    assert locks.fence_write(db, b)
+    db.commit()
+    # a "recupera" el lease (mismo token en Redis) pero el fence de b ya está escrito
+    r.data.update({"s:0600": a.token, "s:0615": a.token})
+    assert not locks.fence_write(db, a)
+    db.rollback()
+    assert db.get(models.SlotFence, "s:0615").fence == b.fence
@@ -0,0 +1,90 @@
+# tests/unit/test_storage_batch.py
+import types
+from importlib import import_module
+
+
+def test_memoria_lotes_y_set_if_absent():
+    st = import_module("storage").MemoryStorage()
+    st.mset_ex({"a": "1", "b": "2"}, ttl=60)
+    assert st.mget(["a", "x", "b"]) == ["1", None, "2"]
+    assert st.set_if_absent("a", "9", ttl=60) is False
+    assert st.set_if_absent("c", "3", ttl=60) is True
+    with st.pipeline() as p:
+        p.incr("n", ttl=60).get("c").delete("a")
+    assert p.results == [1, "3", None]
+    st.delete_many(["b", "c"])
+    assert st.mget(["a", "b", "c"]) == [None, None, None]
+
+
+class _FakePipe:
+    def __init__(self, log):
+        self.log, self.cmds = log, []
+
+    def __getattr__(self, name):
+        def cmd(*a, **k):
+            self.cmds.append((name, a, k))
+            return self
+        return cmd
+
+    def execute(self):
+        self.log.append([c[0] for c in self.cmds])
+        replies = {"get": "v", "setex": True, "incr": 7, "expire": True, "set": None, "delete": 1}
+        return [replies[c[0]] for c in self.cmds]
+
+
+def test_redis_pipeline_un_solo_execute(monkeypatch):
+    log = []
+    client = types.SimpleNamespace(pipeline=lambda **k: _FakePipe(log))
+    monkeypatch.setattr(import_module("redis_conn"), "get_client", lambda url=None: client)
+    st = import_module("storage").get_storage(types.SimpleNamespace(STORAGE_BACKEND="redis", REDIS_URL="redis://x"))
+
+    with st.pipeline() as p:
+        p.incr("rl:s", ttl=60)
+        p.get("state:s")
+        p.set_if_absent("seen_wamid:w", "1", ttl=60)
+    assert p.results == [7, "v", False]
+    assert log == [["incr", "expire", "get", "set"]]
+
+
+def test_wa_admit_dedup_y_orden(appm, monkeypatch):
+    st = import_module("storage").MemoryStorage()
+    monkeypatch.setattr(appm, "storage", st)
+    st.setex("state:wa_1_34", '{"paso": "fecha"}', ttl=60)
+
+    ok, pre = appm._wa_admit("wa_1_34", 100, "wamid.A")
+    assert ok and appm._parse_estado(pre["state"])["paso"] == "fecha"
+    assert appm._wa_admit("wa_1_34", 100, "wamid.A")[0] is False   # reintento de Meta
+    assert appm._wa_admit("wa_1_34", 99, "wamid.B")[0] is False    # llega tarde
+    assert appm._wa_admit("wa_1_34", 101, "wamid.C")[0] is True
+
+
+def test_admit_memoria_un_solo_ganador_entre_hilos():
+    import threading
+    storage = import_module("storage")
+    st = storage.MemoryStorage()
+    verdicts = []
+
+    def worker():
+        verdicts.append(st.admit_message("last_ts:s", "seen_wamid:w", 100, ttl=60)[0])
+    threads = [threading.Thread(target=worker) for _ in range(8)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    assert verdicts.count(storage.ADMIT) == 1 and verdicts.count(storage.DUPLICATE) == 7
+
+
+def test_admit_redis_un_script(monkeypatch):
+    calls = []
+
+    def register_script(src):
+        def run(keys, args):
+            calls.append((keys, args))
+            return ["stale", None]
+        return run
+    client = types.SimpleNamespace(register_script=register_script)
+    monkeypatch.setattr(import_module("redis_conn"), "get_client", lambda url=None: client)
+    st = import_module("storage").get_storage(types.SimpleNamespace(STORAGE_BACKEND="redis", REDIS_URL="redis://x"))
+
+    assert st.admit_message("last_ts:s", None, 5, ttl=60, peek_key="state:s") == ("stale", None)
+    assert calls == [(["last_ts:s", "", "state:s"], [5, 60])]
@@ -0,0 +1,69 @@
+# tests/unit/test_tenant_registry.py
+from importlib import import_module
+
+import pytest
+
+
+def _registry(**kw):
+    mod = import_module("tenant_registry")
+    calls = []
+    rows = {
+        1: {"id": 1, "nombre": "Pelu 1", "api_key": "K1", "wa_phone_number_id": "PH_1"},
+        2: {"id": 2, "nombre": "Pelu 2", "api_key": "K2", "wa_phone_number_id": "PH_2"},
+    }
+
+    def loader(field, value):
+        calls.append((field, value))
+        for row in rows.values():
+            if row[field] == value:
+                return mod.TenantSnapshot(**row, servicios=(), peluqueros_activos=(), fingerprint="fp")
+        return None
+
+    return mod.TenantRegistry(loader=loader, **kw), calls, rows
+
+
+def test_lookup_por_cualquier_indice_solo_carga_una_vez():
+    reg, calls, _ = _registry(ttl=60)
+    a = reg.get_by_wa_phone_number_id("PH_1")
+    b = reg.get_by_api_key("K1")
+    c = reg.get_by_id(1)
+    assert a is b is c
+    assert calls == [("wa_phone_number_id", "PH_1")]
+
+
+def test_snapshot_es_de_solo_lectura():
+    reg, _, _ = _registry()
+    pelu = reg.get_by_id(1)
+    with pytest.raises(AttributeError):
+        pelu.nombre = "otro"
+
+
+def test_ttl_caducado_recarga(monkeypatch):
+    mod = import_module("tenant_registry")
+    now = {"t": 1000.0}
+    monkeypatch.setattr(mod.time, "monotonic", lambda: now["t"])
+    reg, calls, _ = _registry(ttl=60)
+    reg.get_by_id(1)
+    now["t"] += 61
+    reg.get_by_id(1)
+    assert len(calls) == 2
+
+
+def test_lru_acotado_e_invalidacion():
+    reg, calls, _ = _registry(max_entries=1)
+    reg.get_by_id(1)
+    reg.get_by_id(2)
+    assert len(reg) == 1
+    reg.get_by_id(1)
+    assert calls.count(("id", 1)) == 2
+
+    reg.invalidate(1)
+    assert reg.get_by_api_key("K1") is not None
+    assert calls[-1] == ("api_key", "K1")
+
+
+def test_miss_cacheado_con_ttl_negativo():
+    reg, calls, _ = _registry(negative_ttl=10)
+    assert reg.get_by_wa_phone_number_id("PH_X") is None
+    assert reg.get_by_wa_phone_number_id("PH_X") is None
+    assert calls == [("wa_phone_number_id", "PH_X")]
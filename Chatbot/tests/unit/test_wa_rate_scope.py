@@ -0,0 +1,51 @@
+# tests/unit/test_wa_rate_scope.py
+import hashlib
+import hmac
+import json
+
+
+class _LimiterEspia:
+    def __init__(self):
+        self.calls = []
+
+    def hit(self, *a, **k):
+        self.calls.append(a)
+        return True
+
+    def test(self, *a, **k):
+        return True
+
+
+def _body(pnid="PN1"):
+    return json.dumps({"entry": [{"changes": [{"value": {"metadata": {"phone_number_id": pnid}}}]}]}).encode()
+
+
+def test_scope_por_phone_number_id_sin_bd(appm, monkeypatch):
+    def _no_db(*a, **k):
+        raise AssertionError("el scope no debe consultar la BD")
+    monkeypatch.setattr(appm, "get_peluqueria_by_wa_phone_number_id", _no_db)
+    with appm.app.test_request_context("/webhook/whatsapp", method="POST", data=_body()):
+        assert appm._pelu_rate_scope("whatsapp_receive") == "wa:PN1"
+        assert appm._wa_payload() is appm._wa_payload()        # parseado una sola vez
+    with appm.app.test_request_context("/webhook/whatsapp", method="POST", data=b"no-json"):
+        assert appm._pelu_rate_scope("whatsapp_receive") == "pelu:unknown"
+
+
+def test_firma_invalida_no_toca_el_limiter(appm, monkeypatch):
+    # conftest sustituye la vista del webhook: se invoca el handler decorado directamente
+    espia = _LimiterEspia()
+    monkeypatch.setattr(appm.limiter, "_limiter", espia)
+    monkeypatch.setattr(appm.settings, "WABA_APP_SECRET", "S")
+    monkeypatch.setattr(appm, "get_peluqueria_by_wa_phone_number_id", lambda pnid: None)
+    body = _body()
+
+    with appm.app.test_request_context("/webhook/whatsapp", method="POST", data=body,
+                                       headers={"X-Hub-Signature-256": "sha256=00"}):
+        assert appm.whatsapp_receive() == ("", 403)
+    assert espia.calls == []
+
+    sig = "sha256=" + hmac.new(b"S", body, hashlib.sha256).hexdigest()
+    with appm.app.test_request_context("/webhook/whatsapp", method="POST", data=body,
+                                       headers={"X-Hub-Signature-256": sig}):
+        appm.whatsapp_receive()
+    assert len(espia.calls) == 1 and "wa:PN1" in espia.calls[0]